@@ -0,0 +1,272 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+import posixpath
+from glob import glob
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Union, List
+
+from macroeconomy.excel_utils import sheet_parts, WorkbookIndex, CHUNK_SIZE
+
+LOGGER = logging.getLogger(__name__)
+
+# What Dynare generates when it preprocesses and compiles the model, relative to the model directory.
+# This is everything we need to skip preprocessing next time. Results from the last run are left out
+DYNARE_CACHED_OUTPUTS = [
+    'DGE_CRED_Model',
+    '+DGE_CRED_Model',
+    'DGE_CRED_Model.m',
+    'DGE_CRED_Model_*.m',
+]
+DYNARE_IGNORED_OUTPUTS = ['*_results.mat', '*.log']
+
+# Written into a model directory to record which model the Dynare output there was generated from
+FINGERPRINT_FILE = '.cred_dynare_fingerprint'
+
+# Model code that goes into a result cache key, relative to the model directory.
+# Files Dynare generates are left out: they follow from the .mod files and change as runs happen
+RESULT_CACHE_MODEL_FILES = ['**/*.mod', '**/*.m']
+
+
+def hash_files(filepaths, hasher=None):
+    hasher = hasher if hasher else hashlib.sha256()
+    for filepath in filepaths:
+        hasher.update(Path(filepath).name.encode())
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _hash_part(zf: zipfile.ZipFile, name: str, hasher):
+    with zf.open(name) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+
+
+class DynareCache():
+    # A store of preprocessed and compiled Dynare models, keyed by a hash of the model's .mod files.
+    #
+    # Dynare regenerates the model every time RunSimulations() calls it, even though in an ensemble
+    # only the input data changes between runs. When a MacroEconomyCRED has a DynareCache it
+    # - fingerprints the rendered .mod files after _setup,
+    # - restores the matching generated model into the model directory if it isn't there already
+    #   (e.g. in a fresh CREDWorkspace),
+    # - has RunSimulations.m run the generated driver instead of calling dynare whenever the marker
+    #   file says the generated model is current (see cred_config.CachedDynareModel),
+    # - stores the generated model after a successful run if it's new.
+    #
+    # The marker file is only left in the model directory while the generated model there matches
+    # the fingerprint, so a changed model is always preprocessed again.
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(cred_location: Union[str, Path]):
+        mod_files = sorted(glob(str(Path(cred_location, '**', '*.mod')), recursive=True))
+        if len(mod_files) == 0:
+            raise FileNotFoundError(f'No .mod files found in {cred_location}')
+        return hash_files(mod_files)
+
+    def path(self, fingerprint: str):
+        return Path(self.cache_dir, fingerprint)
+
+    def contains(self, fingerprint: str):
+        return os.path.isdir(self.path(fingerprint))
+
+    @staticmethod
+    def current_fingerprint(cred_location: Union[str, Path]):
+        # The fingerprint of the model that the Dynare output in this directory was generated from, if any
+        marker = Path(cred_location, FINGERPRINT_FILE)
+        if not os.path.exists(marker):
+            return None
+        return marker.read_text().strip()
+
+    def restore(self, cred_location: Union[str, Path], fingerprint: str):
+        # Put the generated model matching this fingerprint into the model directory.
+        # Returns True if the model directory now has a generated model to reuse
+        if self.current_fingerprint(cred_location) == fingerprint:
+            return True
+        if not self.contains(fingerprint):
+            # Whatever Dynare generated here is for another model: make the next run preprocess again
+            Path(cred_location, FINGERPRINT_FILE).unlink(missing_ok=True)
+            return False
+        LOGGER.debug(f'Restoring cached Dynare model {fingerprint[:12]} into {cred_location}')
+        self._remove_outputs(cred_location)
+        self._copy_outputs(self.path(fingerprint), cred_location)
+        Path(cred_location, FINGERPRINT_FILE).write_text(fingerprint)
+        return True
+
+    def store(self, cred_location: Union[str, Path], fingerprint: str):
+        # Call after a successful run: the Dynare output in the model directory was generated from this fingerprint
+        Path(cred_location, FINGERPRINT_FILE).write_text(fingerprint)
+        if self.contains(fingerprint):
+            return
+        LOGGER.debug(f'Caching Dynare model {fingerprint[:12]}')
+        # Copy to a temporary directory and rename it into place, so that parallel runs never see a half-written entry
+        tmp_dir = tempfile.mkdtemp(prefix='.incomplete_', dir=self.cache_dir)
+        self._copy_outputs(cred_location, tmp_dir)
+        try:
+            os.rename(tmp_dir, self.path(fingerprint))
+        except OSError:
+            # Another run stored the same model first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _outputs(directory):
+        return [p for pattern in DYNARE_CACHED_OUTPUTS for p in glob(str(Path(directory, pattern)))]
+
+    def _remove_outputs(self, directory):
+        for path in self._outputs(directory):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def _copy_outputs(self, source, destination):
+        for path in self._outputs(source):
+            target = Path(destination, Path(path).name)
+            if os.path.isdir(path):
+                shutil.copytree(path, target, ignore=shutil.ignore_patterns(*DYNARE_IGNORED_OUTPUTS))
+            else:
+                shutil.copy2(path, target)
+
+
+class CREDResultCache():
+    # A store of CRED outputs keyed by everything that determines them, so that a run whose inputs
+    # and setup we've seen before is served from the cache without launching the engine. In an
+    # ensemble many sampled futures have no events and so produce identical inputs.
+    #
+    # The key is a hash of
+    # - the input workbook in the model directory, as it will be run,
+    #   compared by its sheets' XML rather than by file name or bytes (see hash_workbook),
+    # - the run's configuration (see config()),
+    # - the model code in the model directory, after _setup has written the settings into it.
+    #
+    # Pass one to MacroEconomyCRED as result_cache. It's checked after _setup, and successful
+    # runs are added to it in _teardown.
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def config(cred):
+        return dict(
+            engine=cred.engine.name,
+            n_sectors=int(cred.n_sectors),
+            n_regions=int(cred.n_regions),
+            n_sim_years=int(cred.n_sim_years),
+            n_terminal_years=int(cred.n_terminal_years),
+            ForwardLooking=bool(cred.ForwardLooking),
+            Subsecstart=[int(i) for i in cred.Subsecstart],
+            Subsecend=[int(i) for i in cred.Subsecend],
+            scenarios=list(cred.scenarios),
+            exchange_format=cred.exchange_format,
+        )
+
+    def key(self, cred):
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps(self.config(cred), sort_keys=True).encode())
+        self.hash_workbook(cred.cred_input_excel, hasher)
+        hash_files(self.model_files(cred.cred_location), hasher)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def hash_workbook(path: Union[str, Path], hasher=None, exclude: List[str] = ()):
+        # Hash each sheet's XML and the shared strings the sheets refer to, straight from the xlsx package
+        # without parsing them. The workbook's other parts (e.g. document properties with the time it was
+        # saved) are left out, so two workbooks written with the same contents hash the same.
+        # exclude: sheets to leave out
+        hasher = hasher if hasher else hashlib.sha256()
+        with zipfile.ZipFile(path) as zf:
+            parts = sheet_parts(zf)
+            shared_strings = sorted(name for name in zf.namelist() if posixpath.basename(name) == 'sharedStrings.xml')
+            for name in sorted(set(parts).difference(exclude)):
+                hasher.update(name.encode())
+                _hash_part(zf, parts[name], hasher)
+            for name in shared_strings:
+                _hash_part(zf, name, hasher)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def model_files(cred_location: Union[str, Path]):
+        from macroeconomy.cred_workspace import DYNARE_OUTPUTS
+        from macroeconomy.cred_exchange import EXCHANGE_HOOKS
+        # The exchange hooks are installed by _setup and follow from the exchange_format in config()
+        hooks = {Path(cred_location, f) for f in EXCHANGE_HOOKS}
+        files = set()
+        for pattern in RESULT_CACHE_MODEL_FILES:
+            for path in glob(str(Path(cred_location, pattern)), recursive=True):
+                rel_parts = Path(path).relative_to(cred_location).parts
+                if any(fnmatch(part, generated) for part in rel_parts for generated in DYNARE_OUTPUTS):
+                    continue
+                if Path(path) in hooks:
+                    continue
+                files.add(path)
+        return sorted(files)
+
+    def path(self, key: str):
+        # Entries have no suffix: they're in the exchange format of the runs that made them, which is part of the key
+        return Path(self.cache_dir, key[:2], key)
+
+    def contains(self, key: str):
+        return os.path.exists(self.path(key))
+
+    def get(self, key: str, destination: Union[str, Path]):
+        # Copy the cached output to destination. Returns False if there isn't one
+        if not self.contains(key):
+            return False
+        shutil.copy2(self.path(key), destination)
+        return True
+
+    def put(self, key: str, output_excel: Union[str, Path]):
+        if self.contains(key):
+            return
+        os.makedirs(self.path(key).parent, exist_ok=True)
+        # Write to a temporary file and rename it into place, so that readers never see a partial copy
+        fd, tmp_path = tempfile.mkstemp(prefix='.incomplete_', dir=self.path(key).parent)
+        os.close(fd)
+        shutil.copy2(output_excel, tmp_path)
+        os.replace(tmp_path, self.path(key))
+
+
+class BaselineStore(CREDResultCache):
+    # Baseline outputs, reused across experiments. The baseline is the same computation for every
+    # experiment with a given template and setup, so CREDController only needs to solve it when
+    # this key changes.
+    #
+    # The key is a hash of the input's sheets other than its scenarios: the calibration (Content, Data,
+    # Start, Structural Parameters) and the Baseline, which are everything CRED reads to solve the
+    # baseline. Scenario sheets come after the Baseline in a CRED input, as in the template, and are
+    # left out. Also in the key are the run's configuration and the model code as _setup would render
+    # it. Unlike CREDResultCache.key it doesn't need the model directory to be set up first.
+
+    def key(self, cred):
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps(self.config(cred), sort_keys=True).encode())
+        self.hash_workbook(cred.user_input_excel, hasher, exclude=self.scenario_sheets(cred.user_input_excel))
+        rendered = cred.model_config().rendered(cred.cred_location)
+        for path in self.model_files(cred.cred_location):
+            path = Path(path)
+            hasher.update(path.relative_to(cred.cred_location).as_posix().encode())
+            hasher.update(rendered[path].encode() if path in rendered else path.read_bytes())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def scenario_sheets(input_excel: Union[str, Path]):
+        # The sheets after the Baseline
+        sheet_names = WorkbookIndex.get(input_excel).sheet_names
+        if 'Baseline' not in sheet_names:
+            raise ValueError(f'No Baseline sheet in the input at {input_excel}')
+        return sheet_names[sheet_names.index('Baseline') + 1:]
+
+    def path(self, key: str):
+        return Path(self.cache_dir, f'baseline_{key}')
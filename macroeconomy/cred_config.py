@@ -0,0 +1,270 @@
+import re
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Union, List
+
+from macroeconomy.cred_cache import FINGERPRINT_FILE
+
+LOGGER = logging.getLogger(__name__)
+
+# Marks the dynare call CachedDynareModel wrote, so that it can be found again
+CACHED_DYNARE_COMMENT = '% DynareCache: the generated model is current, so skip the preprocessor'
+
+# The model files MacroEconomyCRED configures, relative to the model directory
+RUNSIMULATIONS_FILE = 'RunSimulations.m'
+MOD_FILE = 'DGE_CRED_Model.mod'
+SIMULATION_MODEL_FILE = 'Functions/Simulation_Model.m'
+
+# A value as it can appear on the right of an assignment: an array, a cell array, a quoted string, or a number/word
+_VALUE_PATTERN = r"(\[[^\]\n]*\]|\{[^}\n]*\}|'[^'\n]*'|[-+\w.]+)"
+
+
+def format_value(value):
+    # Write a python value the way MATLAB and the Dynare macro processor expect to read it
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value))
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        values = list(value)
+        if any(isinstance(v, str) for v in values):
+            return '{' + ', '.join(format_value(v) for v in values) + '}'
+        return '[' + ', '.join(format_value(v) for v in values) + ']'
+    raise ValueError(f'Cannot write a value of type {type(value).__name__} into a CRED model file')
+
+
+class CREDSetting():
+    # One edit to the text of a model file. Subclasses implement apply(text) -> text.
+    # Settings with the same key in the same file replace each other
+
+    @property
+    def key(self):
+        raise NotImplementedError()
+
+    def apply(self, text: str):
+        raise NotImplementedError()
+
+
+class Assignment(CREDSetting):
+    # `name = value`, e.g. `options_.iStepSimulation = 40;` or `@# define ForwardLooking = 0`.
+    # Anything after the value on the line (e.g. a semicolon or comment) is kept.
+    # Raises ValueError if a required setting isn't in the file. Settings that aren't required are
+    # skipped quietly in model files that don't have them
+
+    def __init__(self, name: str, value, required: bool = True):
+        self.name = name
+        self.value = value
+        self.required = required
+
+    @property
+    def key(self):
+        return ('assignment', self.name)
+
+    def apply(self, text):
+        pattern = rf'^([^\n]*(?<![\w.]){re.escape(self.name)}\s*=\s*){_VALUE_PATTERN}'
+        new_value = format_value(self.value)
+        new_text, n = re.subn(pattern, lambda m: m.group(1) + new_value, text, flags=re.MULTILINE)
+        if n == 0 and self.required:
+            raise ValueError(f'Could not find "{self.name} = ..." in the model file to set it to {new_value}')
+        return new_text
+
+
+class LineArray(CREDSetting):
+    # Replace the [...] array on every line containing marker, e.g. `sSubsecstart = [1, 2, 4, 5];`
+
+    def __init__(self, marker: str, values: list):
+        self.marker = marker
+        self.values = values
+
+    @property
+    def key(self):
+        return ('line_array', self.marker)
+
+    def apply(self, text):
+        new_value = format_value(list(self.values))
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            if self.marker in line:
+                lines[i] = re.sub(r'\[.*\]', lambda m: new_value, line)
+        return ''.join(lines)
+
+
+class ScenarioNames(CREDSetting):
+    # The scenarios RunSimulations.m simulates. CRED lets the casScenarioNames specification span
+    # multiple lines, so we replace everything from its first line up to the next part of the file,
+    # which starts with 'Define sector'
+
+    def __init__(self, scenarios: List[str]):
+        self.scenarios = scenarios
+
+    @property
+    def key(self):
+        return ('scenarios',)
+
+    def apply(self, text):
+        out = []
+        keep_line = True
+        for line in text.splitlines(keepends=True):
+            if 'casScenarioNames = {' in line:
+                out.append('casScenarioNames = {' + ', '.join(format_value(str(s)) for s in self.scenarios) + '}\n\n')
+                keep_line = False
+            elif 'Define sector' in line:
+                out.append(line)
+                keep_line = True
+            elif keep_line:
+                out.append(line)
+        return ''.join(out)
+
+
+class DynareOptions(CREDSetting):
+    # Add options to the `dynare DGE_CRED_Model ...` call, e.g. 'nograph'
+
+    def __init__(self, options: List[str]):
+        self.options = options
+
+    @property
+    def key(self):
+        return ('dynare_options',)
+
+    def apply(self, text):
+        out = []
+        found = False
+        for line in text.splitlines(keepends=True):
+            match = re.match(r'^(\s*dynare\s+\S+)(.*?)(;?\s*)$', line, flags=re.DOTALL)
+            if match:
+                found = True
+                existing = match.group(2).split()
+                line = ' '.join([match.group(1)] + existing + [o for o in self.options if o not in existing]) + match.group(3)
+            out.append(line)
+        if not found:
+            LOGGER.warning(f'Could not find a dynare call to set the options {self.options}')
+        return ''.join(out)
+
+
+class CachedDynareModel(CREDSetting):
+    # Run the model with the driver Dynare generated last time, instead of calling dynare, when that
+    # generated code is current. Calling dynare always reruns the preprocessor, and in an ensemble only
+    # the input data changes between runs. The dynare call becomes
+    #
+    #   if exist('.cred_dynare_fingerprint', 'file')   % DynareCache: ...
+    #       dynare_config();
+    #       evalin('base', 'DGE_CRED_Model.driver');
+    #   else
+    #       dynare DGE_CRED_Model
+    #   end
+    #
+    # which is what dynare does after preprocessing. DynareCache keeps the marker file in the model
+    # directory only while the generated code there matches the .mod files. With enabled=False the
+    # plain dynare call is put back
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+
+    @property
+    def key(self):
+        return ('cached_dynare_model',)
+
+    def apply(self, text):
+        out = []
+        found = False
+        lines = text.splitlines(keepends=True)
+        i = 0
+        while i < len(lines):
+            if CACHED_DYNARE_COMMENT in lines[i]:
+                # Written by an earlier run: the dynare call is the fifth line of the block
+                indent = re.match(r'^\s*', lines[i]).group(0)
+                call = indent + lines[i + 4].lstrip(' \t')
+                ending = lines[i + 5][len(lines[i + 5].rstrip('\r\n')):]
+                call = call.rstrip('\r\n') + ending
+                i += 6
+            elif re.match(r'^\s*dynare\s+\S+', lines[i]):
+                call = lines[i]
+                i += 1
+            else:
+                out.append(lines[i])
+                i += 1
+                continue
+            found = True
+            out.append(self._block(call) if self.enabled else call)
+        if not found and self.enabled:
+            LOGGER.warning('Could not find a dynare call to reuse the generated model in')
+        return ''.join(out)
+
+    @staticmethod
+    def _block(call):
+        indent = re.match(r'^\s*', call).group(0)
+        body = call.strip()
+        ending = call[len(call.rstrip('\r\n')):]
+        newline = ending if ending else '\n'
+        model = re.match(r'^dynare\s+([^\s;,]+)', body).group(1)
+        block = [
+            f"if exist('{FINGERPRINT_FILE}', 'file')   {CACHED_DYNARE_COMMENT}",
+            '    dynare_config();',
+            f"    evalin('base', '{model}.driver');",
+            'else',
+            f'    {body}',
+            'end',
+        ]
+        return newline.join(indent + line for line in block) + ending
+
+
+class CREDConfig():
+    # Everything to be written into the model files before a run, grouped by file.
+    #
+    # render() reads each file once, applies all of its settings in memory and writes it once,
+    # and only if the result differs from what's on disk. Unchanged files keep their modification
+    # times, which MATLAB, Dynare and DynareCache all pay attention to.
+
+    def __init__(self):
+        self.settings = {}   # file relative to the model directory -> {setting key: setting}
+
+    def add(self, filename: str, setting: CREDSetting):
+        self.settings.setdefault(filename, {})[setting.key] = setting
+        return self
+
+    def render(self, cred_location: Union[str, Path]):
+        # Returns the files that were rewritten
+        written = []
+        for filename in self.settings:
+            path = Path(cred_location, filename)
+            if self.render_file(path, self.settings[filename].values()):
+                written.append(path)
+        return written
+
+    def rendered(self, cred_location: Union[str, Path]):
+        # What render() would write, without writing it: {path: text}
+        out = {}
+        for filename, settings in self.settings.items():
+            path = Path(cred_location, filename)
+            out[path] = self._apply(self._read(path), settings.values(), path)
+        return out
+
+    @staticmethod
+    def _read(path):
+        # newline='' keeps the file's own line endings, so an unchanged file renders byte-identical
+        with open(path, 'r', newline='') as f:
+            return f.read()
+
+    @staticmethod
+    def _apply(text, settings, path=None):
+        for setting in settings:
+            try:
+                text = setting.apply(text)
+            except ValueError as e:
+                raise ValueError(f'{path}: {e}') from e
+        return text
+
+    @staticmethod
+    def render_file(path: Union[str, Path], settings):
+        text = CREDConfig._read(path)
+        new_text = CREDConfig._apply(text, settings, path)
+        if new_text == text:
+            return False
+        with open(path, 'w', newline='') as f:
+            f.write(new_text)
+        return True
@@ -1,6 +1,9 @@
 import os
 import sys
+import shutil
+import asyncio
 import logging
+import tempfile
 import pandas as pd
 import numpy as np
 from typing import Union, List, Optional
@@ -8,12 +11,18 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 
-from climada.engine import Impact
-from climada.entity import MeasureSet
-
 from macroeconomy.cred_model import MacroEconomyCRED
-from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_engine import MatlabEngine
+from macroeconomy.cred_input import CREDInput, CREDInputTemplate
 from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_session import CREDSessionPool
+from macroeconomy.cred_workspace import CREDWorkspacePool
+from macroeconomy.cred_cache import BaselineStore
+from macroeconomy.cred_ensemble_store import CREDEnsembleStore
+from macroeconomy.cred_timing import PhaseTimer, timing_table, write_timing_report
+from macroeconomy.cred_statistics import DEFAULT_QUANTILES, EnsembleAccumulator, ensemble_statistics, tidy_statistics
+from macroeconomy.cred_exchange import EXCHANGE_FORMATS, exchange_path
+from macroeconomy.cred_executor import CREDRunResult, run_cred_task, run_cred_task_async, run_cred_batch_task, run_cred_tasks_in_parallel
 
 LOGGER = logging.getLogger(__name__)
 if len(LOGGER.handlers) == 0:
@@ -24,6 +33,15 @@ if len(LOGGER.handlers) == 0:
     LOGGER.addHandler(handler)
 
 
+def _import_climada_impact():
+    # climada is only needed to turn results into impacts, so running and analysing experiments works without it
+    try:
+        from climada.engine import Impact
+        return Impact
+    except ImportError as e:
+        raise ImportError('Converting CRED results to impacts needs climada. Install it to use as_impact') from e
+
+
 class CREDController():
     # Class to organise and execute an ensemble of CRED simulations
     # TODO And to explore the inputs and outputs until we split these into separate classes
@@ -35,109 +53,488 @@ class CREDController():
         output_dir: Union[str, Path] = None,
         scenario = 'Scenario',
         seed: int = None,
+        baseline_store: BaselineStore = None,
+        ensemble_store: CREDEnsembleStore = None,
         ):
         # Input folder is a location where DGE-CRED model inputs are stored, minus the ones that come from CLIMADA
         # impact_list is a list of paths/pathlikes to climada impact objects or a list of impact objects
+        # baseline_store: reuse baseline runs from previous experiments with the same template and setup
+        # ensemble_store: add each run's results to this store as the run finishes, for fast analysis
         np.random.seed == seed
         self.cred_template = cred_template
         # self.experiment_name = experiment_name
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.scenario = scenario
+        self.baseline_store = baseline_store
+        self.ensemble_store = ensemble_store
+        self.input_template = None
         if self.input_dir == self.output_dir:
             raise ValueError('input dir must be different from output dir')
         if self.input_dir:
-            self.example_input = CREDInput(Path(self.input_dir, os.listdir(self.input_dir)[0]), scenarios=[self.scenario])
-            self.output_var_lookup = CREDOutput.get_output_var_lookup(self.example_input.sectors)
-            self.input_var_lookup = CREDInput.get_input_var_lookup(self.example_input.sectors)
+            # Every input in an experiment is made from the same template, so its Baseline and sectors are read once
+            example_input_path = Path(self.input_dir, sorted(os.listdir(self.input_dir))[0])
+            self.input_template = CREDInputTemplate.get(example_input_path)
+            self.example_input = CREDInput(example_input_path, scenarios=[self.scenario], template=self.input_template)
+            self.output_var_lookup = CREDOutput.get_output_var_lookup(self.input_template.sectors)
+            self.input_var_lookup = self.input_template.input_var_lookup
         self.processed_inputs = None
         self.processed_outputs = None
-
-
-    def run_experiment(self, overwrite_existing=False):
+        self.output_statistics = None
+        self.output_accumulator = None
+        self._processed_outputs_key = None
+        self._ingested = {}              # input file name -> (output size and mtime, (variable, year) array)
+        self._ingested_key = None        # the variables and baseline the ingested runs were read for
+        self._ingested_baseline = None   # (years, (variable, year) array)
+        self.run_results = None
+        # Where the time went in the last experiment outside the runs themselves, e.g. the baseline
+        self.experiment_timer = PhaseTimer()
+
+
+    def run_experiment(
+        self,
+        overwrite_existing=False,
+        session_pool: CREDSessionPool = None,
+        persistent_session=False,
+        max_workers: int = 1,
+        scratch_dir: Union[str, Path] = None,
+        batch_size: int = 1
+    ):
+        # session_pool: send every run in the experiment through these warm MATLAB sessions
+        # persistent_session: create a warm session for the duration of this experiment (one per worker)
+        # max_workers: run this many models at once, each in its own clone of the CRED directory (see CREDWorkspace)
+        # scratch_dir: where to create the clones, e.g. a tmpfs like /dev/shm. Defaults to the system temp directory
+        # batch_size: simulate this many inputs per model run, as sheets Scenario_001, Scenario_002, ... of one
+        #   combined input (see run_cred_batch_task). Outputs are still written one per input
+        #
+        # Returns a list of CREDRunResults, one per input file, in the same order as the input files
         if not self.cred_template:
             raise ValueError('A cred_template must be provided when the CREDController is created if you wish to run the experiment')
         if not self.input_dir:
             raise ValueError('An input_dir must be provided when the CREDController is created if you wish to run the experiment')
         if not self.output_dir:
             raise ValueError('An output_dir must be provided when the CREDController is created if you wish to run the experiment')
-
-        input_file_list = os.listdir(self.input_dir)
-        output_file_list = [Path(self.output_dir, f) for f in input_file_list]
+        if max_workers > 1 and session_pool:
+            raise ValueError('A session_pool can only be used with max_workers = 1. Use persistent_session=True to give each worker its own session')
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        # Sessions are started with MATLAB's command line: with any other engine they'd run the wrong program
+        if (persistent_session or session_pool) and not isinstance(self.cred_template.engine, MatlabEngine):
+            raise ValueError(f'Persistent sessions are only available with the MATLAB engine, not {self.cred_template.engine.name}')
+
+        own_session_pool = None
+        if persistent_session and not session_pool and max_workers == 1:
+            own_session_pool = CREDSessionPool(n_sessions=1, executable=self.cred_template.executable)
+            session_pool = own_session_pool
+
+        self.experiment_timer = PhaseTimer()
+        try:
+            with self.experiment_timer.phase('experiment'):
+                self.run_results = self._run_experiment(overwrite_existing, session_pool, persistent_session, max_workers, scratch_dir, batch_size)
+        finally:
+            if own_session_pool:
+                own_session_pool.close()
+        return self.run_results
+
+
+    def _run_experiment(self, overwrite_existing, session_pool, persistent_session, max_workers, scratch_dir, batch_size):
+        input_file_list = sorted(os.listdir(self.input_dir))
         n_runs = len(input_file_list)
 
-        LOGGER.info('Running baseline')
-        input_excel = Path(self.input_dir, input_file_list[0])
-        output_excel = Path(self.output_dir, 'baseline.xlsx')
-        # We'll alway run the baseline because we need to regenerate it if the previous CRED run wasn't with the same setup
-        # TODO find out how to test for this
-        cred = self.cred_instance_from_template(input_excel, output_excel, ['Baseline'])
-        cred.timeout = None
-        cred.run()
+        with self.experiment_timer.phase('baseline'):
+            self._run_baseline(Path(self.input_dir, input_file_list[0]), session_pool=session_pool)
 
+        results = [None] * n_runs
+        tasks, task_indices = [], []
         for i, f in enumerate(input_file_list):
-            LOGGER.info(f'CRED model run {i} of {n_runs}')
             input_excel = Path(self.input_dir, f)
-            output_excel = Path(self.output_dir, f)
+            output_excel = self.output_path(f)
             if os.path.exists(output_excel) and not overwrite_existing:
-                LOGGER.info(f'...output already exists and overwrite_existing = False. Skipping.')
+                LOGGER.info(f'Output for model run {i} already exists and overwrite_existing = False. Skipping.')
+                results[i] = CREDRunResult(input_excel, output_excel, 'skipped')
+                self.store_result(results[i])
                 continue
-            cred = self.cred_instance_from_template(input_excel, output_excel, [self.scenario])
+            tasks.append((input_excel, output_excel, [self.scenario]))
+            task_indices.append(i)
+
+        cred_kwargs = self.cred_template.template_kwargs()
+        if batch_size > 1:
+            if scratch_dir:
+                os.makedirs(scratch_dir, exist_ok=True)
+            batch_dir = tempfile.mkdtemp(prefix='cred_batches_', dir=scratch_dir)
+            batch_tasks = [
+                ([(input_excel, output_excel) for input_excel, output_excel, _ in tasks[k:k + batch_size]], self.scenario, batch_dir)
+                for k in range(0, len(tasks), batch_size)
+            ]
+            LOGGER.info(f'Running {len(tasks)} models in {len(batch_tasks)} batches of up to {batch_size}')
             try:
-                cred.run()
-            except FileNotFoundError as e:
-                LOGGER.info(f'Model run {i} failed and did not produce output: {e}.')
-        
-        return output_file_list
+                with self.experiment_timer.phase('runs'):
+                    batch_results = self._run_tasks(run_cred_batch_task, cred_kwargs, batch_tasks, session_pool, persistent_session, max_workers, scratch_dir)
+            finally:
+                shutil.rmtree(batch_dir, ignore_errors=True)
+            task_results = [result for batch in batch_results for result in batch]
+        else:
+            with self.experiment_timer.phase('runs'):
+                task_results = self._run_tasks(run_cred_task, cred_kwargs, tasks, session_pool, persistent_session, max_workers, scratch_dir)
+
+        for i, result in zip(task_indices, task_results):
+            results[i] = result
+        n_failed = sum([r.status == 'failed' for r in results])
+        if n_failed > 0:
+            LOGGER.warning(f'{n_failed} of {n_runs} model runs failed')
+        kill_reasons = pd.Series([r.kill_reason for r in results if r.kill_reason], dtype=object)
+        if kill_reasons.size > 0:
+            LOGGER.warning(f'{kill_reasons.size} model runs were killed: {kill_reasons.value_counts().to_dict()}')
+        return results
     
 
-    def cred_instance_from_template(self, input_excel, output_excel, scenarios):
+    async def run_experiment_async(self, overwrite_existing=False, concurrency: int = 1, scratch_dir: Union[str, Path] = None):
+        # The asyncio version of run_experiment: up to `concurrency` models run at once as asyncio
+        # subprocesses, each in its own CREDWorkspace (created in scratch_dir), all driven by the
+        # calling event loop. Cancelling it kills the runs in progress.
+        #
+        # Returns a list of CREDRunResults, one per input file, in the same order as the input files.
+        # Use iter_experiment_async to handle results as they finish
+        input_file_list = sorted(os.listdir(self.input_dir)) if self.input_dir else []
+        results = {}
+        self.experiment_timer = PhaseTimer()
+        with self.experiment_timer.phase('experiment'):
+            async for result in self.iter_experiment_async(overwrite_existing, concurrency, scratch_dir):
+                results[Path(result.input_excel).name] = result
+        self.run_results = [results[f] for f in input_file_list]
+        return self.run_results
+
+
+    async def iter_experiment_async(self, overwrite_existing=False, concurrency: int = 1, scratch_dir: Union[str, Path] = None):
+        # Run the experiment, yielding each model's CREDRunResult as soon as it finishes
+        if not self.cred_template:
+            raise ValueError('A cred_template must be provided when the CREDController is created if you wish to run the experiment')
+        if not self.input_dir:
+            raise ValueError('An input_dir must be provided when the CREDController is created if you wish to run the experiment')
+        if not self.output_dir:
+            raise ValueError('An output_dir must be provided when the CREDController is created if you wish to run the experiment')
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        input_file_list = sorted(os.listdir(self.input_dir))
+        with self.experiment_timer.phase('baseline'):
+            await self._run_baseline_async(Path(self.input_dir, input_file_list[0]))
+
+        tasks = []
+        for f in input_file_list:
+            input_excel, output_excel = Path(self.input_dir, f), self.output_path(f)
+            if os.path.exists(output_excel) and not overwrite_existing:
+                result = CREDRunResult(input_excel, output_excel, 'skipped')
+                await asyncio.to_thread(self.store_result, result)
+                yield result
+                continue
+            tasks.append((input_excel, output_excel, [self.scenario]))
+
+        cred_kwargs = self.cred_template.template_kwargs()
+        # Concurrent runs each get a private copy of the model directory. Workspaces are handed out through an
+        # asyncio queue so that waiting for one doesn't block the event loop
+        workspace_pool = CREDWorkspacePool(concurrency, source_dir=self.cred_template.cred_location, scratch_dir=scratch_dir) if concurrency > 1 else None
+        workspaces = asyncio.Queue()
+        for workspace in (workspace_pool.workspaces if workspace_pool else [None]):
+            workspaces.put_nowait(workspace)
+
+        async def run_one(input_excel, output_excel, scenarios):
+            workspace = await workspaces.get()
+            try:
+                cred_location = await asyncio.to_thread(workspace.create) if workspace else None
+                return await run_cred_task_async(cred_kwargs, input_excel, output_excel, scenarios, cred_location=cred_location)
+            finally:
+                workspaces.put_nowait(workspace)
+
+        pending = [asyncio.ensure_future(run_one(*task)) for task in tasks]
+        try:
+            for n_done, future in enumerate(asyncio.as_completed(pending)):
+                result = await future
+                LOGGER.info(f'Finished CRED model run {n_done + 1} of {len(tasks)}: {result}')
+                await asyncio.to_thread(self.store_result, result)
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if workspace_pool:
+                workspace_pool.cleanup()
+
+
+    def _baseline_instance(self, input_excel, session_pool=None):
+        # The baseline is run in the template's model directory, without a timeout. Without a baseline_store
+        # we always run it because we need to regenerate it if the previous CRED run wasn't with the same setup.
+        # Returns the MacroEconomyCRED and, if we have a store, its key there
+        cred = self.cred_instance_from_template(input_excel, self.output_path('baseline.xlsx'), ['Baseline'], session_pool=session_pool)
+        cred.timeout = None
+        key = self.baseline_store.key(cred) if self.baseline_store else None
+        return cred, key
+
+
+    def _run_baseline(self, input_excel, session_pool=None):
+        cred, key = self._baseline_instance(input_excel, session_pool)
+        if key and self.baseline_store.get(key, cred.user_output_path):
+            LOGGER.info('Reusing the stored baseline for this template and setup')
+            return
+        LOGGER.info('Running baseline')
+        cred.run()
+        if key:
+            self.baseline_store.put(key, cred.user_output_path)
+
+
+    async def _run_baseline_async(self, input_excel):
+        cred, key = await asyncio.to_thread(self._baseline_instance, input_excel)
+        if key and await asyncio.to_thread(self.baseline_store.get, key, cred.user_output_path):
+            LOGGER.info('Reusing the stored baseline for this template and setup')
+            return
+        LOGGER.info('Running baseline')
+        await cred.run_async()
+        if key:
+            await asyncio.to_thread(self.baseline_store.put, key, cred.user_output_path)
+
+
+    def _run_tasks(self, task_function, cred_kwargs, tasks, session_pool, persistent_session, max_workers, scratch_dir):
+        if max_workers > 1:
+            LOGGER.info(f'Running {len(tasks)} model runs on {max_workers} workers')
+            return run_cred_tasks_in_parallel(
+                cred_kwargs,
+                tasks,
+                max_workers=max_workers,
+                scratch_dir=scratch_dir,
+                persistent_session=persistent_session,
+                executable=self.cred_template.executable,
+                task_function=task_function,
+                on_result=self.store_result
+            )
+        results = []
+        session_pool = session_pool if session_pool else self.cred_template.session_pool
+        for i, task in enumerate(tasks):
+            LOGGER.info(f'CRED model run {i + 1} of {len(tasks)}')
+            results.append(task_function(cred_kwargs, *task, session_pool=session_pool))
+            self.store_result(results[-1])
+        return results
+
+
+    def timing_report(self, path: Union[str, Path] = None):
+        # Where the time went in the last experiment: a dataframe with a row per run that went through the model
+        # (not skipped) and a column per phase of the run, in seconds (see cred_timing.PhaseTimer). Runs in a batch
+        # each get an equal share of the batch's time.
+        # path: also write the report there, as .json (with a summary per phase and the experiment's own timings,
+        # e.g. the baseline) or .csv
+        if not self.run_results:
+            raise ValueError('There are no run results to report on. Run an experiment first')
+        table = timing_table({Path(r.input_excel).name: r.timings for r in self.run_results if r.timings})
+        if path:
+            write_timing_report(path, table, self.experiment_timer.timings)
+        return table
+
+
+    def store_result(self, result: Union[CREDRunResult, List[CREDRunResult]]):
+        # Add a finished run's output (or a batch's outputs) to the ensemble store, if we have one.
+        # Runs are stored under their input file's name, with their output's stamp (see _file_stamp). Skipped
+        # runs are added if the store doesn't have their output as it is now
+        if self.ensemble_store is None:
+            return
+        for r in (result if isinstance(result, list) else [result]):
+            name = Path(r.input_excel).name
+            stamp = self._file_stamp(r.output_excel)
+            if r.status == 'skipped':
+                if name in self.ensemble_store and self.ensemble_store.source_stamp(name) == stamp:
+                    continue
+            elif not r.succeeded:
+                continue
+            try:
+                n_sim_years = self.cred_template.n_sim_years if self.cred_template else None
+                output = CREDOutput(r.input_excel, r.output_excel, [self.scenario], n_sim_years=n_sim_years, template=self.input_template)
+                self.ensemble_store.append(name, output.data[self.scenario], stamp=stamp)
+            except Exception as e:
+                LOGGER.warning(f'Could not add the output of {name} to the ensemble store: {e}')
+
+
+    def update_ensemble_store(self):
+        # Add every output in output_dir that the ensemble store doesn't have yet or has an older version of,
+        # e.g. from earlier experiments
+        if self.ensemble_store is None:
+            raise ValueError('The CREDController has no ensemble_store to update')
+        for f in sorted(os.listdir(self.input_dir)):
+            output_excel = self.output_path(f)
+            if os.path.exists(output_excel):
+                self.store_result(CREDRunResult(Path(self.input_dir, f), output_excel, 'skipped'))
+        return self.ensemble_store
+
+
+    def cred_instance_from_template(self, input_excel, output_excel, scenarios, session_pool=None):
         return MacroEconomyCRED(
             input_excel=input_excel,
             output_excel=output_excel,
-            n_sim_years=self.cred_template.n_sim_years,
-            n_sectors=self.cred_template.n_sectors,
-            n_regions=self.cred_template.n_regions,
             scenarios=scenarios,
-            ForwardLooking=self.cred_template.ForwardLooking,
-            Subsecstart=self.cred_template.Subsecstart,
-            Subsecend=self.cred_template.Subsecend,
-            timeout=self.cred_template.timeout
+            session_pool=session_pool if session_pool else self.cred_template.session_pool,
+            **self.cred_template.template_kwargs()
         )
 
 
+    def output_path(self, filename):
+        # Where the output for an input file (or the baseline) goes: its name in the output directory, in the
+        # template's exchange format. Without a template, whichever format is already there
+        path = Path(self.output_dir, filename)
+        if self.cred_template:
+            return exchange_path(path, self.cred_template.exchange_format)
+        for exchange_format in EXCHANGE_FORMATS:
+            if os.path.exists(exchange_path(path, exchange_format)):
+                return exchange_path(path, exchange_format)
+        return path
+
+
     # TODO make a class to hold lists of outputs and calculations for them
-    def load_all_outputs(self):
-        infiles = os.listdir(self.input_dir)
-        infiles = [Path(self.input_dir, f) for f in infiles]
-        outfiles = os.listdir(self.output_dir)
-        outfiles = [Path(self.output_dir, f) for f in outfiles if f!= 'baseline.xlsx']
-        baseline = CREDOutput(infiles[0], Path(self.output_dir, 'baseline.xlsx'), ['Baseline'])
-        return baseline, [CREDOutput(inf, outf, [self.scenario]) for inf, outf in zip(infiles, outfiles)]
+    def load_all_outputs(self, columns: List[str] = None):
+        # Each input's output has the input's name, so pair them by name rather than by directory listing.
+        # Outputs are read lazily (see CREDOutput); columns limits them to the variables you need
+        infiles = [Path(self.input_dir, f) for f in sorted(os.listdir(self.input_dir))]
+        outfiles = [self.output_path(f.name) for f in infiles]
+        # Outputs can include terminal years simulated past the period of interest
+        n_sim_years = self.cred_template.n_sim_years if self.cred_template else None
+        baseline = CREDOutput(infiles[0], self.output_path('baseline.xlsx'), ['Baseline'], n_sim_years=n_sim_years, columns=columns, template=self.input_template)
+        return baseline, [CREDOutput(inf, outf, [self.scenario], n_sim_years=n_sim_years, columns=columns, template=self.input_template) for inf, outf in zip(infiles, outfiles) if os.path.exists(outf)]
+
+
+    def process_outputs(self, quantiles: List[float] = DEFAULT_QUANTILES, cache: bool = True):
+        # Stack each output variable across the ensemble into one (variable, run, year) array and summarise it
+        # in one pass (see ensemble_statistics).
+        #
+        # Sets and returns processed_outputs: {label: dataframe indexed by Year with a column per run, 'mean' and
+        # 'Baseline'}, which plot uses. Also sets output_statistics: a long dataframe with the mean, std, median,
+        # the given quantiles and the baseline for every variable and year, and their difference from the
+        # baseline (see tidy_statistics).
+        #
+        # Outputs are ingested incrementally: a call only reads the outputs that are new or have changed since the
+        # last one (see ingest_outputs), so it's cheap to call repeatedly to monitor a running experiment.
+        # cache: don't recompute the statistics if no outputs have changed and the quantiles are the same
+        labels, variables = list(self.output_var_lookup.keys()), list(self.output_var_lookup.values())
+        changed = self.ingest_outputs(variables)
+        key = tuple(quantiles)
+        if cache and not changed and self.processed_outputs is not None and self._processed_outputs_key == key:
+            return self.processed_outputs
+
+        years, baseline = self._ingested_baseline
+        runs = list(self._ingested)
+        if runs:
+            cube = np.stack([self._ingested[f][1] for f in runs], axis=1)
+        else:
+            cube = np.empty((len(variables), 0, len(years)))
+        names = [self.output_path(f).name for f in runs]
+        stats = ensemble_statistics(cube, baseline, quantiles)
+        index = pd.Index(years, name='Year')
+        self.processed_outputs = {
+            label: pd.DataFrame(
+                np.column_stack([cube[i].T, stats['mean'][i], baseline[i]]),
+                index=index,
+                columns=names + ['mean', 'Baseline']
+            )
+            for i, label in enumerate(labels)
+        }
+        self.output_statistics = tidy_statistics(stats, variables, years, labels)
+        self._processed_outputs_key = key
+        return self.processed_outputs
+
+
+    def ingest_outputs(self, variables: List[str]):
+        # Bring the results held for process_outputs up to date with output_dir: read the outputs that are new or
+        # whose size or modification time has changed, and forget the ones that have gone. Everything is re-read
+        # if the variables or the baseline's years change. Runs come from the ensemble store if it has them as
+        # their outputs are now (the same stamp), otherwise from the output files, and then the store is brought
+        # up to date. Outputs that can't be read yet, e.g. because they're still being written, are tried again
+        # next time.
+        # Returns True if anything changed
+        n_sim_years = self.cred_template.n_sim_years if self.cred_template else None
+        infiles = sorted(os.listdir(self.input_dir))
+        changed = False
+
+        baseline_path = self.output_path('baseline.xlsx')
+        ingested_key = (list(variables), self._file_stamp(baseline_path))
+        if self._ingested_key != ingested_key:
+            baseline = CREDOutput(Path(self.input_dir, infiles[0]), baseline_path, ['Baseline'], n_sim_years=n_sim_years, columns=variables, template=self.input_template)
+            baseline = baseline.data['Baseline'].set_index('Year').reindex(columns=variables)
+            years = baseline.index.to_numpy()
+            # Runs are aligned to the baseline's years, so they only need re-reading if those or the variables change
+            if self._ingested_key is None or self._ingested_key[0] != ingested_key[0] or not np.array_equal(years, self._ingested_baseline[0]):
+                self._ingested = {}
+            self._ingested_baseline = (years, baseline.to_numpy(dtype=float).T)
+            self._ingested_key = ingested_key
+            changed = True
+        years = self._ingested_baseline[0]
+
+        if self.ensemble_store is not None:
+            self.ensemble_store.refresh()
+        ingested = {}
+        for f in infiles:
+            output_path = self.output_path(f)
+            stamp = self._file_stamp(output_path)
+            if stamp is None:
+                continue
+            if f in self._ingested and self._ingested[f][0] == stamp:
+                ingested[f] = self._ingested[f]
+                continue
+            try:
+                if self.ensemble_store is not None and f in self.ensemble_store and self.ensemble_store.source_stamp(f) == stamp:
+                    data = self.ensemble_store.run(f)
+                elif self.ensemble_store is not None:
+                    # The store gets every variable, not just the ones asked for
+                    data = CREDOutput(Path(self.input_dir, f), output_path, [self.scenario], n_sim_years=n_sim_years, template=self.input_template).data[self.scenario]
+                    self.ensemble_store.append(f, data, stamp=stamp)
+                else:
+                    data = CREDOutput(Path(self.input_dir, f), output_path, [self.scenario], n_sim_years=n_sim_years, columns=variables, template=self.input_template).data[self.scenario]
+            except Exception as e:
+                LOGGER.debug(f'Could not read the output of {f} yet: {e}')
+                continue
+            ingested[f] = (stamp, data.set_index('Year').reindex(index=years, columns=variables).to_numpy(dtype=float).T)
+            changed = True
+        changed = changed or len(ingested) != len(self._ingested)
+        self._ingested = ingested
+        return changed
+
+
+    def iter_outputs(self, columns: List[str] = None):
+        # Each output's results in turn, as (input file name, dataframe), reading one output at a time
+        n_sim_years = self.cred_template.n_sim_years if self.cred_template else None
+        for f in sorted(os.listdir(self.input_dir)):
+            output_path = self.output_path(f)
+            if os.path.exists(output_path):
+                output = CREDOutput(Path(self.input_dir, f), output_path, [self.scenario], n_sim_years=n_sim_years, columns=columns, template=self.input_template)
+                yield f, output.data[self.scenario]
+
+
+    def stream_output_statistics(self, quantiles: List[float] = DEFAULT_QUANTILES, k: int = 200, seed: int = None):
+        # output_statistics (see process_outputs) in bounded memory, for ensembles too big to hold: each output is
+        # read, added to an EnsembleAccumulator and discarded. Quantiles are approximate (see KLLSketch; k sets the
+        # accuracy). The accumulator is kept as output_accumulator, so it can be merged with others'
+        labels, variables = list(self.output_var_lookup.keys()), list(self.output_var_lookup.values())
+        n_sim_years = self.cred_template.n_sim_years if self.cred_template else None
+        infiles = sorted(os.listdir(self.input_dir))
+        baseline = CREDOutput(Path(self.input_dir, infiles[0]), self.output_path('baseline.xlsx'), ['Baseline'], n_sim_years=n_sim_years, columns=variables, template=self.input_template)
+        baseline = baseline.data['Baseline'].set_index('Year').reindex(columns=variables)
+        years = baseline.index.to_numpy()
+        self.output_accumulator = EnsembleAccumulator(variables, years, k=k, seed=seed)
+        for _, data in self.iter_outputs(columns=variables):
+            self.output_accumulator.update(data)
+        stats = self.output_accumulator.statistics(baseline.to_numpy(dtype=float).T, quantiles)
+        self.output_statistics = tidy_statistics(stats, variables, years, labels)
+        return self.output_statistics
 
 
-    def process_outputs(self):
-        baseline, output_list = self.load_all_outputs()        
-        out = {}
-        for i, (labelvar, plotvar) in enumerate(self.output_var_lookup.items()):
-            df = pd.DataFrame()
-            for output in output_list:
-                name = Path(output.output_excel_path).name
-                df[name] = output.data[self.scenario][plotvar]
-            df['mean'] = df.mean(axis=1)
-            name = Path(baseline.output_excel_path).name
-            df['Baseline'] = baseline.data['Baseline'][plotvar]
-            df['Year'] = baseline.data['Baseline']['Year']
-            df.set_index('Year', inplace=True)
-            out[labelvar] = df
-        self.processed_outputs = out
-        return out
+    @staticmethod
+    def _file_stamp(path):
+        # Size and modification time of a file, to tell when it's changed. None if it doesn't exist
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
 
 
     def load_all_inputs(self):
         infiles = os.listdir(self.input_dir)
         infiles = [Path(self.input_dir, f) for f in infiles]
-        return [CREDInput(inf, scenarios=["Scenario"], set_impacts_to_zero=False) for inf in infiles]
+        return [CREDInput(inf, scenarios=["Scenario"], set_impacts_to_zero=False, template=self.input_template) for inf in infiles]
 
 
     def process_inputs(self):
@@ -283,6 +680,7 @@ class CREDController():
         var_future_list = [np.mean(self._subset_result_years(result, self.end_year - n_years_to_average + 1, self.end_year)[colname]) for result in results_list]
         var_delta_list = [fut - base for base, fut in zip(var_hist_list, var_future_list)]
         event_ids = [str(i) for i in range(self.n_simulations)]
+        Impact = _import_climada_impact()
         imp = Impact(
             event_id = event_ids,
             event_name = event_ids,
@@ -0,0 +1,264 @@
+import os
+import shutil
+import asyncio
+import logging
+import subprocess
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Union
+
+from macroeconomy.cred_watchdog import CREDWatchdog
+from macroeconomy.cred_exchange import read_sheets, write_sheets
+
+LOGGER = logging.getLogger(__name__)
+
+# The mock engine labels its output rows from this year
+MOCK_FIRST_YEAR = 2014
+
+
+class CREDEngine():
+    # The program that actually runs the CRED model.
+    #
+    # MacroEconomyCRED calls the three steps in order for every run:
+    # - prepare(cred): after the model files and input Excel have been set up
+    # - execute(cred): run the model. Raise subprocess.TimeoutExpired, CalledProcessError or CREDRunKilled on failure
+    # - collect(cred): after the run, before the output is copied to the user's location
+    #
+    # execute_async(cred) is the asyncio version of execute, used by MacroEconomyCRED.run_async.
+    # By default it runs execute in a thread. Engines that launch a process override it to use
+    # an asyncio subprocess, which is killed if the run is cancelled.
+    #
+    # Engines should hold only simple settings (paths, flags) so that they can be pickled and sent
+    # to worker processes in a parallel experiment.
+
+    name = None
+    executable = None
+
+    def check(self):
+        # Raise an error if this engine can't run on this machine
+        if self.executable and not os.path.exists(self.executable):
+            raise FileNotFoundError(f'Could not find the executable to run CRED with {self.name} at {self.executable}. Please check your setup in cred_model.py')
+
+    def command(self, cred):
+        return None
+
+    def prepare(self, cred):
+        pass
+
+    def execute(self, cred):
+        raise NotImplementedError()
+
+    async def execute_async(self, cred):
+        await asyncio.to_thread(self.execute, cred)
+
+    def collect(self, cred):
+        pass
+
+    @staticmethod
+    def run_command(cred, command):
+        # Run the engine in a one-off process. With a watchdog the process is sampled as it runs and
+        # killed, along with anything it started, if it times out, runs out of memory or stalls
+        if not cred.watchdog:
+            subprocess.run(command, shell=True, check=True, timeout=cred.timeout)
+            return
+        process = subprocess.Popen(command, shell=True, start_new_session=True)
+        returncode = cred.watchdog.watch(process, timeout=cred.timeout)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    @staticmethod
+    async def run_command_async(cred, command):
+        # As run_command, without blocking the event loop. The timeout is always enforced (as
+        # CREDRunKilled) and the process is killed, along with anything it started, on cancellation
+        watchdog = cred.watchdog if cred.watchdog else CREDWatchdog()
+        # Shielded so that if we're cancelled while the process starts, we still get it and can kill it
+        starting = asyncio.ensure_future(asyncio.create_subprocess_shell(command, start_new_session=True))
+        process = None
+        try:
+            process = await asyncio.shield(starting)
+            monitor = watchdog.monitor(process.pid, timeout=cred.timeout)
+            while True:
+                try:
+                    returncode = await asyncio.wait_for(process.wait(), timeout=watchdog.poll_interval)
+                    break
+                except asyncio.TimeoutError:
+                    monitor.check_or_kill()
+        except BaseException:
+            # Killed by the watchdog, or the run was cancelled
+            if process is None:
+                process = await starting
+            if process.returncode is None:
+                watchdog.monitor(process.pid).kill()
+                await process.wait()
+            raise
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.executable!r})' if self.executable else f'{self.__class__.__name__}()'
+
+
+class MatlabEngine(CREDEngine):
+    # Runs RunSimulations() in MATLAB: in a fresh process each time, or in a warm session if the
+    # MacroEconomyCRED object has a session_pool
+
+    name = 'matlab'
+
+    def __init__(self, executable: Union[str, Path] = None):
+        if executable is None:
+            from macroeconomy.cred_model import MATLAB_EXECUTABLE
+            executable = MATLAB_EXECUTABLE
+        self.executable = executable
+
+    def command(self, cred):
+        return f'''{self.executable} -nodisplay -nodesktop -r "try; cd('{cred.cred_location}'); RunSimulations(); catch; end; quit;"'''
+
+    def execute(self, cred):
+        if cred.session_pool:
+            cred.session_pool.run_simulations(cred.cred_location, timeout=cred.timeout, watchdog=cred.watchdog)
+        else:
+            self.run_command(cred, self.command(cred))
+
+    async def execute_async(self, cred):
+        if cred.session_pool:
+            # Sessions are synchronous: wait for one in a thread
+            await asyncio.to_thread(self.execute, cred)
+        else:
+            await self.run_command_async(cred, self.command(cred))
+
+
+class OctaveEngine(CREDEngine):
+    # Runs RunSimulations() with Octave in batch mode
+    # Note: CRED is developed against MATLAB and this hasn't been tested much
+
+    name = 'octave'
+
+    def __init__(self, executable: Union[str, Path] = None):
+        if executable is None:
+            from macroeconomy.cred_model import OCTAVE_EXECUTABLE
+            executable = OCTAVE_EXECUTABLE
+        self.executable = executable
+
+    def command(self, cred):
+        return f'''{self.executable} --no-gui --quiet --eval "try; cd('{cred.cred_location}'); RunSimulations(); catch err; disp(err.message); end"'''
+
+    def execute(self, cred):
+        if cred.session_pool:
+            raise ValueError('Persistent sessions are only available with the MATLAB engine')
+        self.run_command(cred, self.command(cred))
+
+    async def execute_async(self, cred):
+        if cred.session_pool:
+            raise ValueError('Persistent sessions are only available with the MATLAB engine')
+        await self.run_command_async(cred, self.command(cred))
+
+
+class MockEngine(CREDEngine):
+    # A fast, pure-python stand-in for CRED.
+    #
+    # Reads the scenario sheets from the input Excel in the model directory and writes a
+    # ResultsScenarios workbook with the same layout CRED produces: one sheet per scenario,
+    # with a Year column and the variables in CREDOutput.get_output_var_lookup. The numbers are
+    # a smooth growth path, knocked down by the sector and housing damages in the input, so
+    # they're plausible enough for testing plots and post-processing. They are not economics!
+    #
+    # Use it to test and profile the orchestration code (CREDController, Excel I/O,
+    # post-processing) without a MATLAB licence.
+
+    name = 'mock'
+
+    def __init__(self, growth_rate: float = 0.02):
+        self.growth_rate = growth_rate
+
+    def command(self, cred):
+        return f'MockEngine().execute() in {cred.cred_location}'
+
+    def execute(self, cred):
+        # Reads and writes the model's exchange files in whatever format the run uses, as CRED does
+        scenario_inputs = read_sheets(cred.cred_input_path, cred.scenarios)
+        results = {scenario: self.simulate(scenario_inputs[scenario], cred.n_sectors) for scenario in cred.scenarios}
+        write_sheets(cred.cred_output_path, results)
+
+    def simulate(self, scenario_input: pd.DataFrame, n_sectors: int):
+        n_years = scenario_input.shape[0]
+        t = np.arange(n_years)
+        trend = np.power(1 + self.growth_rate, t)
+
+        def shock(colname):
+            if colname in scenario_input:
+                return scenario_input[colname].fillna(0).to_numpy(dtype=float)
+            return np.zeros(n_years)
+
+        def persistent(damage, recovery=0.3):
+            # Damage to capital stocks decays away over a few years
+            out = np.zeros_like(damage)
+            for i, d in enumerate(damage):
+                out[i] = d + (out[i-1] * (1 - recovery) if i > 0 else 0)
+            return np.clip(out, 0, 1)
+
+        out = {'Year': MOCK_FIRST_YEAR + t}
+        total_output = np.zeros(n_years)
+        for i in range(1, n_sectors + 1):
+            capital_loss = persistent(shock(f'exo_D_{i}_1'))
+            productivity_loss = shock(f'exo_D_N_{i}_1') + shock(f'exo_D_K_{i}_1')
+            size = 100 / n_sectors
+            out[f'Y_{i}'] = size * trend * (1 - 0.3 * capital_loss) * (1 - 0.5 * productivity_loss)
+            out[f'N_{i}'] = 0.3 * (1 - 0.2 * shock(f'exo_D_N_{i}_1'))
+            out[f'K_{i}'] = 3 * size * trend * (1 - capital_loss)
+            out[f'P_D_{i}'] = 1 + 0.1 * capital_loss
+            out[f'Q_D_{i}'] = 0.8 * out[f'Y_{i}']
+            total_output += out[f'Y_{i}']
+        out['Y'] = total_output
+        out['H'] = 200 * trend * (1 - persistent(shock('exo_DH')))
+        out['C'] = 0.6 * total_output
+        out['PoP'] = np.cumprod(1 + shock('exo_PoP'))
+        out['BG'] = 0.4 * total_output
+        return pd.DataFrame(out)
+
+    @staticmethod
+    def make_model_directory(
+        path: Union[str, Path],
+        input_excel: Union[str, Path],
+        n_sectors: int = 5,
+        n_regions: int = 1,
+    ):
+        # Create a minimal CRED model directory that MacroEconomyCRED can set up and the MockEngine
+        # can run: the files _setup edits, plus the template input Excel
+        path = Path(path)
+        os.makedirs(Path(path, 'Functions'), exist_ok=True)
+        os.makedirs(Path(path, 'ExcelFiles'), exist_ok=True)
+        Path(path, 'RunSimulations.m').write_text(
+            "% Mock CRED model for testing\n"
+            "casScenarioNames = {'Baseline'}\n\n"
+            "% Define sectors\n"
+            "sSubsecstart = [1, 2, 4, 5];\n"
+            "sSubsecend = [1, 3, 4, 5];\n"
+            "sExchangeFormat = 'xlsx';\n"
+            "dynare DGE_CRED_Model\n"
+            "[mValues, casColumns] = CREDReadSheet(sInputFile, casScenarioNames{1});\n"
+            "CREDWriteSheet(sOutputFile, casScenarioNames{1}, mValues, casColumns);\n"
+        )
+        Path(path, 'DGE_CRED_Model.mod').write_text(
+            f"@# define Regions = {n_regions}\n"
+            "@# define ForwardLooking = 0\n"
+            "options_.iStepSimulation  = 40;\n"
+        )
+        Path(path, 'Functions', 'Simulation_Model.m').write_text("iDisplay = 40;\n")
+        shutil.copy2(input_excel, Path(path, 'ExcelFiles', f'ModelSimulationandCalibration{n_sectors}Sectorsand{n_regions}Regions.xlsx'))
+        return path
+
+
+ENGINES = {
+    'matlab': MatlabEngine,
+    'octave': OctaveEngine,
+    'mock': MockEngine,
+}
+
+
+def get_engine(engine: Union[str, CREDEngine]):
+    if isinstance(engine, CREDEngine):
+        return engine
+    if engine not in ENGINES:
+        raise ValueError(f"MacroEconomyCRED engine must be a CREDEngine or one of {list(ENGINES.keys())}")
+    return ENGINES[engine]()
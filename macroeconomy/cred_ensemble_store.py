@@ -0,0 +1,237 @@
+import os
+import json
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Union, List
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+
+class CREDEnsembleStore():
+    # The results of every run in an ensemble as one run x year x variable cube on disk, so that
+    # analyses read arrays instead of re-parsing thousands of output workbooks.
+    #
+    # The cube is split into chunks of chunk_size runs. Each chunk is a .npy file of float64 with
+    # shape (variable, run, year), so that one variable across the runs in a chunk is a contiguous
+    # block, and a JSON file with the names of the runs it holds so far and, for each, the stamp of
+    # the output it was read from (see source_stamp). index.json holds the years, the variables, the
+    # chunk size and the number of chunks.
+    #
+    # Runs are appended as they finish. A run's numbers are written before its name, so readers
+    # never see a half-written run. Appending a name that's already there overwrites that run.
+    # There should only be one writer at a time; CREDController appends from the main process.
+    #
+    # Readers memory-map the chunks, so reading one variable or one run only touches that slice.
+    #
+    # The years and variables are fixed when the store is created: from the first run appended,
+    # unless given. Later runs are matched to them by name; anything missing is NaN and variables
+    # the store doesn't have are dropped.
+
+    def __init__(
+        self,
+        store_dir: Union[str, Path],
+        years: List[int] = None,
+        variables: List[str] = None,
+        chunk_size: int = 256,
+    ):
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        self.store_dir = Path(store_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.years = [int(y) for y in years] if years is not None else None
+        self.variables = list(variables) if variables is not None else None
+        self.chunk_size = chunk_size
+        self._chunk_names = []   # the names of the runs in each chunk, in slot order
+        self._chunk_stamps = []  # the source stamps of the runs in each chunk, in slot order
+        self._slots = {}         # run name -> (chunk, slot)
+        self._chunks = {}        # chunk -> read-only memory map
+        if os.path.exists(self.index_path):
+            self._read_index(years, variables)
+
+    @property
+    def index_path(self):
+        return Path(self.store_dir, INDEX_FILE)
+
+    def chunk_path(self, chunk: int):
+        return Path(self.store_dir, f'chunk_{chunk:05d}.npy')
+
+    def chunk_names_path(self, chunk: int):
+        return Path(self.store_dir, f'chunk_{chunk:05d}.json')
+
+    @property
+    def names(self):
+        # Run names in the order they're stored
+        return [name for names in self._chunk_names for name in names]
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, name):
+        return name in self._slots
+
+    def __repr__(self):
+        n_variables = len(self.variables) if self.variables else 0
+        n_years = len(self.years) if self.years else 0
+        return f'CREDEnsembleStore({self.store_dir}: {len(self)} runs x {n_years} years x {n_variables} variables)'
+
+    # -------
+    # Writing
+    # -------
+
+    def append(self, name: str, data: pd.DataFrame, stamp: tuple = None):
+        # Add one run's results: a dataframe with a Year column and a column per variable,
+        # e.g. CREDOutput.data[scenario].
+        # stamp: anything JSON can hold that identifies the version of the output the results were read
+        # from, e.g. its size and modification time. Readers use it to tell when a run is out of date
+        if self.years is None or self.variables is None:
+            self._create(data)
+        values = self._values(data)
+        if name in self._slots:
+            chunk, slot = self._slots[name]
+        else:
+            if not self._chunk_names or len(self._chunk_names[-1]) == self.chunk_size:
+                self._new_chunk()
+            chunk, slot = len(self._chunk_names) - 1, len(self._chunk_names[-1])
+        cube = np.load(self.chunk_path(chunk), mmap_mode='r+')
+        cube[:, slot, :] = values
+        cube.flush()
+        del cube
+        stamp = list(stamp) if stamp is not None else None
+        if name not in self._slots:
+            self._chunk_names[chunk].append(name)
+            self._chunk_stamps[chunk].append(stamp)
+            self._slots[name] = (chunk, slot)
+        elif self._chunk_stamps[chunk][slot] == stamp:
+            return
+        else:
+            self._chunk_stamps[chunk][slot] = stamp
+        self._write_chunk_names(chunk)
+
+    def _create(self, data):
+        if self.years is None:
+            self.years = [int(y) for y in data['Year']]
+        if self.variables is None:
+            self.variables = [str(c) for c in data.columns if c != 'Year']
+        self._write_index()
+
+    def _values(self, data):
+        # (variable, year) array of a run's results in the store's layout
+        extra = [c for c in data.columns if c != 'Year' and c not in self.variables]
+        if extra:
+            LOGGER.debug(f'Ignoring variables that are not in the ensemble store: {extra}')
+        return data.set_index('Year').reindex(index=self.years, columns=self.variables).to_numpy(dtype=float).T
+
+    def _new_chunk(self):
+        chunk = len(self._chunk_names)
+        cube = np.lib.format.open_memmap(
+            self.chunk_path(chunk), mode='w+', dtype=np.float64,
+            shape=(len(self.variables), self.chunk_size, len(self.years))
+        )
+        cube[:] = np.nan
+        cube.flush()
+        del cube
+        self._chunk_names.append([])
+        self._chunk_stamps.append([])
+        self._write_chunk_names(chunk)
+        self._write_index()
+
+    def _write_chunk_names(self, chunk):
+        self._write_json(self.chunk_names_path(chunk), {'names': self._chunk_names[chunk], 'stamps': self._chunk_stamps[chunk]})
+
+    def _write_index(self):
+        self._write_json(self.index_path, {
+            'years': self.years,
+            'variables': self.variables,
+            'chunk_size': self.chunk_size,
+            'n_chunks': len(self._chunk_names),
+        })
+
+    def _write_json(self, path, content):
+        # Write to a temporary file and rename it into place, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(prefix='.incomplete_', suffix='.json', dir=self.store_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp_path, path)
+
+    def _read_index(self, years, variables):
+        with open(self.index_path) as f:
+            index = json.load(f)
+        if years is not None and self.years != index['years']:
+            raise ValueError(f'The ensemble store at {self.store_dir} has different years: {index["years"]}')
+        if variables is not None and self.variables != index['variables']:
+            raise ValueError(f'The ensemble store at {self.store_dir} has different variables: {index["variables"]}')
+        self.years = index['years']
+        self.variables = index['variables']
+        self.chunk_size = index['chunk_size']
+        for chunk in range(index['n_chunks']):
+            with open(self.chunk_names_path(chunk)) as f:
+                content = json.load(f)
+            # Stores written before stamps were kept have a plain list of names
+            names = content['names'] if isinstance(content, dict) else content
+            self._chunk_names.append(names)
+            self._chunk_stamps.append(content['stamps'] if isinstance(content, dict) else [None] * len(names))
+            for slot, name in enumerate(names):
+                self._slots[name] = (chunk, slot)
+
+    # -------
+    # Reading
+    # -------
+
+    def _chunk(self, chunk: int):
+        if chunk not in self._chunks:
+            self._chunks[chunk] = np.load(self.chunk_path(chunk), mmap_mode='r')
+        return self._chunks[chunk]
+
+    def _variable_index(self, variable):
+        if not self.variables or variable not in self.variables:
+            raise KeyError(f'{variable} is not in the ensemble store')
+        return self.variables.index(variable)
+
+    def refresh(self):
+        # Pick up runs appended since this store was opened, e.g. by another process
+        self._chunk_names, self._chunk_stamps, self._slots, self._chunks = [], [], {}, {}
+        if os.path.exists(self.index_path):
+            self._read_index(None, None)
+        return self
+
+    def variable(self, variable: str, runs: List[str] = None):
+        # (run, year) array of one variable, for every run or the given runs
+        i = self._variable_index(variable)
+        if runs is not None:
+            parts = [self._run_values(run)[i][np.newaxis] for run in runs]
+        else:
+            parts = [self._chunk(chunk)[i, 0:len(names), :] for chunk, names in enumerate(self._chunk_names) if names]
+        return np.concatenate(parts) if parts else np.empty((0, len(self.years)))
+
+    def variable_frame(self, variable: str, runs: List[str] = None):
+        # One variable as a dataframe indexed by year, with a column per run
+        return pd.DataFrame(
+            self.variable(variable, runs).T,
+            index=pd.Index(self.years, name='Year'),
+            columns=list(runs) if runs is not None else self.names
+        )
+
+    def _run_values(self, name):
+        if name not in self._slots:
+            raise KeyError(f'No run called {name} in the ensemble store')
+        chunk, slot = self._slots[name]
+        return self._chunk(chunk)[:, slot, :]
+
+    def source_stamp(self, name: str):
+        # The stamp the run was appended with, as a tuple, or None if it had none
+        if name not in self._slots:
+            raise KeyError(f'No run called {name} in the ensemble store')
+        chunk, slot = self._slots[name]
+        stamp = self._chunk_stamps[chunk][slot]
+        return tuple(stamp) if stamp is not None else None
+
+    def run(self, name: str):
+        # One run's results, laid out like the output it came from: a Year column and a column per variable
+        df = pd.DataFrame(self._run_values(name).T, columns=self.variables)
+        df.insert(0, 'Year', self.years)
+        return df
@@ -0,0 +1,216 @@
+import os
+import re
+import logging
+import zipfile
+import numpy as np
+import openpyxl
+import pandas as pd
+from pathlib import Path
+from typing import Union, List, Dict
+
+from macroeconomy.excel_utils import sheet_parts
+
+LOGGER = logging.getLogger(__name__)
+
+# Formats for the data passed between python and the model: the scenario sheets the model reads
+# and the results it writes. xlsx is CRED's own format. mat (MATLAB's binary format, written and
+# read with scipy.io) skips the slow XML parsing and writing at both ends of every run.
+#
+# A .mat exchange file has one variable per sheet: a struct with fields
+# - columns: cell array of column names
+# - values: numeric matrix, one row per year
+# - integer: logical row vector, the columns to read back as integers (e.g. Year)
+EXCHANGE_FORMATS = ['xlsx', 'mat']
+EXCHANGE_SUFFIXES = {'xlsx': '.xlsx', 'mat': '.mat'}
+
+# Model-side functions that read and write exchange files, installed into the model's Functions
+# directory by install_exchange_hooks. RunSimulations.m reads its scenario sheets with
+#   [mValues, casColumns] = CREDReadSheet(sFile, sSheet)
+# and writes its results with
+#   CREDWriteSheet(sFile, sSheet, mValues, casColumns)
+# where sFile has the extension named by sExchangeFormat, which MacroEconomyCRED sets.
+# Both dispatch on the file extension, so xlsx keeps working as before. They stick to functions
+# that MATLAB and Octave share.
+EXCHANGE_HOOKS = {
+    'Functions/CREDReadSheet.m': """function [mValues, casColumns] = CREDReadSheet(sFile, sSheet)
+% Read one sheet of CRED data from an .xlsx or .mat exchange file (see macroeconomy/cred_exchange.py)
+[~, ~, sExt] = fileparts(sFile);
+if strcmpi(sExt, '.mat')
+    S = load(sFile, sSheet);
+    mValues = S.(sSheet).values;
+    casColumns = S.(sSheet).columns;
+else
+    [mValues, casText] = xlsread(sFile, sSheet);
+    casColumns = casText(1, :);
+end
+end
+""",
+    'Functions/CREDWriteSheet.m': """function CREDWriteSheet(sFile, sSheet, mValues, casColumns)
+% Write one sheet of CRED data to an .xlsx or .mat exchange file (see macroeconomy/cred_exchange.py)
+[~, ~, sExt] = fileparts(sFile);
+if strcmpi(sExt, '.mat')
+    S.(sSheet).columns = casColumns;
+    S.(sSheet).values = mValues;
+    S.(sSheet).integer = all(mValues == fix(mValues), 1);
+    if exist(sFile, 'file') == 2
+        save('-v7', '-append', sFile, '-struct', 'S');
+    else
+        save('-v7', sFile, '-struct', 'S');
+    end
+else
+    xlswrite(sFile, [casColumns; num2cell(mValues)], sSheet);
+end
+end
+""",
+}
+
+
+def check_exchange_hooks_called(runsimulations_file: Union[str, Path]):
+    # Installing the hooks isn't enough: RunSimulations.m has to read and write its sheets with them.
+    # A model that doesn't would read the xlsx input and write xlsx output whatever the format
+    text = Path(runsimulations_file).read_text()
+    missing = [Path(hook).stem for hook in EXCHANGE_HOOKS if not re.search(rf'\b{Path(hook).stem}\s*\(', text)]
+    if missing:
+        raise ValueError(f'{runsimulations_file} does not call {missing}, so it can only exchange data as xlsx. Use exchange_format="xlsx" or update the model')
+
+
+def _import_scipy_io():
+    try:
+        import scipy.io
+        return scipy.io
+    except ImportError as e:
+        raise ImportError('The mat exchange format needs scipy. Install it or use exchange_format="xlsx"') from e
+
+
+def check_exchange_format(exchange_format: str):
+    if exchange_format not in EXCHANGE_FORMATS:
+        raise ValueError(f'exchange_format must be one of {EXCHANGE_FORMATS}, not {exchange_format}')
+
+
+def exchange_path(path: Union[str, Path], exchange_format: str):
+    # The file to use for path in the given format, e.g. results.xlsx -> results.mat
+    check_exchange_format(exchange_format)
+    return Path(path).with_suffix(EXCHANGE_SUFFIXES[exchange_format])
+
+
+def format_of(path: Union[str, Path]):
+    suffix = Path(path).suffix.lower()
+    for exchange_format, format_suffix in EXCHANGE_SUFFIXES.items():
+        if suffix == format_suffix:
+            return exchange_format
+    raise ValueError(f'Not a CRED exchange file: {path}. Expected one of {list(EXCHANGE_SUFFIXES.values())}')
+
+
+def list_sheets(path: Union[str, Path]):
+    if format_of(path) == 'mat':
+        return [name for name, _, _ in _import_scipy_io().whosmat(path)]
+    # Straight from the workbook's index, without opening any sheets
+    with zipfile.ZipFile(path) as zf:
+        return list(sheet_parts(zf))
+
+
+def read_sheets(path: Union[str, Path], sheet_names: List[str] = None, nrows: int = None, columns: List[str] = None):
+    # Read sheets from an exchange file into {sheet name: dataframe}. All sheets if sheet_names is None.
+    # columns: only read the columns with these names, in the order they're in the file.
+    # Raises ValueError if a sheet is missing, whatever the format
+    if format_of(path) == 'xlsx':
+        if columns is not None:
+            return _read_xlsx_columns(path, sheet_names, nrows, columns)
+        return pd.read_excel(path, sheet_name=list(sheet_names) if sheet_names is not None else None, nrows=nrows)
+
+    sheet_names = list(sheet_names) if sheet_names is not None else list_sheets(path)
+    contents = _import_scipy_io().loadmat(path, variable_names=sheet_names, chars_as_strings=True)
+    missing = [name for name in sheet_names if name not in contents]
+    if missing:
+        raise ValueError(f'Sheets {missing} not found in {path}')
+    return {name: _sheet_from_struct(contents[name], nrows, columns) for name in sheet_names}
+
+
+def _read_xlsx_columns(path, sheet_names, nrows, columns):
+    # read_excel converts every cell of every row it reads before usecols picks the columns out, so
+    # instead find the columns' positions in each sheet's header row and have openpyxl hand back only
+    # that span of each row, and only the first nrows rows. openpyxl still tokenises the XML of the
+    # rows it reads, but cells outside the span are never converted or stored
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet_names = list(sheet_names) if sheet_names is not None else workbook.sheetnames
+        missing = [name for name in sheet_names if name not in workbook.sheetnames]
+        if missing:
+            raise ValueError(f'Sheets {missing} not found in {path}')
+        sheets = {}
+        for name in sheet_names:
+            worksheet = workbook[name]
+            header = next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            keep = [i for i, column in enumerate(header) if column in columns]
+            if not keep:
+                sheets[name] = pd.DataFrame()
+                continue
+            rows = worksheet.iter_rows(
+                min_row=2,
+                max_row=nrows + 1 if nrows is not None else None,
+                min_col=keep[0] + 1,
+                max_col=keep[-1] + 1,
+                values_only=True
+            )
+            values = [[row[i - keep[0]] for i in keep] for row in rows]
+            # As read_excel does, drop empty rows at the end of the sheet
+            while values and all(value is None for value in values[-1]):
+                values.pop()
+            sheets[name] = pd.DataFrame(values, columns=[header[i] for i in keep]).infer_objects()
+        return sheets
+    finally:
+        workbook.close()
+
+
+def write_sheets(path: Union[str, Path], sheets: Dict[str, pd.DataFrame]):
+    # Write {sheet name: dataframe} to a new exchange file, replacing any existing file
+    if format_of(path) == 'xlsx':
+        with pd.ExcelWriter(path, engine='openpyxl') as writer:
+            for name, df in sheets.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+        return
+    _import_scipy_io().savemat(path, {name: _sheet_to_struct(name, df) for name, df in sheets.items()})
+
+
+def _sheet_to_struct(name, df):
+    if not name.isidentifier() or len(name) > 63:
+        raise ValueError(f'Sheet name {name} is not a valid MATLAB variable name and cannot be written to a .mat file')
+    try:
+        values = df.to_numpy(dtype=float)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Sheet {name} has non-numeric data and cannot be written to a .mat file') from e
+    return {
+        'columns': np.array([str(c) for c in df.columns], dtype=object).reshape(1, -1),
+        'values': values.reshape(df.shape),
+        'integer': np.array([pd.api.types.is_integer_dtype(dtype) for dtype in df.dtypes]).reshape(1, -1),
+    }
+
+
+def _sheet_from_struct(struct, nrows=None, columns=None):
+    # loadmat gives a (1, 1) record array, with every field wrapped in at least two dimensions
+    struct = struct[0, 0]
+    names = [str(c[0]) if c.size else '' for c in struct['columns'].ravel()]
+    values = struct['values']
+    values = values.reshape(-1, len(names)) if values.size else np.empty((0, len(names)))
+    integer = struct['integer'].ravel() if 'integer' in struct.dtype.names else np.zeros(len(names), dtype=bool)
+    keep = [i for i, name in enumerate(names) if columns is None or name in columns]
+    values = values[0:nrows, keep] if nrows is not None else values[:, keep]
+    df = pd.DataFrame(values, columns=[names[i] for i in keep])
+    for j, i in enumerate(keep):
+        if integer[i] and not df.iloc[:, j].isna().any():
+            df.isetitem(j, df.iloc[:, j].astype('int64'))
+    return df
+
+
+def install_exchange_hooks(cred_location: Union[str, Path]):
+    # Write the model-side reader and writer into the model directory, if they're missing or out of date.
+    # Returns the files that were written
+    written = []
+    for filename, text in EXCHANGE_HOOKS.items():
+        path = Path(cred_location, filename)
+        if path.exists() and path.read_text() == text:
+            continue
+        os.makedirs(path.parent, exist_ok=True)
+        path.write_text(text)
+        written.append(path)
+    return written
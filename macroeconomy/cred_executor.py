@@ -0,0 +1,219 @@
+import os
+import logging
+from pathlib import Path
+from typing import Union, List
+from multiprocessing import util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from macroeconomy.cred_model import MacroEconomyCRED, CRED_ENGINE
+from macroeconomy.cred_engine import MatlabEngine, get_engine
+from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_session import CREDSessionPool
+from macroeconomy.cred_workspace import CREDWorkspace
+from macroeconomy.cred_exchange import exchange_path, list_sheets
+from macroeconomy.cred_timing import PhaseTimer
+
+LOGGER = logging.getLogger(__name__)
+
+# Each worker process in a parallel experiment owns one workspace (and optionally one warm session)
+# for its whole lifetime. These are set by _init_worker
+_WORKER_WORKSPACE = None
+_WORKER_SESSION_POOL = None
+
+
+class CREDRunResult():
+    # The outcome of a single model run in an experiment
+    # status is one of 'success', 'cached' (served from a CREDResultCache), 'skipped' or 'failed'
+    # kill_reason is set if the run was killed by its timeout or watchdog (see cred_watchdog.KILL_REASONS)
+    # timings is {phase: seconds} for the phases the run went through (see cred_timing.PhaseTimer)
+
+    def __init__(self, input_excel, output_excel, status, error=None, kill_reason=None, timings=None):
+        self.input_excel = input_excel
+        self.output_excel = output_excel
+        self.status = status
+        self.error = error
+        self.kill_reason = kill_reason
+        self.timings = timings
+
+    @property
+    def succeeded(self):
+        return self.status in ['success', 'cached']
+
+    def __repr__(self):
+        error = f', error={self.error!r}' if self.error else ''
+        killed = f', kill_reason={self.kill_reason!r}' if self.kill_reason else ''
+        return f'CREDRunResult({Path(self.input_excel).name}, status={self.status!r}{killed}{error})'
+
+
+def run_cred_task(cred_kwargs: dict, input_excel, output_excel, scenarios, session_pool=None, load_output=True):
+    # Run one model and record what happened rather than raising, so that one bad ensemble
+    # member doesn't bring down the rest of the experiment.
+    # With load_output=False the output isn't checked for the scenarios (see MacroEconomyCRED.run)
+    kwargs = dict(cred_kwargs)
+    if _WORKER_WORKSPACE:
+        kwargs['cred_location'] = _WORKER_WORKSPACE.path
+    session_pool = session_pool if session_pool else _WORKER_SESSION_POOL
+    if session_pool:
+        kwargs['session_pool'] = session_pool
+    cred = None
+    try:
+        cred = MacroEconomyCRED(input_excel=input_excel, output_excel=output_excel, scenarios=scenarios, **kwargs)
+        cred.run(load_output=load_output)
+    except Exception as e:
+        LOGGER.info(f'Model run with {Path(input_excel).name} failed: {e}')
+        kill_reason = cred.kill_reason if cred else None
+        timings = cred.timer.timings if cred else None
+        return CREDRunResult(input_excel, output_excel, 'failed', error=str(e), kill_reason=kill_reason, timings=timings)
+    status = 'cached' if cred.cached_result else 'success'
+    return CREDRunResult(input_excel, output_excel, status, kill_reason=cred.kill_reason, timings=cred.timer.timings)
+
+
+async def run_cred_task_async(cred_kwargs: dict, input_excel, output_excel, scenarios, cred_location=None):
+    # The asyncio version of run_cred_task. cred_location overrides the template's model directory,
+    # e.g. with a CREDWorkspace so that concurrent runs don't share files.
+    # Cancellation isn't caught: it kills the run and propagates
+    kwargs = dict(cred_kwargs)
+    if cred_location:
+        kwargs['cred_location'] = cred_location
+    cred = None
+    try:
+        cred = MacroEconomyCRED(input_excel=input_excel, output_excel=output_excel, scenarios=scenarios, **kwargs)
+        await cred.run_async()
+    except Exception as e:
+        LOGGER.info(f'Model run with {Path(input_excel).name} failed: {e}')
+        kill_reason = cred.kill_reason if cred else None
+        timings = cred.timer.timings if cred else None
+        return CREDRunResult(input_excel, output_excel, 'failed', error=str(e), kill_reason=kill_reason, timings=timings)
+    status = 'cached' if cred.cached_result else 'success'
+    return CREDRunResult(input_excel, output_excel, status, kill_reason=cred.kill_reason, timings=cred.timer.timings)
+
+
+def run_cred_batch_task(cred_kwargs: dict, members: List[tuple], scenario, batch_dir, session_pool=None):
+    # Run several ensemble members in one model invocation: the scenario sheet of each member's
+    # input becomes its own sheet (Scenario_001, Scenario_002, ...) in a combined input, CRED
+    # simulates every sheet listed in casScenarioNames, and the combined output is split back into
+    # one output per member. This pays MATLAB startup and model solving once per batch, not per member.
+    #
+    # members is a list of (input_excel, output_excel) pairs. Returns one CREDRunResult per member: if the
+    # model leaves some members' sheets out of the output, only those members fail
+    names = [CREDInput.batch_scenario_name(scenario, i) for i in range(len(members))]
+    batch_name = f'batch_{Path(members[0][0]).stem}'
+    batch_input = Path(batch_dir, f'{batch_name}.xlsx')
+    exchange_format = cred_kwargs.get('exchange_format', 'xlsx')
+    batch_output = exchange_path(Path(batch_dir, f'{batch_name}_results.xlsx'), exchange_format)
+
+    # Each member is given an equal share of the time the batch took
+    timer = PhaseTimer()
+
+    def member_timings():
+        return {phase: seconds / len(members) for phase, seconds in timer.timings.items()}
+
+    def member_results(status, error=None, kill_reason=None):
+        return [CREDRunResult(input_excel, output_excel, status, error=error, kill_reason=kill_reason, timings=member_timings()) for input_excel, output_excel in members]
+
+    kwargs = dict(cred_kwargs)
+    if kwargs.get('timeout'):
+        # The timeout is for one scenario; a batch simulates len(members) of them
+        kwargs['timeout'] = kwargs['timeout'] * len(members)
+    # Members' workbooks are exported when the batch is split, not the batch's
+    export_excel = kwargs.pop('export_excel', False) and exchange_format != 'xlsx'
+    try:
+        with timer.phase('build_batch'):
+            CREDInput.batch([input_excel for input_excel, _ in members], scenario=scenario).to_excel(batch_input, overwrite=True)
+    except Exception as e:
+        LOGGER.info(f'Could not build the batched input {batch_input.name}: {e}')
+        return member_results('failed', error=str(e))
+
+    # The batch's output is split below, which copes with members that are missing from it
+    result = run_cred_task(kwargs, batch_input, batch_output, names, session_pool=session_pool, load_output=False)
+    timer.timings.update(result.timings or {})
+    if not result.succeeded:
+        return member_results('failed', error=result.error, kill_reason=result.kill_reason)
+
+    try:
+        with timer.phase('split_batch'):
+            present = set(list_sheets(batch_output))
+            outputs = {name: output_excel for name, (_, output_excel) in zip(names, members) if name in present}
+            written = {}
+            if outputs:
+                output = CREDOutput(batch_input, batch_output, list(outputs), n_sim_years=kwargs.get('n_sim_years'))
+                written = output.split_scenarios(outputs, scenario_name=scenario)
+                if export_excel:
+                    output.split_scenarios({name: exchange_path(path, 'xlsx') for name, path in outputs.items()}, scenario_name=scenario)
+    except Exception as e:
+        LOGGER.info(f'Could not split the batched output {batch_output.name}: {e}')
+        return member_results('failed', error=str(e))
+    finally:
+        for path in [batch_input, batch_output]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return [
+        CREDRunResult(input_excel, output_excel, result.status, kill_reason=result.kill_reason, timings=member_timings()) if name in written
+        else CREDRunResult(input_excel, output_excel, 'failed', error=f'{name} missing from the batched output', timings=member_timings())
+        for name, (input_excel, output_excel) in zip(names, members)
+    ]
+
+
+def _init_worker(source_dir, scratch_dir, persistent_session, executable):
+    global _WORKER_WORKSPACE, _WORKER_SESSION_POOL
+    _WORKER_WORKSPACE = CREDWorkspace(source_dir, scratch_dir=scratch_dir)
+    _WORKER_WORKSPACE.create()
+    # Worker processes don't run atexit handlers, but they do run multiprocessing finalizers
+    util.Finalize(None, _WORKER_WORKSPACE.cleanup, exitpriority=10)
+    if persistent_session:
+        _WORKER_SESSION_POOL = CREDSessionPool(n_sessions=1, executable=executable)
+        util.Finalize(None, _WORKER_SESSION_POOL.close, exitpriority=20)
+
+
+def run_cred_tasks_in_parallel(
+    cred_kwargs: dict,
+    tasks: List[tuple],
+    max_workers: int,
+    scratch_dir: Union[str, Path] = None,
+    persistent_session: bool = False,
+    executable: Union[str, Path] = None,
+    task_function=run_cred_task,
+    on_result=None,
+):
+    # Run (input_excel, output_excel, scenarios) tasks on a pool of worker processes, each with its
+    # own clone of the CRED directory. Returns results in the same order as the tasks.
+    # task_function is called as task_function(cred_kwargs, *task), e.g. run_cred_batch_task with
+    # (members, scenario, batch_dir) tasks.
+    # on_result is called with each task's result in this process as soon as it finishes.
+    #
+    # If a worker dies (e.g. killed for running out of memory, or MATLAB crashing) the pool is broken
+    # and every task it hadn't finished is recorded as failed, rather than the whole experiment being
+    # lost. They wrote no output, so running the experiment again without overwrite_existing redoes them
+    if persistent_session and not isinstance(get_engine(cred_kwargs.get('engine') or CRED_ENGINE), MatlabEngine):
+        raise ValueError('Persistent sessions are only available with the MATLAB engine')
+    source_dir = cred_kwargs.get('cred_location')
+    results = [None] * len(tasks)
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_worker,
+        initargs=(source_dir, scratch_dir, persistent_session, executable)
+    ) as executor:
+        futures = {executor.submit(task_function, cred_kwargs, *task): i for i, task in enumerate(tasks)}
+        for n_done, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                error = 'A worker process died while running this task' if isinstance(e, BrokenProcessPool) else str(e)
+                LOGGER.info(f'Model run {i + 1} did not finish: {error}')
+                results[i] = _failed_task_result(task_function, tasks[i], error)
+            LOGGER.info(f'Finished CRED model run {n_done + 1} of {len(tasks)}: {results[i]}')
+            if on_result:
+                on_result(results[i])
+    return results
+
+
+def _failed_task_result(task_function, task, error):
+    # What a task that never returned gives: a failed result for its run, or one for each member of a batch
+    if task_function is run_cred_batch_task:
+        members = task[0]
+        return [CREDRunResult(input_excel, output_excel, 'failed', error=error) for input_excel, output_excel in members]
+    return CREDRunResult(task[0], task[1], 'failed', error=error)
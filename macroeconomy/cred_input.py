@@ -6,20 +6,67 @@ import os
 import matplotlib.pyplot as plt
 from typing import Union, List, Dict
 from pathlib import Path
+from collections import OrderedDict
+
+from macroeconomy.excel_utils import WorkbookIndex
+from macroeconomy.profiling import profiled
 
 LOGGER = logging.getLogger(__name__)
 
 # TODO / WARNING: Currently this module is designed to work with the out-of-the-box setup for the UNU-specific installation 
 # of CRED with 5 sectors, 1 region and fixed exogenous parameters. This will need to be adapted in the future!
 
+class CREDInputTemplate:
+    # The parts of a CRED input that every input made from the same template shares: the sectors, the
+    # input variable lookup and the Baseline sheet. These are parsed once per template and shared by
+    # every CREDInput and CREDOutput given the template, which then only read their own scenario sheets.
+    #
+    # Use get() to fetch a template from the registry, which holds one per workbook, keyed by its path,
+    # size and modification time so that an edited workbook is parsed again. Treat templates as
+    # read-only: CREDInputs take copies of anything they might change.
+    #
+    # The registry only keeps the REGISTRY_SIZE templates used most recently (see excel_utils.WorkbookIndex)
+
+    REGISTRY_SIZE = 16
+    _registry = OrderedDict()
+
+    def __init__(self, path):
+        self.path = path
+        self.baseline = pd.read_excel(path, sheet_name='Baseline')
+        self.sectors = CREDInput.read_sectors_from_cred_input(path)
+        self.n_sectors = len(self.sectors)
+        self.input_var_lookup = CREDInput.get_input_var_lookup(self.sectors)
+
+    @classmethod
+    def get(cls, path):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in cls._registry:
+            # Drop anything parsed from an older version of the workbook
+            for old_key in [k for k in cls._registry if k[0] == key[0]]:
+                del cls._registry[old_key]
+            cls._registry[key] = cls(path)
+            while len(cls._registry) > cls.REGISTRY_SIZE:
+                cls._registry.popitem(last=False)
+        cls._registry.move_to_end(key)
+        return cls._registry[key]
+
+    @classmethod
+    def clear(cls):
+        cls._registry.clear()
+
+
 class CREDInput:
     def __init__(
         self,
         input_excel_path,
         scenarios=["Scenario"],
         # n_sim_years=None,
-        set_impacts_to_zero = False
+        set_impacts_to_zero = False,
+        template: CREDInputTemplate = None
     ):
+        # template: the CREDInputTemplate this input was made from. The Baseline sheet and the sectors are
+        # then taken from it, and only the scenario sheets are read from the input
         self.input_excel_path = input_excel_path
         if 'Baseline' in scenarios:
             LOGGER.warning("Don't provide 'Baseline' as an input scenario here: it doesn't have exogenous impacts. I'll remove that from the input scenarios for you")
@@ -27,17 +74,24 @@ class CREDInput:
         self.scenarios = scenarios
         self.scenarios_with_baseline = ['Baseline'] + scenarios
         
-        with pd.ExcelFile(input_excel_path) as xl:
-            self.data = {scenario: pd.read_excel(xl, sheet_name=scenario) for scenario in self.scenarios}
-            self.baseline = pd.read_excel(xl, sheet_name='Baseline')
-
-        self.sectors = self.read_sectors_from_cred_input(self.input_excel_path)
+        if template is not None:
+            with pd.ExcelFile(input_excel_path) as xl:
+                self.data = {scenario: pd.read_excel(xl, sheet_name=scenario) for scenario in self.scenarios}
+            # Inputs written from a truncated CREDInput have a Baseline as long as their scenarios
+            n_rows = max(df.shape[0] for df in self.data.values()) if self.data else None
+            self.baseline = template.baseline.iloc[0:n_rows].copy()
+            self.sectors = template.sectors
+        else:
+            with pd.ExcelFile(input_excel_path) as xl:
+                self.data = {scenario: pd.read_excel(xl, sheet_name=scenario) for scenario in self.scenarios}
+                self.baseline = pd.read_excel(xl, sheet_name='Baseline')
+            self.sectors = self.read_sectors_from_cred_input(self.input_excel_path)
         self.n_sectors = len(self.sectors)
         self.vars = self.map_variable_names()
 
         n_sim_years_list = np.unique([df.shape[0] for df in self.data.values()] + [self.baseline.shape[0]])
-        self.n_sim_years = np.min(n_sim_years_list)
-        self.input_var_lookup = self.get_input_var_lookup(self.sectors)
+        self.n_sim_years = int(np.min(n_sim_years_list))
+        self.input_var_lookup = dict(template.input_var_lookup) if template is not None else self.get_input_var_lookup(self.sectors)
 
         if len(n_sim_years_list) > 1:
             LOGGER.warning(f'Unexpected: different scenarios have different numbers of years. Truncating to {self.n_sim_years} years')
@@ -124,6 +178,7 @@ class CREDInput:
         raise ValueError(f'Unrecognised impact_type: {impact_type}')
 
 
+    @profiled()
     def to_excel(self, path, overwrite=False):
         if not overwrite and os.path.exists(path):
             raise FileExistsError(f'Output file already exists at {path}')
@@ -131,12 +186,45 @@ class CREDInput:
         shutil.copy2(self.input_excel_path, path)
         with pd.ExcelWriter(path, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
             for sheet, df in self.data.items():
-                df.to_excel(writer, sheet, index=False)
-            self.baseline.to_excel(writer, 'Baseline', index=False)
+                df.to_excel(writer, sheet_name=sheet, index=False)
+            self.baseline.to_excel(writer, sheet_name='Baseline', index=False)
+
 
+    def add_scenario(self, scenario, data):
+        # Add a new scenario sheet, e.g. one copied from another input built from the same template
+        if scenario == 'Baseline' or scenario in self.data:
+            raise ValueError(f'Scenario "{scenario}" is already in the input data')
+        if data.shape[0] < self.n_sim_years:
+            raise ValueError(f'The provided data have fewer years ({data.shape[0]}) than the input excel ({self.n_sim_years})')
+        self.data[scenario] = data.iloc[0:self.n_sim_years, ].reset_index(drop=True)
+        self.scenarios = self.scenarios + [scenario]
+        self.scenarios_with_baseline = self.scenarios_with_baseline + [scenario]
 
-    def add_scenario(self):
-        raise NotImplementedError()
+
+    def remove_scenario(self, scenario):
+        if scenario not in self.data:
+            raise ValueError(f'Scenario "{scenario}" is not in the input data')
+        del self.data[scenario]
+        self.scenarios = [s for s in self.scenarios if s != scenario]
+        self.scenarios_with_baseline = [s for s in self.scenarios_with_baseline if s != scenario]
+
+
+    @staticmethod
+    def batch_scenario_name(scenario, i):
+        return f'{scenario}_{i+1:03d}'
+
+
+    @classmethod
+    def batch(cls, input_excel_paths, scenario='Scenario'):
+        # Combine the same scenario from several inputs made from one template into a single input,
+        # with one sheet per input named Scenario_001, Scenario_002, ... so that CRED can simulate
+        # them all in one run. The other sheets come from the first input.
+        batch = cls(input_excel_paths[0], scenarios=[scenario])
+        for i, path in enumerate(input_excel_paths):
+            data = pd.read_excel(path, sheet_name=scenario)
+            batch.add_scenario(cls.batch_scenario_name(scenario, i), data)
+        batch.remove_scenario(scenario)
+        return batch
 
 
     def set_dummy_impacts(self, scale=1, frequency=0.2, scale_imp_to_bi=0.25, seed=None):
@@ -213,7 +301,12 @@ class CREDInput:
 
     @staticmethod
     def read_sectors_from_cred_input(path):
-        df = pd.read_excel(path, sheet_name='Content')
+        # The Content sheet is read once per version of the workbook (see excel_utils.WorkbookIndex)
+        return CREDInput.sectors_from_content(WorkbookIndex.get(path).sheet('Content'))
+
+    @staticmethod
+    def sectors_from_content(df):
+        # The sectors listed in an input's Content sheet
         i_row_sectors = np.argwhere(df['Sheets'] == 'Sectors')[0][0] + 1
         sectors = df.iloc[i_row_sectors:, 1]
         return sectors
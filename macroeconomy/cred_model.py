@@ -1,5 +1,7 @@
 import os
 import re
+import time
+import asyncio
 import subprocess
 import logging
 import numpy as np
@@ -13,12 +15,25 @@ import matplotlib.pyplot as plt
 
 from macroeconomy.cred_input import CREDInput
 from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_session import CREDSessionPool
+from macroeconomy.cred_engine import CREDEngine, get_engine
+from macroeconomy.cred_cache import DynareCache, CREDResultCache
+from macroeconomy.cred_watchdog import CREDWatchdog, CREDRunKilled
+from macroeconomy.excel_utils import truncate_workbook, WorkbookIndex
+from macroeconomy.cred_timing import PhaseTimer
+from macroeconomy.cred_exchange import (
+    check_exchange_format, exchange_path, read_sheets, write_sheets, install_exchange_hooks, check_exchange_hooks_called
+)
+from macroeconomy.cred_config import (
+    CREDConfig, Assignment, LineArray, ScenarioNames, DynareOptions, CachedDynareModel,
+    RUNSIMULATIONS_FILE, MOD_FILE, SIMULATION_MODEL_FILE
+)
 
 LOGGER = logging.getLogger(__name__)
 
 # TODO allow these to be overridden by CLIMADA conf? 
 CRED_LOCATION = '/Users/chrisfairless/Projects/UNU/CLIMADA_CRED_data/CRED/CRED_inputs/Thailand and Egypt/DGE_CRED_Model/Matlab/'
-CRED_ENGINE = 'matlab'   # matlab or octave
+CRED_ENGINE = 'matlab'   # matlab, octave or mock
 
 # Only one of these needs to be provided (matching your choice of ENGINE) but both variables are required during testing
 MATLAB_EXECUTABLE = '/Applications/MATLAB_R2024b.app/bin/matlab'
@@ -39,6 +54,7 @@ class MacroEconomyCRED():
         input_excel: Union[str, Path] = None,
         output_excel: Union[str, Path] = None,
         n_sim_years: int = None,
+        n_terminal_years: int = 0,
         n_sectors: int = 5,
         n_regions: int = 1,
         scenarios: list = ["Baseline", "Scenario"],
@@ -46,19 +62,22 @@ class MacroEconomyCRED():
         Subsecend = [1, 3, 4, 5],
         ForwardLooking: bool = False,
         timeout: int = None,   # TODO make this part of the execute command
+        session_pool: CREDSessionPool = None,
+        cred_location: Union[str, Path] = None,
+        engine: Union[str, CREDEngine] = None,
+        dynare_cache: DynareCache = None,
+        watchdog: CREDWatchdog = None,
+        result_cache: CREDResultCache = None,
+        exchange_format: str = 'xlsx',
+        export_excel: bool = False,
         # ClimateVarsRegional = ["tas"],
         # ClimateVarsNational = ["SL"],
     ):
-        self.cred_location = CRED_LOCATION        
-        self.engine = CRED_ENGINE
-        if self.engine == "matlab":
-            self.executable = MATLAB_EXECUTABLE
-            self.cred_command = f'''{self.executable} -nodisplay -nodesktop -r "try; cd('{self.cred_location}'); RunSimulations(); catch; end; quit;"'''
-        elif self.engine == "octave":
-            self.executable = OCTAVE_EXECUTABLE
-            raise ValueError('CRED in python is currently only set up to work with MATLAB')
-        else:
-            raise ValueError("MacroEconomyCRED must have engine as either 'matlab' or 'octave'")
+        # Run against a different copy of the model, e.g. a CREDWorkspace, instead of the global CRED_LOCATION
+        self.cred_location = cred_location if cred_location else CRED_LOCATION
+        # The engine that runs the model: 'matlab', 'octave', 'mock' or a CREDEngine object
+        self.engine = get_engine(engine if engine else CRED_ENGINE)
+        self.executable = self.engine.executable
 
         self.n_sectors = n_sectors
         self.n_regions = n_regions
@@ -70,13 +89,29 @@ class MacroEconomyCRED():
 
         self.user_input_excel = input_excel if input_excel else self.cred_input_excel 
         self.user_output_excel = output_excel if output_excel else self.cred_output_excel
+
+        # The format the model reads its scenario sheets in and writes its results in: 'xlsx' or 'mat' (see cred_exchange).
+        # With 'mat' the calibration sheets are still read from the input workbook, but the scenario data and
+        # results are passed as .mat files, and the output is written next to output_excel with a .mat suffix.
+        # export_excel also writes the output to output_excel as a workbook
+        check_exchange_format(exchange_format)
+        self.exchange_format = exchange_format
+        self.export_excel = export_excel
+        self.cred_input_path = exchange_path(self.cred_input_excel, exchange_format)
+        self.cred_output_path = exchange_path(self.cred_output_excel, exchange_format)
+        self.user_output_path = exchange_path(self.user_output_excel, exchange_format)
         
         self.runsimulations_file = Path(self.cred_location, 'RunSimulations.m')
         self.mod_file = Path(self.cred_location, 'DGE_CRED_Model.mod')
         self.simulation_model_file = Path(self.cred_location, 'Functions', 'Simulation_Model.m')
         self.check_directories_exist()
 
-        self.n_sim_years = n_sim_years if n_sim_years else self.get_input().n_sim_years
+        self.n_sim_years = n_sim_years if n_sim_years else self.input_n_sim_years()
+        # Extra years of scenario data and iStepSimulation past n_sim_years, for models whose terminal
+        # condition would otherwise distort the last years we keep. They're cut from the output
+        if n_terminal_years < 0:
+            raise ValueError('n_terminal_years must be zero or more')
+        self.n_terminal_years = n_terminal_years
         self.model_has_been_run = False
 
         self.Subsecstart = Subsecstart
@@ -87,7 +122,31 @@ class MacroEconomyCRED():
         # self.ClimateVars = ClimateVarsRegional + ClimateVarsNational
         # self.iStepSteadyState = iStepSteadyState
         self.timeout = timeout
-
+        # Optional pool of warm MATLAB sessions. If not provided, each run launches its own MATLAB process
+        self.session_pool = session_pool
+        # Optional store of compiled Dynare models, so runs that only change the input data skip preprocessing
+        self.dynare_cache = dynare_cache
+        self.dynare_fingerprint = None
+        # Optional monitor that kills runs that use too much memory or stop making progress
+        self.watchdog = watchdog
+        # Why the last run was killed, if it was: one of cred_watchdog.KILL_REASONS
+        self.kill_reason = None
+        # Optional store of previous outputs: runs with the same inputs and setup are served from here
+        self.result_cache = result_cache
+        self.result_cache_key = None
+        self.cached_result = False
+        # Where the time went in the last run (see cred_timing.PhaseTimer). Also attached to its output as timings
+        self.timer = PhaseTimer()
+
+
+    @property
+    def n_model_years(self):
+        # The horizon the model is solved over
+        return self.n_sim_years + self.n_terminal_years
+
+    @property
+    def cred_command(self):
+        return self.engine.command(self)
 
     @classmethod
     def from_input(cls, input, **kwargs):
@@ -98,23 +157,45 @@ class MacroEconomyCRED():
         input.to_excel(cred.cred_input_excel, overwrite=True)
         return cred
 
+    def template_kwargs(self):
+        # Settings shared by every run in an experiment, i.e. everything except the input, output and scenarios.
+        # Use these to create more MacroEconomyCRED objects with the same setup
+        return dict(
+            n_sim_years=self.n_sim_years,
+            n_terminal_years=self.n_terminal_years,
+            n_sectors=self.n_sectors,
+            n_regions=self.n_regions,
+            ForwardLooking=self.ForwardLooking,
+            Subsecstart=self.Subsecstart,
+            Subsecend=self.Subsecend,
+            timeout=self.timeout,
+            cred_location=self.cred_location,
+            engine=self.engine,
+            dynare_cache=self.dynare_cache,
+            watchdog=self.watchdog,
+            result_cache=self.result_cache,
+            exchange_format=self.exchange_format,
+            export_excel=self.export_excel
+        )
+
     def get_input(self):
         return CREDInput(
-            template_excel_path = self.user_input_excel,
+            input_excel_path = self.user_input_excel,
             scenarios = self.scenarios
         )
     
     def get_output(self):
-        if not os.path.exists(self.user_output_excel):
+        if not os.path.exists(self.user_output_path):
             if self.model_has_been_run:
-                raise FileNotFoundError(f'No output file at {self.user_output_excel}. Something may have gone wrong during the model execution')
+                raise FileNotFoundError(f'No output file at {self.user_output_path}. Something may have gone wrong during the model execution')
             else:
-                raise FileNotFoundError(f'No output file at {self.user_output_excel}. Run the model first')
+                raise FileNotFoundError(f'No output file at {self.user_output_path}. Run the model first')
         self.model_has_been_run = True
         return CREDOutput(
             input_excel_path = self.user_input_excel,
-            output_excel_path = self.user_output_excel,
-            scenarios = self.scenarios
+            output_excel_path = self.user_output_path,
+            scenarios = self.scenarios,
+            n_sim_years = self.n_sim_years
         )
 
     
@@ -127,75 +208,211 @@ class MacroEconomyCRED():
     # Methods for executing the model
     # ------------------------------- 
 
-    def run(self):
+    def run(self, load_output: bool = True):
+        # Returns the CREDOutput, unless load_output is False, e.g. when the output is split up by the caller
+        LOGGER.info('Executing CRED')
+        self.kill_reason = None
+        self.timer = PhaseTimer()
+        with self.timer.phase('setup'):
+            self._setup()
+        with self.timer.phase('cache_lookup'):
+            cached = self._restore_cached_result()
+        if not cached:
+            with self.timer.phase('execute'):
+                self._execute()
+            with self.timer.phase('teardown'):
+                self._teardown()
+        return self._timed_output() if load_output else None
+
+
+    async def run_async(self, load_output: bool = True):
+        # As run(), but awaitable: the engine runs as an asyncio subprocess (see CREDEngine.execute_async)
+        # and the Excel work before and after runs in a thread, so one event loop can drive many runs.
+        # Cancelling the task kills the model run
         LOGGER.info('Executing CRED')
-        self._setup()
-        self._execute()
-        self._teardown()
-        return self.get_output()
+        self.kill_reason = None
+        self.timer = PhaseTimer()
+        with self.timer.phase('setup'):
+            await asyncio.to_thread(self._setup)
+        with self.timer.phase('cache_lookup'):
+            cached = await asyncio.to_thread(self._restore_cached_result)
+        if not cached:
+            with self.timer.phase('execute'):
+                await self._execute_async()
+            with self.timer.phase('teardown'):
+                await asyncio.to_thread(self._teardown)
+        return await asyncio.to_thread(self._timed_output) if load_output else None
+
+
+    def _timed_output(self):
+        with self.timer.phase('load_output'):
+            output = self.get_output()
+        output.timings = self.timer.timings
+        LOGGER.debug(f'Run timings: {self.timer}')
+        return output
 
 
     def _setup(self):
-        self.check_directories_exist()
-        self.check_model_is_valid()
-        self.set_istep_simulation(self.n_sim_years)
-        self.set_forwardlooking(self.ForwardLooking)
-        self.set_scenarios(self.scenarios)
-        self.set_iDisplay(self.n_sim_years)
-        self.set_subsector_starts_and_ends(self.Subsecstart, self.Subsecend)
-        self.remove_existing_output()
+        with self.timer.phase('check'):
+            self.check_directories_exist()
+            self.check_model_is_valid()
+        with self.timer.phase('model_files'):
+            self.model_config().render(self.cred_location)
+            if self.exchange_format != 'xlsx':
+                check_exchange_hooks_called(self.runsimulations_file)
+                install_exchange_hooks(self.cred_location)
+            if self.dynare_cache:
+                self._restore_dynare_model()
+            self.remove_existing_output()
         
         # Copy input into the CRED model directory
         if self.user_input_excel != self.cred_input_excel:
-            self.copy_input_into_cred(source=self.user_input_excel)
+            with self.timer.phase('copy_input'):
+                self.copy_input_into_cred(source=self.user_input_excel)
         
-        # Trim the Excel file in the model directory to the number of years we're running
-        self._truncate_input_excel()
+        # Trim the scenario data the model reads to the number of years we're solving for
+        with self.timer.phase('truncate_input'):
+            if self.exchange_format == 'xlsx':
+                self._truncate_input_excel()
+            else:
+                self._write_exchange_input()
+        with self.timer.phase('engine_prepare'):
+            self.engine.prepare(self)
             
     
     def _execute(self):
+        launched = time.time()
         try:
-            subprocess.run(self.cred_command, shell=True, check=True, timeout=self.timeout)
-        except TimeoutExpired as e:
-            LOGGER.info(f'The model run took longer than the timeout of {self.timeout} seconds. Terminating and moving on.')
-            return
-        except CalledProcessError as e:
+            self.engine.execute(self)
+        except (TimeoutExpired, CREDRunKilled, CalledProcessError) as e:
+            self._handle_engine_error(e)
+        self._record_first_output(launched)
+        self._check_output_exists()
+
+
+    async def _execute_async(self):
+        launched = time.time()
+        try:
+            await self.engine.execute_async(self)
+        except (TimeoutExpired, CREDRunKilled, CalledProcessError) as e:
+            self._handle_engine_error(e)
+        self._record_first_output(launched)
+        self._check_output_exists()
+
+
+    def _record_first_output(self, launched):
+        # Time from launching the engine to the output being written, going by the output's modification time.
+        # The rest of execute is the engine shutting down
+        if os.path.exists(self.cred_output_path):
+            self.timer.record('first_output', max(0.0, os.path.getmtime(self.cred_output_path) - launched))
+
+
+    def _handle_engine_error(self, e):
+        if isinstance(e, CalledProcessError):
             # Sometime I get a segfault after the model has run but while the output is being written
-            if os.path.exists(self.cred_output_excel):
-                LOGGER.info('MATLAB produced output but was not able to quit successfully. Ignoring the error.')
-            else:
-                LOGGER.info('MATLAB was not able to quit successfully and did not produce output.')
-                raise e
+            if os.path.exists(self.cred_output_path):
+                LOGGER.info(f'{self.engine.name} produced output but was not able to quit successfully. Ignoring the error.')
+                return
+            LOGGER.info(f'{self.engine.name} was not able to quit successfully and did not produce output.')
+            raise e
+        self.kill_reason = e.reason if isinstance(e, CREDRunKilled) else 'timeout'
+        # Sometimes the model hangs after the output is written
+        if os.path.exists(self.cred_output_path):
+            LOGGER.info(f'{self.engine.name} was killed ({self.kill_reason}) after it produced output. Keeping the output.')
+            return
+        LOGGER.info(f'{self.engine.name} was killed ({self.kill_reason}) before it produced output. Moving on.')
+        if isinstance(e, CREDRunKilled):
+            raise e
+        raise CREDRunKilled('timeout', f'The model run took longer than the timeout of {self.timeout} seconds') from e
+
 
-        if not os.path.exists(self.cred_output_excel):
+    def _check_output_exists(self):
+        if not os.path.exists(self.cred_output_path):
             raise FileNotFoundError(f"No CRED output was created. The model probably failed to finish. Errors are not printed within python. To see what went wrong try running the model again from the command line with:\n{self.cred_command}")
 
 
     def _teardown(self):
+        with self.timer.phase('engine_collect'):
+            self.engine.collect(self)
         # Only clear up if the model ran successfully
-        if os.path.exists(self.cred_output_excel):
-            self._truncate_output_excel()   # TODO find a way to run a shorter simulation!!
-            if self.user_output_excel != self.cred_output_excel:
-                self.copy_output_from_cred(destination=self.user_output_excel)
+        if os.path.exists(self.cred_output_path):
+            with self.timer.phase('truncate_output'):
+                self._truncate_output()   # TODO find a way to run a shorter simulation!!
+            if self.user_output_path != self.cred_output_path:
+                with self.timer.phase('copy_output'):
+                    self.copy_output_from_cred(destination=self.user_output_path)
+            with self.timer.phase('export_excel'):
+                self._export_excel()
+            with self.timer.phase('store_caches'):
+                if self.dynare_cache:
+                    self.dynare_cache.store(self.cred_location, self.dynare_fingerprint)
+                # Don't cache output from a run that was killed: it may be incomplete
+                if self.result_cache and not self.kill_reason:
+                    self.result_cache.put(self.result_cache_key, self.cred_output_path)
             self.model_has_been_run = True
     
 
+    def _restore_dynare_model(self):
+        # Fingerprint the model as it will be run and put the generated model into the model directory if we have it
+        self.dynare_fingerprint = self.dynare_cache.fingerprint(self.cred_location)
+        if self.dynare_cache.restore(self.cred_location, self.dynare_fingerprint):
+            LOGGER.debug('Reusing the generated Dynare model')
+
+
+    def _restore_cached_result(self):
+        # Look up this run in the result cache. Returns True if the output was copied from it
+        self.cached_result = False
+        if not self.result_cache:
+            return False
+        self.result_cache_key = self.result_cache.key(self)
+        if not self.result_cache.get(self.result_cache_key, self.user_output_path):
+            return False
+        LOGGER.info(f'Using the cached output for this run ({self.result_cache_key[:12]}). The model was not run')
+        self._export_excel()
+        self.cached_result = True
+        self.model_has_been_run = True
+        return True
+
+
+    def _export_excel(self):
+        # With a binary exchange format the output is only written as a workbook if asked for
+        if self.export_excel and self.exchange_format != 'xlsx':
+            write_sheets(exchange_path(self.user_output_excel, 'xlsx'), read_sheets(self.user_output_path))
+
+
     def remove_existing_output(self):
-        if os.path.exists(self.cred_output_excel):
-            os.remove(self.cred_output_excel)
+        if os.path.exists(self.cred_output_path):
+            os.remove(self.cred_output_path)
 
 
     def _truncate_input_excel(self):
         truncate_scenarios = list(set(self.scenarios).union({'Baseline'}))
-        self.truncate_cred_excel(self.cred_input_excel, self.cred_input_excel, truncate_scenarios, n_sim_years=self.n_sim_years)
+        self.truncate_cred_excel(self.cred_input_excel, self.cred_input_excel, truncate_scenarios, n_sim_years=self.n_model_years)
+
+
+    def _truncate_output(self):
+        # CRED writes more years than n_sim_years: iStepSimulation only sets the years it reports, and the
+        # horizon it solves over isn't a setting we can change from here. Outputs are cut to n_sim_years,
+        # so whoever reads them gets the years that were asked for. Only rewritten if needed
+        if self.exchange_format == 'xlsx':
+            index = WorkbookIndex(self.cred_output_path)
+            too_long = [sheet for sheet in index.sheet_names if index.n_rows(sheet) > self.n_sim_years]
+            if too_long:
+                self.truncate_cred_excel(self.cred_output_path, self.cred_output_path, too_long, n_sim_years=self.n_sim_years)
+            return
+        sheets = read_sheets(self.cred_output_path)
+        if any(df.shape[0] > self.n_sim_years for df in sheets.values()):
+            write_sheets(self.cred_output_path, {name: df.iloc[0:self.n_sim_years] for name, df in sheets.items()})
 
-    
-    def _truncate_output_excel(self):
-        self.truncate_cred_excel(self.cred_output_excel, self.cred_output_excel, self.scenarios, n_sim_years=self.n_sim_years)
+
+    def _write_exchange_input(self):
+        # The scenario sheets the model reads, trimmed to the years we're solving for, in the exchange format
+        truncate_scenarios = list(set(self.scenarios).union({'Baseline'}))
+        write_sheets(self.cred_input_path, self.truncated_sheets(self.user_input_excel, truncate_scenarios, self.n_model_years))
 
 
     def copy_output_from_cred(self, destination):
-        shutil.copy2(self.cred_output_excel, destination)
+        shutil.copy2(self.cred_output_path, destination)
   
     def copy_input_into_cred(self, source):
         shutil.copy2(source, self.cred_input_excel)
@@ -216,11 +433,30 @@ class MacroEconomyCRED():
     # Methods for modifying CRED before running
     # -----------------------------------------
 
+    def model_config(self):
+        # Everything _setup writes into the model files, applied in one pass per file by CREDConfig.render
+        config = CREDConfig()
+        # iStepSimulation covers the years we asked for plus any terminal years, and only the years we asked for
+        # are displayed. This doesn't shorten the horizon CRED solves over (see _truncate_output)
+        config.add(MOD_FILE, Assignment('options_.iStepSimulation', self.n_model_years))
+        config.add(MOD_FILE, Assignment('@# define ForwardLooking', bool(self.ForwardLooking)))
+        config.add(SIMULATION_MODEL_FILE, Assignment('iDisplay', self.n_sim_years))
+        config.add(RUNSIMULATIONS_FILE, ScenarioNames(self.scenarios))
+        config.add(RUNSIMULATIONS_FILE, LineArray('sSubsecstart', self.Subsecstart))
+        config.add(RUNSIMULATIONS_FILE, LineArray('sSubsecend', self.Subsecend))
+        # Models without the exchange hooks can only read and write xlsx, and don't need telling
+        config.add(RUNSIMULATIONS_FILE, Assignment('sExchangeFormat', self.exchange_format, required=self.exchange_format != 'xlsx'))
+        # Run the generated model without preprocessing when DynareCache says it's current. Without a cache, call dynare as usual
+        config.add(RUNSIMULATIONS_FILE, CachedDynareModel(enabled=bool(self.dynare_cache)))
+        return config
+
+    # The methods below change one setting at a time. _setup uses model_config instead
+
     def set_istep_simulation(self, istep: int):
         self._rewrite_mod_var('options_.iStepSimulation', istep)
     
     def set_forwardlooking(self, forwardlooking: bool):
-        self._rewrite_mod_var('@# define ForwardLooking', int(forwardlooking))
+        self._rewrite_mod_var('@# define ForwardLooking', bool(forwardlooking))
 
     def set_iDisplay(self, n_sim_years: int):
         self._rewrite_simulation_model_var('iDisplay', n_sim_years)
@@ -236,63 +472,32 @@ class MacroEconomyCRED():
 
     @staticmethod
     def _rewrite_cred_file(filepath, pattern, value):
-        with open(filepath, 'r') as f:
-            filedata = f.read()
-        pattern = re.escape(pattern)
-        if not isinstance(value, int):
-            raise ValueError('This method currently only works replacing integer values. Generalise me!')
-        pattern = rf"(.*{pattern}\s*=\s*)\d+"  # for integer replacement
         # e.g. @# define Regions = 1
-        filedata = re.sub(pattern, rf'\g<1>{value}', filedata)
-        with open(filepath, 'w') as f:
-            f.write(filedata)
+        CREDConfig.render_file(filepath, [Assignment(pattern, value)])
 
     def set_scenarios(self, scenarios: List[str]):
-        scenario_string = "'" + "', '".join(scenarios) + "'"
-
-        with open(self.runsimulations_file, 'r') as f:
-            lines_file = f.readlines()
-
-        # Writing scenarios can be complex as CRED lets them span multiple lines
-        # This reads the RunSimulations.m file line-by-line, editing the first line of the 
-        # casSecnarioNames specification and deleting all subsequent lines until the next 
-        # part of the file, which starts with 'Define sector'
-        with open(self.runsimulations_file, 'w') as f:
-            keep_line = True
-            for l in lines_file:
-                if 'casScenarioNames = {' in l:
-                    s = 'casScenarioNames = {' + scenario_string + '}\n\n'
-                    f.write(s)
-                    keep_line = False
-                elif 'Define sector' in l:
-                    f.write(l)
-                    keep_line = True
-                elif keep_line:
-                    f.write(l)
+        CREDConfig.render_file(self.runsimulations_file, [ScenarioNames(scenarios)])
     
     def set_subsector_starts_and_ends(self, subsecstart: list, subsecend: list):
-        with open(self.runsimulations_file, 'r') as f:
-            lines = f.readlines()
-        for i, line in enumerate(lines):
-            if "sSubsecstart" in line:
-                lines[i] = re.sub(r'\[.*\]', str(subsecstart), line)
-            if "sSubsecend" in line:
-                lines[i] = re.sub(r'\[.*\]', str(subsecend), line)
-        with open(self.runsimulations_file, 'w') as f:
-            f.writelines(lines)
+        CREDConfig.render_file(self.runsimulations_file, [LineArray('sSubsecstart', subsecstart), LineArray('sSubsecend', subsecend)])
 
-    @staticmethod
-    def truncate_cred_excel(input_file, output_file, scenarios, n_sim_years):
-        xl = pd.read_excel(input_file, sheet_name=scenarios)
+    def set_dynare_options(self, options: List[str]):
+        # Add options to the `dynare DGE_CRED_Model ...` call in RunSimulations.m, e.g. 'nograph'
+        CREDConfig.render_file(self.runsimulations_file, [DynareOptions(options)])
 
+    @staticmethod
+    def truncated_sheets(input_file, scenarios, n_sim_years):
+        index = WorkbookIndex.get(input_file)
         for scenario in scenarios:
-            if xl[scenario].shape[0] < n_sim_years:
-                raise ValueError("Input Excel has fewer rows than the requested truncation")
-            xl[scenario] = xl[scenario].iloc[0:n_sim_years, ]
-        
-        with pd.ExcelWriter(output_file, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
-            for scenario in scenarios:
-                xl[scenario].to_excel(writer, sheet_name=scenario, index=False)
+            if index.n_rows(scenario) < n_sim_years:
+                raise ValueError(f"Input Excel has fewer rows ({index.n_rows(scenario)}) than the requested truncation ({n_sim_years})")
+        return pd.read_excel(input_file, sheet_name=scenarios, nrows=n_sim_years)
+
+    @staticmethod
+    def truncate_cred_excel(input_file, output_file, scenarios, n_sim_years):
+        # Write input_file to output_file with the scenario sheets cut to n_sim_years rows. Only those sheets' XML
+        # is rewritten, streaming, and the rest of the workbook is copied as is (see excel_utils.truncate_workbook)
+        truncate_workbook(input_file, output_file, scenarios, n_sim_years)
 
 
     # -----------------------------------------
@@ -301,10 +506,9 @@ class MacroEconomyCRED():
 
     def check_directories_exist(self):
         if not os.path.exists(self.cred_location):
-            raise ValueError(f'CRED directory does not exist at {cred_location}')
+            raise ValueError(f'CRED directory does not exist at {self.cred_location}')
 
-        if not os.path.exists(self.executable):
-            raise FileNotFoundError(f'Could not find the executable to run CRED with {self.engine} at {self.executable}. Please check your setup in macroeconomy.py')
+        self.engine.check()
 
         if not os.path.exists(self.user_input_excel):
             raise FileNotFoundError(f'Input file not found at {self.user_input_excel}')
@@ -313,8 +517,22 @@ class MacroEconomyCRED():
             raise FileNotFoundError(f'Location for output file not found at {self.user_output_excel}')
 
 
+    def input_n_sim_years(self):
+        # The number of years in the input: the fewest rows in any of the scenarios we're running and the Baseline
+        index = WorkbookIndex.get(self.user_input_excel)
+        return min(index.n_rows(scenario) for scenario in set(self.scenarios).union({'Baseline'}))
+
+
     def check_model_is_valid(self):
+        # Checked against the input's WorkbookIndex, so this doesn't parse the input again
         sectors = CREDInput.read_sectors_from_cred_input(self.user_input_excel)
         if len(sectors) != self.n_sectors:
             raise ValueError(f"The input Excel sheet's Content page doesn't have {self.n_sectors} to match the user-supplied count of {self.n_sectors}. Sectors: {sectors}")
+        index = WorkbookIndex.get(self.user_input_excel)
+        missing = [scenario for scenario in set(self.scenarios).union({'Baseline'}) if scenario not in index.sheet_names]
+        if missing:
+            raise ValueError(f'Scenarios {missing} not found in the input at {self.user_input_excel}')
+        for scenario in set(self.scenarios).union({'Baseline'}):
+            if index.n_rows(scenario) < self.n_model_years:
+                raise ValueError(f"Scenario {scenario} in the input has fewer rows ({index.n_rows(scenario)}) than the years to simulate ({self.n_model_years})")
         # TODO more
@@ -5,20 +5,83 @@ import shutil
 import os
 from typing import Union, List, Dict
 from pathlib import Path
+from collections.abc import MutableMapping
 import matplotlib.pyplot as plt
 
-from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_input import CREDInput, CREDInputTemplate
+from macroeconomy.cred_exchange import list_sheets, read_sheets, write_sheets
 
 LOGGER = logging.getLogger(__name__)
 
 
+class LazySheets(MutableMapping):
+    # {sheet name: dataframe} for sheets in a workbook or exchange file, where each sheet is only read
+    # the first time it's used. nrows and columns limit what's read, as in cred_exchange.read_sheets
+
+    def __init__(self, path: Union[str, Path], sheet_names: List[str], nrows: int = None, columns: List[str] = None):
+        self.path = path
+        self.sheet_names = list(sheet_names)
+        self.nrows = nrows
+        self.columns = columns
+        self._sheets = {}
+
+    @property
+    def loaded(self):
+        return list(self._sheets)
+
+    def load(self):
+        # Read every sheet that hasn't been read yet, opening the file once
+        unread = [name for name in self.sheet_names if name not in self._sheets]
+        if unread:
+            self._sheets.update(read_sheets(self.path, unread, nrows=self.nrows, columns=self.columns))
+        return self
+
+    def __getitem__(self, name):
+        if name not in self._sheets:
+            if name not in self.sheet_names:
+                raise KeyError(name)
+            self._sheets.update(read_sheets(self.path, [name], nrows=self.nrows, columns=self.columns))
+        return self._sheets[name]
+
+    def __setitem__(self, name, df):
+        if name not in self.sheet_names:
+            self.sheet_names.append(name)
+        self._sheets[name] = df
+
+    def __delitem__(self, name):
+        self.sheet_names.remove(name)
+        self._sheets.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.sheet_names
+
+    def __iter__(self):
+        return iter(self.sheet_names)
+
+    def __len__(self):
+        return len(self.sheet_names)
+
+
 class CREDOutput:
     def __init__(
         self,
         input_excel_path,
         output_excel_path,
         scenarios=["Scenario"],
+        n_sim_years=None,
+        columns: List[str] = None,
+        template: CREDInputTemplate = None,
     ):
+        # n_sim_years: only read this many years of output, e.g. to drop the terminal years a run
+        # simulated past the period of interest. By default everything in the output is read.
+        # columns: only read these output variables (and Year), e.g. the values of get_output_var_lookup
+        # an analysis needs. By default every variable is read.
+        # template: the CREDInputTemplate the input was made from, to take the sectors and the input's
+        # Baseline from instead of reading them from the input (see CREDInput).
+        # The output can be in any exchange format (see cred_exchange), going by its suffix.
+        #
+        # Nothing is read here except the output's list of sheets: each sheet in data is read the first
+        # time it's used, and the input, sectors and n_sim_years are read when they're first needed
         self.input_excel_path = input_excel_path
         self.output_excel_path = output_excel_path
 
@@ -26,23 +89,69 @@ class CREDOutput:
         self.scenarios = scenarios
 
         if not os.path.exists(output_excel_path):
-            raise FileNotFoundError(f'Output Excel file not found at {self.user_output_excel}')
-
-        with pd.ExcelFile(output_excel_path) as xl:
-            self.data = {scenario: pd.read_excel(xl, sheet_name=scenario) for scenario in self.scenarios}
-            try:                
-                self.data['Baseline'] = pd.read_excel(xl, sheet_name='Baseline')
-                self.scenarios_with_baseline = list(set(scenarios).union({'Baseline'}))
-            except ValueError as e:
-                self.scenarios_with_baseline = self.scenarios
-
-        self.n_sim_years = self.data[self.scenarios_with_baseline[0]].shape[0]
-        self.input = CREDInput(input_excel_path, scenarios=scenarios)
-        self.input.truncate_to_n_years(self.n_sim_years)
-        self.sectors = self.input.sectors
-        self.n_sectors = self.input.n_sectors
+            raise FileNotFoundError(f'Output Excel file not found at {self.output_excel_path}')
+
+        sheet_names = list_sheets(output_excel_path)
+        missing = [scenario for scenario in scenarios if scenario not in sheet_names]
+        if missing:
+            raise ValueError(f'Scenarios {missing} not found in the output at {self.output_excel_path}')
+        has_baseline = 'Baseline' in sheet_names
+        self.scenarios_with_baseline = list(set(scenarios).union({'Baseline'})) if has_baseline else self.scenarios
+        self.columns = list(dict.fromkeys(['Year'] + list(columns))) if columns is not None else None
+        self.data = LazySheets(output_excel_path, self.scenarios_with_baseline, nrows=n_sim_years, columns=self.columns)
+
+        self.template = template
+        # {phase: seconds} for the run that produced this output, if it was just run (see cred_timing.PhaseTimer)
+        self.timings = None
+        self._input = None
+        self._sectors = None
+
+
+    @property
+    def n_sim_years(self):
+        return self.data[self.scenarios_with_baseline[0]].shape[0]
+
+    @property
+    def input(self):
+        if self._input is None:
+            self._input = CREDInput(self.input_excel_path, scenarios=self.scenarios, template=self.template)
+            self._input.truncate_to_n_years(self.n_sim_years)
+        return self._input
+
+    @property
+    def sectors(self):
+        if self._input is not None:
+            return self._input.sectors
+        if self.template is not None:
+            return self.template.sectors
+        if self._sectors is None:
+            self._sectors = CREDInput.read_sectors_from_cred_input(self.input_excel_path)
+        return self._sectors
+
+    @property
+    def n_sectors(self):
+        return len(self.sectors)
+
+    @property
+    def output_var_lookup(self):
         # Human readable names for output variables
-        self.output_var_lookup = self.get_output_var_lookup(self.sectors)
+        return self.get_output_var_lookup(self.sectors)
+
+
+    def split_scenarios(self, output_paths: Dict[str, Union[str, Path]], scenario_name='Scenario'):
+        # Write each scenario in this output to its own workbook, as though it had been run on its own,
+        # e.g. to unpack a batched run of Scenario_001, Scenario_002, ... into one output per member.
+        # output_paths maps each scenario in this output to the file to write it to, in the exchange format
+        # given by its suffix.
+        # Returns a dict of the scenarios that were written and where to
+        written = {}
+        for scenario, path in output_paths.items():
+            if scenario not in self.data:
+                LOGGER.warning(f'Scenario {scenario} is not in the output at {self.output_excel_path}')
+                continue
+            write_sheets(path, {scenario_name: self.data[scenario]})
+            written[scenario] = path
+        return written
 
 
     def plot(self, varlist=None, add_sector_shocks=True):
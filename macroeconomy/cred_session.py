@@ -0,0 +1,204 @@
+import time
+import queue
+import uuid
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from typing import Union, List, Callable
+from contextlib import contextmanager
+from subprocess import CalledProcessError, TimeoutExpired, PIPE, STDOUT
+
+from macroeconomy.cred_watchdog import CREDRunKilled
+
+LOGGER = logging.getLogger(__name__)
+
+# Every command sent to a session ends by printing this marker followed by a per-command token
+# and a status code, so we know when RunSimulations() has finished without quitting the engine
+SESSION_SENTINEL = '__CRED_SESSION_DONE__'
+
+
+class MatlabSession():
+    # A long-lived MATLAB process that receives commands over stdin.
+    #
+    # Starting MATLAB (and loading Dynare) often takes longer than the CRED simulation itself,
+    # so instead of launching one process per run we keep a session warm and send it
+    # `RunSimulations()` calls one at a time.
+    #
+    # The process is created with `process_factory(command, stdin=PIPE, stdout=PIPE, ...)`,
+    # which is subprocess.Popen by default. Anything that behaves like a Popen object can be
+    # swapped in, e.g. a small python script that echoes the sentinel, so that the pooling
+    # logic can be tested without MATLAB installed.
+
+    def __init__(
+        self,
+        command: List[str],
+        process_factory: Callable = subprocess.Popen,
+    ):
+        self.command = command
+        self.process_factory = process_factory
+        self.process = None
+        self.n_runs = 0
+        self._lines = None
+        self._reader = None
+
+    @staticmethod
+    def default_command(executable: Union[str, Path]):
+        return [str(executable), '-nodisplay', '-nodesktop', '-nosplash']
+
+    @staticmethod
+    def run_simulations_command(cred_location: Union[str, Path]):
+        return f"cd('{cred_location}'); RunSimulations();"
+
+    def start(self):
+        if self.is_alive():
+            return
+        LOGGER.info('Starting a persistent CRED engine session')
+        self.process = self.process_factory(
+            self.command,
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=STDOUT,
+            text=True,
+            bufsize=1
+        )
+        self.n_runs = 0
+        # Read stdout in a background thread so we can wait on it with a timeout
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_stdout, args=(self.process.stdout, self._lines), daemon=True)
+        self._reader.start()
+
+    @staticmethod
+    def _read_stdout(stream, lines):
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+        lines.put(None)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def run(self, command: str, timeout: float = None, watchdog=None):
+        # Run a single command in the session and block until it completes.
+        # Raises TimeoutExpired or CalledProcessError, like subprocess.run(..., check=True) would,
+        # so callers can treat a session and a one-off process the same way.
+        # With a CREDWatchdog the session is also killed (raising CREDRunKilled) if it runs out of memory or stalls
+        self.start()
+        monitor = watchdog.monitor(self.process.pid) if watchdog else None
+        token = uuid.uuid4().hex
+        wrapped = f"try; {command} disp('{SESSION_SENTINEL}:{token}:0'); catch err; disp(['{SESSION_SENTINEL}:{token}:1 ' err.message]); end"
+        self.process.stdin.write(wrapped + '\n')
+        self.process.stdin.flush()
+        self.n_runs += 1
+
+        end_time = None if timeout is None else time.monotonic() + timeout
+        output = []
+        marker = f'{SESSION_SENTINEL}:{token}:'
+        while True:
+            remaining = None if end_time is None else max(end_time - time.monotonic(), 0)
+            wait = remaining if monitor is None else min(watchdog.poll_interval, remaining if remaining is not None else watchdog.poll_interval)
+            try:
+                line = self._lines.get(timeout=wait)
+            except queue.Empty:
+                if remaining is not None and time.monotonic() >= end_time:
+                    # We can't interrupt a command that's running, so the session is lost
+                    self.close(force=True)
+                    raise TimeoutExpired(command, timeout, output=''.join(output))
+                try:
+                    monitor.check_or_kill()
+                except CREDRunKilled:
+                    self.close(force=True)
+                    raise
+                continue
+            if line is None:
+                returncode = self.process.wait()
+                self.process = None
+                raise CalledProcessError(returncode, command, output=''.join(output))
+            if marker in line:
+                status = line.split(marker, 1)[1].strip()
+                if status.startswith('0'):
+                    return ''.join(output)
+                raise CalledProcessError(1, command, output=''.join(output) + status[1:].strip())
+            LOGGER.debug(line.rstrip())
+            output.append(line)
+
+    def run_simulations(self, cred_location: Union[str, Path], timeout: float = None, watchdog=None):
+        return self.run(self.run_simulations_command(cred_location), timeout=timeout, watchdog=watchdog)
+
+    def close(self, force=False, timeout=30):
+        if self.process is None:
+            return
+        if not force and self.process.poll() is None:
+            try:
+                self.process.stdin.write('quit;\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=timeout)
+            except (OSError, TimeoutExpired):
+                force = True
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+
+class CREDSessionPool():
+    # A small pool of warm MATLAB sessions.
+    #
+    # Sessions are started lazily the first time they're needed and restarted if they die
+    # (or after max_runs_per_session runs, in case MATLAB leaks memory over a long experiment).
+    # Use it as a context manager, or call close() when you're done, so that no MATLAB
+    # processes are left behind.
+    #
+    # Note: sessions that run at the same time must not share a CRED directory.
+
+    def __init__(
+        self,
+        n_sessions: int = 1,
+        executable: Union[str, Path] = None,
+        command: List[str] = None,
+        process_factory: Callable = subprocess.Popen,
+        max_runs_per_session: int = None,
+    ):
+        if n_sessions < 1:
+            raise ValueError('A session pool needs at least one session')
+        if command is None:
+            if executable is None:
+                from macroeconomy.cred_model import MATLAB_EXECUTABLE
+                executable = MATLAB_EXECUTABLE
+            command = MatlabSession.default_command(executable)
+        self.n_sessions = n_sessions
+        self.max_runs_per_session = max_runs_per_session
+        self.sessions = [MatlabSession(command, process_factory) for _ in range(n_sessions)]
+        # Last in, first out: when runs are sequential we keep reusing the warmest session
+        self._idle = queue.LifoQueue()
+        for session in self.sessions:
+            self._idle.put(session)
+
+    @contextmanager
+    def session(self):
+        session = self._idle.get()
+        try:
+            if self.max_runs_per_session and session.n_runs >= self.max_runs_per_session:
+                LOGGER.info(f'Recycling an engine session after {session.n_runs} runs')
+                session.close()
+            session.start()
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def run(self, command: str, timeout: float = None, watchdog=None):
+        with self.session() as session:
+            return session.run(command, timeout=timeout, watchdog=watchdog)
+
+    def run_simulations(self, cred_location: Union[str, Path], timeout: float = None, watchdog=None):
+        with self.session() as session:
+            return session.run_simulations(cred_location, timeout=timeout, watchdog=watchdog)
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
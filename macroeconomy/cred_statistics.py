@@ -0,0 +1,237 @@
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+from typing import List, Dict
+
+LOGGER = logging.getLogger(__name__)
+
+# Quantiles reported across an ensemble, on top of the median
+DEFAULT_QUANTILES = [0.05, 0.25, 0.75, 0.95]
+
+
+def quantile_name(q: float):
+    return f'q{q:g}'
+
+
+def ensemble_statistics(cube: np.ndarray, baseline: np.ndarray = None, quantiles: List[float] = DEFAULT_QUANTILES):
+    # Summary statistics across the runs of an ensemble, for every variable and year at once.
+    # cube: (variable, run, year) array of results. baseline: (variable, year) array, optional.
+    # Returns {statistic: (variable, year) array} with mean, std, median, each quantile (see
+    # quantile_name) and, if given, the baseline. Missing values (NaN) are ignored
+    cube = np.asarray(cube, dtype=float)
+    if cube.ndim != 3:
+        raise ValueError(f'Expected a (variable, run, year) array, got shape {cube.shape}')
+    n_runs = cube.shape[1]
+    with warnings.catch_warnings():
+        # Years where every run is missing give NaN, which is what we want
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        stats = {
+            'mean': np.nanmean(cube, axis=1),
+            'std': np.nanstd(cube, axis=1, ddof=1) if n_runs > 1 else np.full(cube.shape[::2], np.nan),
+        }
+        levels = np.nanquantile(cube, [0.5] + list(quantiles), axis=1) if n_runs > 0 else np.full((1 + len(quantiles),) + cube.shape[::2], np.nan)
+    stats['median'] = levels[0]
+    for q, level in zip(quantiles, levels[1:]):
+        stats[quantile_name(q)] = level
+    if baseline is not None:
+        stats['baseline'] = np.asarray(baseline, dtype=float)
+    return stats
+
+
+def tidy_statistics(stats: Dict[str, np.ndarray], variables: List[str], years, labels: List[str] = None):
+    # ensemble_statistics output as a long dataframe: one row per variable, year and statistic, with
+    # the value and, where there's a baseline, the value minus the baseline. Spreads like std have no
+    # baseline delta. labels are human readable names for the variables, e.g. from get_output_var_lookup
+    n_variables, n_years = len(variables), len(years)
+    baseline = stats.get('baseline')
+    frames = []
+    for statistic, values in stats.items():
+        values = np.asarray(values, dtype=float).ravel()
+        delta = values - baseline.ravel() if baseline is not None and statistic != 'std' else np.full(values.shape, np.nan)
+        frames.append(pd.DataFrame({
+            'variable': np.repeat(variables, n_years),
+            'Year': np.tile(years, n_variables),
+            'statistic': statistic,
+            'value': values,
+            'baseline_delta': delta,
+        }))
+    out = pd.concat(frames, ignore_index=True)
+    if labels is not None:
+        out.insert(0, 'label', out['variable'].map(dict(zip(variables, labels))))
+    return out
+
+
+class WelfordAccumulator():
+    # Running count, mean and variance of a stream of equally shaped arrays, element by element, using
+    # Welford's algorithm. Missing values (NaN) are skipped. Accumulators can be merged, e.g. from
+    # different workers, with Chan et al.'s parallel update
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape)
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float)
+        present = ~np.isnan(values)
+        self.count += present
+        delta = np.where(present, values - self.mean, 0)
+        self.mean += np.divide(delta, self.count, out=np.zeros(self.shape), where=present)
+        self.m2 += np.where(present, delta * (values - self.mean), 0)
+        return self
+
+    def merge(self, other: 'WelfordAccumulator'):
+        if other.shape != self.shape:
+            raise ValueError(f'Cannot merge accumulators with shapes {self.shape} and {other.shape}')
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(count > 0, other.count / count, 0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * weight
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        # Sample variance (ddof=1), NaN where there are fewer than two values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class KLLSketch():
+    # Approximate quantiles of a stream of equally shaped arrays, element by element, in bounded memory:
+    # a KLL sketch (Karnin, Lang and Liberty 2016) per element. Every element sees the same number of
+    # values, so the elements share one set of compactors and are compacted together as arrays.
+    #
+    # Level h of the sketch holds values that each stand for 2**h of the originals. When a level is
+    # full its values are sorted and every other one is promoted, starting from a random offset. Memory
+    # is O(k) arrays whatever the length of the stream, and the rank error is around 1.7 / k.
+    #
+    # Missing values (NaN) are kept, sorted last, and left out when quantiles are calculated.
+    # Sketches with the same shape can be merged, e.g. from different workers
+
+    def __init__(self, shape, k: int = 200, seed: int = None):
+        if k < 8:
+            raise ValueError('k must be at least 8')
+        self.shape = tuple(shape)
+        self.k = k
+        self.n = 0
+        self.levels = [[]]     # per level, a list of arrays of the sketch's shape
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def __len__(self):
+        # Number of arrays held, not the number seen (that's n)
+        return sum(len(items) for items in self.levels)
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float)
+        if values.shape != self.shape:
+            raise ValueError(f'Expected an array of shape {self.shape}, got {values.shape}')
+        self.levels[0].append(values)
+        self.n += 1
+        self._compress()
+        return self
+
+    def merge(self, other: 'KLLSketch'):
+        if other.shape != self.shape:
+            raise ValueError(f'Cannot merge sketches with shapes {self.shape} and {other.shape}')
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        while len(self) > sum(self._capacity(level) for level in range(len(self.levels))):
+            for level, items in enumerate(self.levels):
+                if len(items) >= self._capacity(level):
+                    break
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items = np.sort(np.stack(self.levels[level]), axis=0)
+            # An odd one out stays where it is
+            keep = [items[-1]] if len(items) % 2 else []
+            pairs = items[:len(items) - len(keep)]
+            offset = self._rng.integers(2)
+            self.levels[level + 1].extend(pairs[offset::2])
+            self.levels[level] = keep
+
+    def quantile(self, quantiles: List[float]):
+        # (quantile, *shape) array of approximate quantiles. NaN where an element has no values
+        items = [(values, 2 ** level) for level, level_items in enumerate(self.levels) for values in level_items]
+        if not items:
+            return np.full((len(quantiles),) + self.shape, np.nan)
+        values = np.stack([values for values, _ in items])
+        weights = np.array([weight for _, weight in items], dtype=float).reshape((-1,) + (1,) * len(self.shape))
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        weights = np.where(np.isnan(values), 0, np.take_along_axis(np.broadcast_to(weights, values.shape), order, axis=0))
+        cumulative = np.cumsum(weights, axis=0)
+        total = cumulative[-1]
+        out = np.empty((len(quantiles),) + self.shape)
+        for i, q in enumerate(quantiles):
+            # The first value whose cumulative weight reaches q of the total
+            position = np.minimum((cumulative < q * total).sum(axis=0), len(values) - 1)
+            out[i] = np.take_along_axis(values, position[np.newaxis], axis=0)[0]
+        out[:, total == 0] = np.nan
+        return out
+
+
+class EnsembleAccumulator():
+    # Statistics of an ensemble's results, updated one run at a time so that runs can be discarded
+    # as they're read: Welford means and variances and KLL quantile sketches, per variable and year.
+    # Accumulators from different workers can be merged. statistics() gives the same statistics
+    # as ensemble_statistics, with approximate quantiles
+
+    def __init__(self, variables: List[str], years, k: int = 200, seed: int = None):
+        self.variables = list(variables)
+        self.years = np.asarray(years)
+        shape = (len(self.variables), len(self.years))
+        self.moments = WelfordAccumulator(shape)
+        self.sketch = KLLSketch(shape, k=k, seed=seed)
+
+    @property
+    def n(self):
+        return self.sketch.n
+
+    def update(self, data: pd.DataFrame):
+        # Add one run's results: a dataframe with a Year column and a column per variable, e.g.
+        # CREDOutput.data[scenario]. Missing variables and years are NaN, others are ignored
+        values = data.set_index('Year').reindex(index=self.years, columns=self.variables).to_numpy(dtype=float).T
+        self.moments.update(values)
+        self.sketch.update(values)
+        return self
+
+    def merge(self, other: 'EnsembleAccumulator'):
+        if other.variables != self.variables or not np.array_equal(other.years, self.years):
+            raise ValueError('Cannot merge accumulators with different variables or years')
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def statistics(self, baseline: np.ndarray = None, quantiles: List[float] = DEFAULT_QUANTILES):
+        # {statistic: (variable, year) array}, as from ensemble_statistics
+        levels = self.sketch.quantile([0.5] + list(quantiles))
+        stats = {
+            'mean': np.where(self.moments.count > 0, self.moments.mean, np.nan),
+            'std': self.moments.std,
+            'median': levels[0],
+        }
+        for q, level in zip(quantiles, levels[1:]):
+            stats[quantile_name(q)] = level
+        if baseline is not None:
+            stats['baseline'] = np.asarray(baseline, dtype=float)
+        return stats
@@ -0,0 +1,87 @@
+import json
+import time
+import logging
+import pandas as pd
+from pathlib import Path
+from typing import Union, List, Dict
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PhaseTimer():
+    # Wall-clock time spent in the phases of a model run, e.g. setup, execute and teardown, and the
+    # steps inside them. Phases nest: a phase started inside another is recorded as 'outer.inner'.
+    # Time spent in a phase more than once is added up.
+    #
+    # timings is a plain {phase: seconds} dict in the order the phases started, so it can be pickled
+    # back from worker processes and tabulated (see timing_table)
+
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name: str):
+        self._stack.append(name)
+        full_name = '.'.join(self._stack)
+        self.timings.setdefault(full_name, 0.0)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timings[full_name] += time.perf_counter() - start
+            self._stack.pop()
+
+    def record(self, name: str, seconds: float):
+        # Add a time measured some other way, inside whatever phase we're in
+        full_name = '.'.join(self._stack + [name])
+        self.timings[full_name] = self.timings.get(full_name, 0.0) + seconds
+
+    def __repr__(self):
+        timings = ', '.join(f'{name}={seconds:.3f}s' for name, seconds in self.timings.items())
+        return f'PhaseTimer({timings})'
+
+
+def timing_table(timings: Dict[str, Dict[str, float]]):
+    # {run name: PhaseTimer.timings} as a dataframe with a row per run and a column per phase, in the
+    # order the phases first appear. Phases a run didn't go through are NaN
+    df = pd.DataFrame.from_dict(timings, orient='index')
+    df.index.name = 'run'
+    return df
+
+
+def timing_summary(table: pd.DataFrame):
+    # Per phase: the number of runs that went through it, the total, mean, median and maximum
+    # seconds, and the share of all the time in top-level phases
+    top_level = [phase for phase in table.columns if '.' not in phase]
+    total = table[top_level].sum().sum()
+    summary = pd.DataFrame({
+        'n_runs': table.count(),
+        'total': table.sum(),
+        'mean': table.mean(),
+        'median': table.median(),
+        'max': table.max(),
+    })
+    summary['share'] = summary['total'] / total if total > 0 else float('nan')
+    summary.index.name = 'phase'
+    return summary
+
+
+def write_timing_report(path: Union[str, Path], table: pd.DataFrame, experiment_timings: Dict[str, float] = None):
+    # Write a timing report. As .json: the experiment's own timings, the summary and each run's timings.
+    # As .csv: each run's timings, one row per run
+    path = Path(path)
+    if path.suffix == '.csv':
+        table.to_csv(path)
+    elif path.suffix == '.json':
+        report = {
+            'experiment': experiment_timings or {},
+            'summary': json.loads(timing_summary(table).to_json(orient='index')),
+            'runs': json.loads(table.to_json(orient='index')),
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        raise ValueError(f'Timing reports are written as .json or .csv, not {path.suffix}')
+    return path
@@ -0,0 +1,174 @@
+import os
+import time
+import signal
+import logging
+from subprocess import TimeoutExpired
+
+LOGGER = logging.getLogger(__name__)
+
+# Why a run was killed, as recorded on MacroEconomyCRED.kill_reason and CREDRunResult.kill_reason
+KILL_REASONS = ['timeout', 'memory', 'stall']
+
+
+def _import_psutil():
+    try:
+        import psutil
+        return psutil
+    except ImportError:
+        LOGGER.warning('psutil is not installed: the CRED watchdog can only enforce timeouts, not memory limits or stalls')
+        return None
+
+
+class CREDRunKilled(RuntimeError):
+    # Raised when a model run is killed by its watchdog or timeout. reason is one of KILL_REASONS
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class CREDWatchdog():
+    # Watches the engine process during a model run and kills it (with any child processes) if it
+    # - uses more than max_rss_mb of memory, summed over the process and its children
+    # - stops making progress: less than min_cpu_seconds of CPU time used in stall_timeout seconds
+    # - runs for longer than the run's timeout
+    #
+    # A hung MATLAB otherwise holds a worker for hours, and one run that blows up its memory can
+    # push the whole node into swap. The process is sampled every poll_interval seconds.
+    #
+    # Memory and stall checks need psutil. Without it only the timeout is enforced.
+    # Watchdogs hold only settings, so one can be shared by every run in an experiment.
+
+    def __init__(
+        self,
+        max_rss_mb: float = None,
+        stall_timeout: float = None,
+        min_cpu_seconds: float = 1.0,
+        poll_interval: float = 1.0,
+    ):
+        if poll_interval <= 0:
+            raise ValueError('poll_interval must be positive')
+        self.max_rss_mb = max_rss_mb
+        self.stall_timeout = stall_timeout
+        self.min_cpu_seconds = min_cpu_seconds
+        self.poll_interval = poll_interval
+
+    def monitor(self, pid: int, timeout: float = None):
+        return ProcessMonitor(self, pid, timeout)
+
+    def watch(self, process, timeout: float = None):
+        # Wait for a Popen process to finish, checking on it as it runs.
+        # Returns its return code, or kills it and raises CREDRunKilled
+        monitor = self.monitor(process.pid, timeout)
+        while True:
+            try:
+                returncode = process.wait(timeout=self.poll_interval)
+                LOGGER.debug(f'Engine process finished. {monitor.summary()}')
+                return returncode
+            except TimeoutExpired:
+                pass
+            try:
+                monitor.check_or_kill()
+            except CREDRunKilled:
+                process.wait()
+                raise
+
+    def __repr__(self):
+        return f'CREDWatchdog(max_rss_mb={self.max_rss_mb}, stall_timeout={self.stall_timeout})'
+
+
+class ProcessMonitor():
+    # The watchdog's view of one running process, from the start of a model run
+
+    def __init__(self, watchdog: CREDWatchdog, pid: int, timeout: float = None):
+        self.watchdog = watchdog
+        self.pid = pid
+        self.timeout = timeout
+        self.start_time = time.monotonic()
+        self.last_progress_time = self.start_time
+        self.last_progress_cpu = None
+        self.peak_rss_mb = 0
+        self.cpu_seconds = 0
+        psutil = _import_psutil() if watchdog.max_rss_mb or watchdog.stall_timeout else None
+        self._psutil = psutil
+        self._process = None
+        if psutil:
+            try:
+                self._process = psutil.Process(pid)
+            except psutil.NoSuchProcess:
+                pass
+
+    def _usage(self):
+        # Memory and CPU time of the process and all of its children, e.g. MATLAB under a shell
+        rss, cpu = 0, 0
+        processes = [self._process]
+        try:
+            processes += self._process.children(recursive=True)
+        except self._psutil.NoSuchProcess:
+            return None
+        for p in processes:
+            try:
+                rss += p.memory_info().rss
+                times = p.cpu_times()
+                cpu += times.user + times.system
+            except (self._psutil.NoSuchProcess, self._psutil.AccessDenied):
+                pass
+        return rss / 2**20, cpu
+
+    def check(self):
+        # Returns (reason, message) if the process should be killed, otherwise None
+        now = time.monotonic()
+        elapsed = now - self.start_time
+        if self.timeout and elapsed > self.timeout:
+            return 'timeout', f'The model run took longer than the timeout of {self.timeout} seconds'
+        if not self._process:
+            return None
+        usage = self._usage()
+        if usage is None:
+            return None
+        rss_mb, cpu = usage
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+        self.cpu_seconds = cpu
+        if self.watchdog.max_rss_mb and rss_mb > self.watchdog.max_rss_mb:
+            return 'memory', f'The model run used {rss_mb:.0f} MB of memory, over the limit of {self.watchdog.max_rss_mb} MB'
+        if self.watchdog.stall_timeout:
+            if self.last_progress_cpu is None or cpu - self.last_progress_cpu >= self.watchdog.min_cpu_seconds:
+                self.last_progress_cpu = cpu
+                self.last_progress_time = now
+            elif now - self.last_progress_time > self.watchdog.stall_timeout:
+                return 'stall', f'The model run used less than {self.watchdog.min_cpu_seconds} s of CPU in {self.watchdog.stall_timeout} s and looks stuck'
+        return None
+
+    def check_or_kill(self):
+        problem = self.check()
+        if problem:
+            reason, message = problem
+            LOGGER.info(f'Killing the engine process: {message}. {self.summary()}')
+            self.kill()
+            raise CREDRunKilled(reason, message)
+
+    def kill(self):
+        # Kill the process and everything it started
+        if self._process:
+            try:
+                processes = self._process.children(recursive=True) + [self._process]
+            except self._psutil.NoSuchProcess:
+                processes = []
+            for p in processes:
+                try:
+                    p.kill()
+                except self._psutil.NoSuchProcess:
+                    pass
+            self._psutil.wait_procs(processes, timeout=10)
+            return
+        try:
+            # Processes started with start_new_session=True lead their own process group
+            if hasattr(os, 'killpg') and os.getpgid(self.pid) == self.pid:
+                os.killpg(self.pid, signal.SIGKILL)
+            else:
+                os.kill(self.pid, signal.SIGKILL if hasattr(signal, 'SIGKILL') else signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def summary(self):
+        return f'Elapsed {time.monotonic() - self.start_time:.1f} s, CPU {self.cpu_seconds:.1f} s, peak memory {self.peak_rss_mb:.0f} MB'
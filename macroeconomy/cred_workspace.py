@@ -0,0 +1,168 @@
+import os
+import queue
+import shutil
+import logging
+import tempfile
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Union, List
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+# Files that MacroEconomyCRED._setup edits (and that CRED writes) in the model directory.
+# Every workspace gets its own private copy of these. Patterns are relative to the model directory
+PRIVATE_FILES = [
+    'RunSimulations.m',
+    'DGE_CRED_Model.mod',
+    'Functions/Simulation_Model.m',
+    'ExcelFiles/*.xlsx',
+    'ExcelFiles/*.mat',
+    'Functions/CREDReadSheet.m',    # see cred_exchange.EXCHANGE_HOOKS
+    'Functions/CREDWriteSheet.m',
+]
+
+# Output written by Dynare when it preprocesses and solves the model. These are left behind in the
+# source directory by previous runs: we never link them into a workspace since Dynare would write
+# straight through the link and modify the source directory
+DYNARE_OUTPUTS = [
+    'DGE_CRED_Model',
+    '+DGE_CRED_Model',
+    'DGE_CRED_Model.log',
+    'DGE_CRED_Model.m',
+    'DGE_CRED_Model_*.m',
+    'DGE_CRED_Model_*.mat',
+    '.cred_dynare_fingerprint',   # see DynareCache
+]
+
+LINK_MODES = ['hardlink', 'symlink', 'copy']
+
+
+class CREDWorkspace():
+    # A private clone of the CRED model directory, so that several runs can happen at once
+    # without clobbering each other's RunSimulations.m, .mod file and Excel files.
+    #
+    # Immutable files (the bulk of the model and Dynare code) are hardlinked or symlinked from the
+    # source directory and only the files listed in private_files are copied. Hardlinks are
+    # preferred: they're cheap and MATLAB sees ordinary files. If they can't be made (e.g. the
+    # scratch_dir is a tmpfs like /dev/shm, on a different device to the source) we fall back
+    # to symlinks.
+    #
+    # WARNING: a linked file that's written in place modifies the source directory too. If you
+    # edit other model files before a run, add them to private_files.
+
+    def __init__(
+        self,
+        source_dir: Union[str, Path] = None,
+        scratch_dir: Union[str, Path] = None,
+        link_mode: str = 'hardlink',
+        private_files: List[str] = PRIVATE_FILES,
+        exclude: List[str] = DYNARE_OUTPUTS,
+    ):
+        if source_dir is None:
+            from macroeconomy.cred_model import CRED_LOCATION
+            source_dir = CRED_LOCATION
+        if not os.path.isdir(source_dir):
+            raise ValueError(f'CRED directory does not exist at {source_dir}')
+        if link_mode not in LINK_MODES:
+            raise ValueError(f'link_mode must be one of {LINK_MODES}')
+        self.source_dir = Path(source_dir)
+        self.scratch_dir = scratch_dir
+        self.link_mode = link_mode
+        self.private_files = private_files
+        self.exclude = exclude
+        self.path = None
+
+    def create(self):
+        if self.path:
+            return self.path
+        if self.scratch_dir:
+            os.makedirs(self.scratch_dir, exist_ok=True)
+        self.path = Path(tempfile.mkdtemp(prefix='cred_workspace_', dir=self.scratch_dir))
+        LOGGER.debug(f'Creating CRED workspace at {self.path}')
+        link_mode = self.link_mode
+
+        for root, dirs, files in os.walk(self.source_dir):
+            rel_root = Path(root).relative_to(self.source_dir)
+            dirs[:] = [d for d in dirs if not self._matches(rel_root / d, self.exclude)]
+            os.makedirs(Path(self.path, rel_root), exist_ok=True)
+            for f in files:
+                rel_path = rel_root / f
+                if self._matches(rel_path, self.exclude):
+                    continue
+                source, target = Path(self.source_dir, rel_path), Path(self.path, rel_path)
+                if self._matches(rel_path, self.private_files):
+                    shutil.copy2(source, target)
+                else:
+                    link_mode = self._link(source, target, link_mode)
+        return self.path
+
+    @staticmethod
+    def _matches(rel_path, patterns):
+        rel_path = rel_path.as_posix()
+        return any(fnmatch(rel_path, pattern) for pattern in patterns)
+
+    @staticmethod
+    def _link(source, target, link_mode):
+        # Returns the link mode that worked, so we don't keep retrying hardlinks across devices
+        if link_mode == 'hardlink':
+            try:
+                os.link(source, target)
+                return link_mode
+            except OSError:
+                LOGGER.debug('Could not hardlink into the CRED workspace. Falling back to symlinks')
+                link_mode = 'symlink'
+        if link_mode == 'symlink':
+            try:
+                os.symlink(os.path.abspath(source), target)
+                return link_mode
+            except OSError:
+                LOGGER.debug('Could not symlink into the CRED workspace. Falling back to copies')
+                link_mode = 'copy'
+        shutil.copy2(source, target)
+        return link_mode
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+
+    def __enter__(self):
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+
+class CREDWorkspacePool():
+    # A fixed set of workspaces cloned from the same CRED directory, handed out one run at a time.
+    # Workspaces are created lazily and reused between runs, since only the private files change.
+
+    def __init__(self, n_workspaces: int = 1, **workspace_kwargs):
+        if n_workspaces < 1:
+            raise ValueError('A workspace pool needs at least one workspace')
+        self.n_workspaces = n_workspaces
+        self.workspaces = [CREDWorkspace(**workspace_kwargs) for _ in range(n_workspaces)]
+        self._idle = queue.LifoQueue()
+        for workspace in self.workspaces:
+            self._idle.put(workspace)
+
+    @contextmanager
+    def workspace(self):
+        workspace = self._idle.get()
+        try:
+            workspace.create()
+            yield workspace
+        finally:
+            self._idle.put(workspace)
+
+    def cleanup(self):
+        for workspace in self.workspaces:
+            workspace.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
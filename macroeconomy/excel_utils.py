@@ -0,0 +1,268 @@
+import os
+import re
+import shutil
+import logging
+import zipfile
+import tempfile
+import posixpath
+import xml.etree.ElementTree as ET
+import pandas as pd
+from pathlib import Path
+from collections import OrderedDict
+from typing import Union, List
+
+LOGGER = logging.getLogger(__name__)
+
+# Sheet XML is streamed through in chunks of this many bytes
+CHUNK_SIZE = 2**20
+
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# The tags the truncation acts on inside a sheet: row starts, cell values, the sheet's dimension and the end of its data
+_SHEET_TAG = re.compile(rb'<(?:\w+:)?(row|v|is|dimension)\b([^>]*?)(/?)>|</(?:\w+:)?sheetData>')
+_ROW_NUMBER = re.compile(rb'\br="(\d+)"')
+_DIMENSION_REF = re.compile(rb'(\bref="[A-Z]+(\d+):[A-Z]+)(\d+)(")')
+_CALC_CHAIN = re.compile(rb'<(?:Relationship|Override)\b[^>]*calcChain[^>]*/>')
+# Row starts and cell values, to count the rows that hold data
+_ROW_OR_VALUE = re.compile(rb'<(?:\w+:)?(row|v|is)\b([^>]*?)(/?)>')
+
+
+def truncate_workbook(
+    input_file: Union[str, Path],
+    output_file: Union[str, Path],
+    sheet_names: List[str],
+    n_rows: int
+):
+    # Write a copy of input_file to output_file (which may be the same file) keeping only the header
+    # row and the first n_rows rows of each sheet in sheet_names.
+    #
+    # This edits the xlsx package directly: the named sheets' XML is streamed through, dropping rows
+    # past the cut, and every other part of the workbook is copied across byte for byte, so nothing
+    # is ever loaded into a spreadsheet library. That's much faster than reading the workbook into
+    # pandas and writing sheets back with openpyxl, and keeps everything openpyxl would drop
+    # (comments, external links, ...). The calculation chain is removed since it may refer to cells
+    # that no longer exist; Excel rebuilds it.
+    #
+    # Raises ValueError if a sheet is missing or has fewer than n_rows rows. output_file is untouched
+    # if anything goes wrong.
+    output_file = Path(output_file)
+    fd, tmp_path = tempfile.mkstemp(prefix='.incomplete_', suffix='.xlsx', dir=output_file.parent)
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(input_file) as zin, zipfile.ZipFile(tmp_path, 'w') as zout:
+            parts = sheet_parts(zin)
+            missing = [name for name in sheet_names if name not in parts]
+            if missing:
+                raise ValueError(f'Worksheets {missing} not found in {input_file}')
+            truncate = {parts[name]: name for name in sheet_names}
+            # The calculation chain's entries in the package's content types and the workbook's relationships go with it
+            has_calc_chain = any(_is_calc_chain(name) for name in zin.namelist())
+            calc_chain_references = ['[Content_Types].xml', _rels_path(workbook_part(zin))]
+
+            for info in zin.infolist():
+                if _is_calc_chain(info.filename):
+                    continue
+                with zin.open(info) as source, zout.open(_copy_info(info), 'w') as dest:
+                    if info.filename in truncate:
+                        n_available = _truncate_sheet_xml(source, dest, n_rows)
+                        if n_available < n_rows:
+                            raise ValueError(f"Sheet {truncate[info.filename]} in {input_file} has fewer rows ({n_available}) than the requested truncation ({n_rows})")
+                    elif has_calc_chain and info.filename in calc_chain_references:
+                        dest.write(_CALC_CHAIN.sub(b'', source.read()))
+                    else:
+                        shutil.copyfileobj(source, dest, CHUNK_SIZE)
+        os.replace(tmp_path, output_file)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class WorkbookIndex():
+    # What we need to know about a workbook's layout, without reading it into pandas each time: its sheet
+    # names, each sheet's columns (the header row) and number of data rows, and the contents of small sheets
+    # that are read whole, like a CRED input's Content sheet.
+    #
+    # Use get() to fetch a workbook's index from the registry, which holds one per workbook, keyed by its
+    # path, size and modification time so that a changed workbook is indexed again. Each fact is worked out
+    # the first time it's asked for and then remembered. Treat what's returned as read-only.
+    #
+    # An ensemble indexes a new input workbook for every run, so the registry only keeps the
+    # REGISTRY_SIZE workbooks used most recently
+
+    REGISTRY_SIZE = 16
+    _registry = OrderedDict()
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            self._parts = sheet_parts(zf)
+        self.sheet_names = list(self._parts)
+        self._n_rows = {}
+        self._columns = {}
+        self._sheets = {}
+
+    @classmethod
+    def get(cls, path: Union[str, Path]):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in cls._registry:
+            # Drop the index of an older version of the workbook
+            for old_key in [k for k in cls._registry if k[0] == key[0]]:
+                del cls._registry[old_key]
+            cls._registry[key] = cls(path)
+            while len(cls._registry) > cls.REGISTRY_SIZE:
+                cls._registry.popitem(last=False)
+        cls._registry.move_to_end(key)
+        return cls._registry[key]
+
+    @classmethod
+    def clear(cls):
+        cls._registry.clear()
+
+    def _check_sheet(self, sheet_name):
+        if sheet_name not in self._parts:
+            raise ValueError(f'Worksheet {sheet_name} not found in {self.path}')
+
+    def n_rows(self, sheet_name: str):
+        # Rows of data below the header row, as pandas would read them. Counted by streaming the sheet's XML
+        self._check_sheet(sheet_name)
+        if sheet_name not in self._n_rows:
+            with zipfile.ZipFile(self.path) as zf, zf.open(self._parts[sheet_name]) as source:
+                self._n_rows[sheet_name] = _count_sheet_rows(source)
+        return self._n_rows[sheet_name]
+
+    def columns(self, sheet_name: str):
+        self._check_sheet(sheet_name)
+        if sheet_name not in self._columns:
+            if sheet_name in self._sheets:
+                self._columns[sheet_name] = list(self._sheets[sheet_name].columns)
+            else:
+                # With no rows pandas leaves out columns with no header, so read one
+                self._columns[sheet_name] = list(pd.read_excel(self.path, sheet_name=sheet_name, nrows=1).columns)
+        return self._columns[sheet_name]
+
+    def sheet(self, sheet_name: str):
+        # A whole sheet as a dataframe. Only for small sheets: it's kept for the life of the index
+        self._check_sheet(sheet_name)
+        if sheet_name not in self._sheets:
+            self._sheets[sheet_name] = pd.read_excel(self.path, sheet_name=sheet_name)
+        return self._sheets[sheet_name]
+
+
+def workbook_part(zf: zipfile.ZipFile):
+    # The path of the workbook part in the package, usually xl/workbook.xml
+    rels = ET.fromstring(zf.read('_rels/.rels'))
+    for rel in rels.iter(f'{{{_PACKAGE_REL_NS}}}Relationship'):
+        if rel.get('Type', '').endswith('/officeDocument'):
+            return _resolve('', rel.get('Target'))
+    raise ValueError(f'No workbook found in {zf.filename}')
+
+
+def sheet_parts(zf: zipfile.ZipFile):
+    # {sheet name: path of the sheet's XML in the package}
+    workbook = workbook_part(zf)
+    targets = {
+        rel.get('Id'): _resolve(posixpath.dirname(workbook), rel.get('Target'))
+        for rel in ET.fromstring(zf.read(_rels_path(workbook))).iter(f'{{{_PACKAGE_REL_NS}}}Relationship')
+    }
+    return {
+        sheet.get('name'): targets[sheet.get(f'{{{_REL_NS}}}id')]
+        for sheet in ET.fromstring(zf.read(workbook)).iter(f'{{{_MAIN_NS}}}sheet')
+    }
+
+
+def _resolve(base_dir, target):
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _rels_path(part):
+    return posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+
+
+def _is_calc_chain(name):
+    return posixpath.basename(name) == 'calcChain.xml'
+
+
+def _copy_info(info: zipfile.ZipInfo):
+    # An entry for the output with the same name, date and compression as the input's
+    out = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    out.compress_type = info.compress_type
+    out.external_attr = info.external_attr
+    return out
+
+
+def _truncate_sheet_xml(source, dest, n_rows: int, chunk_size: int = CHUNK_SIZE):
+    # Copy sheet XML from source to dest, dropping rows more than n_rows below the first (header) row and
+    # shrinking the sheet's dimension to match. Returns how many rows there were below the header, up to the
+    # last row with values: as in _count_sheet_rows, rows that only have formatting don't count
+    header_row = None
+    last_row = 0
+    last_filled_row = 0
+    skipping = False
+    buffer = b''
+    eof = False
+    while not eof:
+        chunk = source.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        pos = 0
+        for match in _SHEET_TAG.finditer(buffer):
+            if not skipping:
+                dest.write(buffer[pos:match.start()])
+            pos = match.end()
+            tag = match.group(0)
+            if match.group(1) == b'row':
+                number = _ROW_NUMBER.search(match.group(2))
+                last_row = int(number.group(1)) if number else last_row + 1
+                header_row = last_row if header_row is None else header_row
+                skipping = last_row > header_row + n_rows
+            elif match.group(1) in [b'v', b'is']:
+                if not match.group(3):
+                    last_filled_row = last_row
+            elif match.group(1) == b'dimension':
+                # The dimension comes before the rows: it starts at the header row
+                tag = _DIMENSION_REF.sub(lambda m: m.group(1) + str(min(int(m.group(3)), int(m.group(2)) + n_rows)).encode() + m.group(4), tag)
+            else:
+                skipping = False
+            if not skipping:
+                dest.write(tag)
+        # Hold back anything after the last complete tag, in case a tag we act on is split across chunks
+        keep_from = len(buffer) if eof else max(pos, buffer.rfind(b'<'))
+        if not skipping:
+            dest.write(buffer[pos:keep_from])
+        buffer = buffer[keep_from:]
+    if header_row is None:
+        return 0
+    return last_filled_row - header_row
+
+
+def _count_sheet_rows(source, chunk_size: int = CHUNK_SIZE):
+    # How many rows below the first row with values there are, up to the last row with values, in a sheet's
+    # XML. Rows that only have formatting don't count
+    first_row = None
+    last_row = 0
+    last_filled_row = 0
+    buffer = b''
+    eof = False
+    while not eof:
+        chunk = source.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        pos = 0
+        for match in _ROW_OR_VALUE.finditer(buffer):
+            pos = match.end()
+            if match.group(1) == b'row':
+                number = _ROW_NUMBER.search(match.group(2))
+                last_row = int(number.group(1)) if number else last_row + 1
+            elif not match.group(3):
+                first_row = last_row if first_row is None else first_row
+                last_filled_row = last_row
+        # Keep anything after the last complete tag, in case a tag is split across chunks
+        buffer = buffer[len(buffer) if eof else max(pos, buffer.rfind(b'<')):]
+    if first_row is None:
+        return 0
+    return last_filled_row - first_row
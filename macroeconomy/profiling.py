@@ -0,0 +1,176 @@
+import io
+import os
+import re
+import time
+import atexit
+import pstats
+import cProfile
+import logging
+import functools
+import pandas as pd
+from pathlib import Path
+from typing import Union
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+# Set this to a directory to profile the pipeline's stages for the whole process, e.g.
+#   MACROECONOMY_PROFILE=profiles python generate_inputs.py
+PROFILE_ENV_VAR = 'MACROECONOMY_PROFILE'
+
+# The profiling session in progress, if there is one. Stages check this and nothing else when profiling is off
+_SESSION = None
+
+
+class ProfilingSession():
+    # cProfile statistics for each stage of the pipeline (see profiled), collected while the session is
+    # active. Each stage gets its own profiler, which only runs while that stage is the innermost one in
+    # progress: when a stage calls another, the outer stage's profiler is paused. So every stage's
+    # statistics hold only its own time, and between them they cover the time spent in stages.
+    #
+    # write() saves each stage's statistics as <stage>.prof, for pstats or snakeviz, and summary.txt:
+    # each stage's calls and time, then the functions with the most time of their own across all stages.
+    # Only the thread that started a stage is profiled
+
+    def __init__(self, output_dir: Union[str, Path], n_top: int = 40):
+        self.output_dir = Path(output_dir)
+        self.n_top = n_top
+        self.profiles = {}       # stage -> cProfile.Profile
+        self.calls = {}          # stage -> number of calls
+        self.wall_time = {}      # stage -> seconds, including nested stages
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name: str):
+        if self._stack:
+            self.profiles[self._stack[-1]].disable()
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._stack.append(name)
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.wall_time[name] = self.wall_time.get(name, 0.0) + time.perf_counter() - start
+            self._stack.pop()
+            if self._stack:
+                self.profiles[self._stack[-1]].enable()
+
+    def stats(self, name: str = None):
+        # pstats.Stats for one stage, or all stages together
+        names = [name] if name else [n for n in self.profiles if self.profiles[n].getstats()]
+        if not names:
+            return None
+        stats = pstats.Stats(self.profiles[names[0]])
+        for other in names[1:]:
+            stats.add(self.profiles[other])
+        return stats
+
+    def stage_summary(self):
+        # Per stage: calls, total wall time (including nested stages) and time profiled in the stage itself
+        own_time = {name: self.stats(name).total_tt if profile.getstats() else 0.0 for name, profile in self.profiles.items()}
+        df = pd.DataFrame({
+            'calls': pd.Series(self.calls),
+            'wall_time': pd.Series(self.wall_time),
+            'own_time': pd.Series(own_time),
+        })
+        df.index.name = 'stage'
+        return df
+
+    def hot_functions(self, n: int = None):
+        # The functions with the most time of their own, across all stages, as a dataframe
+        stats = self.stats()
+        if stats is None:
+            return pd.DataFrame(columns=['function', 'ncalls', 'tottime', 'cumtime'])
+        rows = [
+            {'function': pstats.func_std_string(func), 'ncalls': nc, 'tottime': tt, 'cumtime': ct}
+            for func, (cc, nc, tt, ct, callers) in stats.stats.items()
+        ]
+        return pd.DataFrame(rows).sort_values('tottime', ascending=False).head(n if n else self.n_top).reset_index(drop=True)
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, profile in self.profiles.items():
+            if profile.getstats():
+                profile.dump_stats(Path(self.output_dir, f'{_file_name(name)}.prof'))
+        summary = io.StringIO()
+        summary.write('Time by stage (seconds)\n\n')
+        summary.write(self.stage_summary().to_string(float_format='{:.3f}'.format))
+        summary.write(f'\n\nTop {self.n_top} functions by time of their own, across all stages\n\n')
+        summary.write(self.hot_functions().to_string(float_format='{:.3f}'.format))
+        summary.write('\n')
+        path = Path(self.output_dir, 'summary.txt')
+        path.write_text(summary.getvalue())
+        LOGGER.info(f'Wrote profiles of {len(self.profiles)} stages to {self.output_dir}')
+        return path
+
+
+def _file_name(stage):
+    return re.sub(r'[^\w.-]', '_', stage)
+
+
+def profiling_enabled():
+    return _SESSION is not None
+
+
+@contextmanager
+def profiling(output_dir: Union[str, Path], n_top: int = 40):
+    # Profile the pipeline's stages while in this context, and write the results to output_dir when it ends:
+    #
+    #   with profiling('profiles'):
+    #       generate_many_cred_inputs(...)
+    #
+    # Sessions don't nest: inside another session, this one does nothing
+    global _SESSION
+    if _SESSION is not None:
+        LOGGER.warning(f'Already profiling to {_SESSION.output_dir}. Not starting another profiling session')
+        yield _SESSION
+        return
+    _SESSION = ProfilingSession(output_dir, n_top=n_top)
+    session = _SESSION
+    try:
+        yield session
+    finally:
+        _SESSION = None
+        session.write()
+
+
+@contextmanager
+def profile_stage(name: str):
+    # Profile a block of code as a stage, if profiling is on
+    if _SESSION is None:
+        yield
+        return
+    with _SESSION.stage(name):
+        yield
+
+
+def profiled(name: str = None):
+    # Decorator that profiles every call of a function as a stage, if profiling is on. The stage is named
+    # after the function (module.qualname) unless given. When profiling is off, the only cost is checking that
+    def decorator(func):
+        stage = name if name else f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _SESSION is None:
+                return func(*args, **kwargs)
+            with _SESSION.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_from_environment():
+    # Profile the whole process if the environment variable is set, writing the results when it exits
+    global _SESSION
+    output_dir = os.environ.get(PROFILE_ENV_VAR)
+    if output_dir and _SESSION is None:
+        _SESSION = ProfilingSession(output_dir)
+        atexit.register(_SESSION.write)
+        LOGGER.info(f'Profiling pipeline stages to {output_dir}')
+
+
+_start_from_environment()
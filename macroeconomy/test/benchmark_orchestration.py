@@ -0,0 +1,178 @@
+# Benchmarks for the python side of running CRED: MacroEconomyCRED.run, CREDController.run_experiment and
+# post-processing the ensemble, with a fake CRED in place of MATLAB.
+#
+# Not a unittest: this takes a while. Run it as a script, e.g.
+#   python -m macroeconomy.test.benchmark_orchestration --sizes 10 100 1000 --output orchestration.json
+#
+# CRED_LOCATION is pointed at a generated model directory (see MockEngine.make_model_directory) and the model
+# is run through the MatlabEngine, as it would be for real, but with a stub executable in place of MATLAB. The
+# stub reads the scenarios and exchange format from RunSimulations.m, like CRED does, and writes a synthetic
+# results workbook with MockEngine.simulate. So the benchmark covers everything except the model itself,
+# including launching a process per run. Use --engine mock to leave out the process launch too.
+#
+# For each ensemble size N it reports:
+# - input generation: writing N inputs with dummy impacts, per input
+# - per-run overhead: the python side of a run (everything but execute), and execute itself, which here is
+#   launching the stub and waiting for it, per run (see CREDController.timing_report)
+# - Excel I/O: the per-run phases that read or write workbooks
+# - post-processing throughput: runs per second for process_outputs from scratch, process_outputs when
+#   nothing has changed, stream_output_statistics, filling an ensemble store and process_outputs from it
+#
+# Inputs are generated from fixed seeds, so runs of the benchmark are comparable over time. --output writes
+# the results with details of the machine and library versions.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy import cred_model
+from macroeconomy.cred_engine import MatlabEngine, MockEngine
+from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_controller import CREDController
+from macroeconomy.cred_ensemble_store import CREDEnsembleStore
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+REPO_DIR = Path(os.path.dirname(__file__)).parents[1]
+
+DEFAULT_SIZES = [10, 100, 1000]
+
+# Phases of a run (see MacroEconomyCRED.run) that read or write workbooks
+EXCEL_IO_PHASES = ['setup.copy_input', 'setup.truncate_input', 'teardown.truncate_output', 'teardown.copy_output', 'teardown.export_excel', 'load_output']
+
+# A stand-in for the MATLAB executable, called with MatlabEngine.command's arguments
+STUB_EXECUTABLE = '''#!@PYTHON@
+# Fake MATLAB for benchmarking: simulates the scenarios in casScenarioNames with MockEngine
+import re
+import sys
+sys.path.insert(0, @REPO@)
+from pathlib import Path
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_exchange import exchange_path, read_sheets, write_sheets
+
+location = Path(re.search(r"cd\\('(.*?)'\\)", ' '.join(sys.argv[1:])).group(1))
+run_simulations = Path(location, 'RunSimulations.m').read_text()
+scenarios = re.findall(r"'([^']*)'", re.search(r'casScenarioNames\\s*=\\s*\\{(.*?)\\}', run_simulations).group(1))
+exchange_format = re.search(r"sExchangeFormat\\s*=\\s*'(\\w+)'", run_simulations)
+exchange_format = exchange_format.group(1) if exchange_format else 'xlsx'
+input_excel = next(Path(location, 'ExcelFiles').glob('ModelSimulationandCalibration*.xlsx'))
+n_sectors, n_regions = [int(n) for n in re.findall(r'\\d+', input_excel.name)]
+output_excel = Path(location, 'ExcelFiles', f'ResultsScenarios{n_sectors}Sectorsand{n_regions}Regions.xlsx')
+scenario_inputs = read_sheets(exchange_path(input_excel, exchange_format), scenarios)
+engine = MockEngine()
+write_sheets(exchange_path(output_excel, exchange_format), {s: engine.simulate(scenario_inputs[s], n_sectors) for s in scenarios})
+'''
+
+
+def make_fake_cred(path, input_excel=TESTDATA_INPUT):
+    # A model directory for MockEngine plus the stub executable. Returns (model directory, executable)
+    cred_location = MockEngine.make_model_directory(Path(path, 'CRED'), input_excel)
+    executable = Path(path, 'fake_matlab')
+    executable.write_text(STUB_EXECUTABLE.replace('@PYTHON@', sys.executable).replace('@REPO@', repr(str(REPO_DIR))))
+    executable.chmod(0o755)
+    return cred_location, executable
+
+
+def make_inputs(input_dir, n, seed, input_excel=TESTDATA_INPUT):
+    os.makedirs(input_dir, exist_ok=True)
+    for i in range(n):
+        cred_input = CREDInput(input_excel, scenarios=['Scenario'])
+        cred_input.set_dummy_impacts(scale=0.1, frequency=0.5, seed=seed + i + 1)
+        cred_input.to_excel(Path(input_dir, f'sample_{i:05d}.xlsx'))
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    f(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def benchmark(n, work_dir, engine, max_workers=1, seed=0):
+    input_dir, output_dir = Path(work_dir, 'inputs'), Path(work_dir, 'outputs')
+    os.makedirs(output_dir)
+    results = {'n_runs': n}
+
+    results['input_generation_per_run'] = timed(make_inputs, input_dir, n, seed) / n
+
+    cred_template = cred_model.MacroEconomyCRED(input_excel=TESTDATA_INPUT, engine=engine)
+    controller = CREDController(cred_template, input_dir, output_dir)
+    results['experiment_per_run'] = timed(controller.run_experiment, max_workers=max_workers) / n
+    failed = [r for r in controller.run_results if not r.succeeded]
+    if failed:
+        raise RuntimeError(f'{len(failed)} of {n} runs failed, e.g. {failed[0]}')
+    timings = controller.timing_report()
+    top_level = [phase for phase in timings.columns if '.' not in phase]
+    results['run_total_per_run'] = timings[top_level].sum(axis=1).mean()
+    results['run_execute_per_run'] = timings['execute'].mean()
+    results['run_overhead_per_run'] = results['run_total_per_run'] - results['run_execute_per_run']
+    results['run_excel_io_per_run'] = timings[[p for p in EXCEL_IO_PHASES if p in timings]].sum(axis=1).mean()
+    results['baseline'] = controller.experiment_timer.timings.get('experiment.baseline')
+
+    results['process_outputs_runs_per_s'] = n / timed(controller.process_outputs)
+    results['process_outputs_unchanged_runs_per_s'] = n / timed(controller.process_outputs)
+    results['stream_output_statistics_runs_per_s'] = n / timed(controller.stream_output_statistics, seed=seed)
+    store_controller = CREDController(cred_template, input_dir, output_dir, ensemble_store=CREDEnsembleStore(Path(work_dir, 'store')))
+    results['ensemble_store_fill_runs_per_s'] = n / timed(store_controller.update_ensemble_store)
+    results['process_outputs_from_store_runs_per_s'] = n / timed(store_controller.process_outputs)
+    return results
+
+
+def environment():
+    return {
+        'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark CRED orchestration and post-processing with a fake CRED')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Ensemble sizes to benchmark')
+    parser.add_argument('--engine', choices=['stub', 'mock'], default='stub', help='stub: a fake MATLAB executable, launched per run. mock: MockEngine, in process')
+    parser.add_argument('--max-workers', type=int, default=1, help='Run this many models at once')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help='Where to create the model directory, inputs and outputs. Defaults to a temporary directory')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix='cred_benchmark_'))
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        cred_location, executable = make_fake_cred(work_dir)
+        cred_model.CRED_LOCATION = str(cred_location)
+        engine = MatlabEngine(executable=str(executable)) if args.engine == 'stub' else MockEngine()
+        results = []
+        for n in args.sizes:
+            print(f'Benchmarking {n} runs...', flush=True)
+            n_dir = Path(work_dir, f'n_{n}')
+            if os.path.exists(n_dir):
+                shutil.rmtree(n_dir)
+            results.append(benchmark(n, n_dir, engine, max_workers=args.max_workers, seed=args.seed))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    table = pd.DataFrame(results).set_index('n_runs').T
+    with pd.option_context('display.float_format', '{:.4g}'.format):
+        print(table)
+    if args.output:
+        report = {'environment': environment(), 'settings': vars(args), 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return table
+
+
+if __name__ == '__main__':
+    main()
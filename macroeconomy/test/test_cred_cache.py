@@ -0,0 +1,247 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_cache import DynareCache, CREDResultCache, BaselineStore
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_executor import run_cred_task
+from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_model import MacroEconomyCRED
+from macroeconomy.cred_workspace import CREDWorkspace
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestDynareCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+        self.cache = DynareCache(Path(self.tmp, 'dynare_cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _fake_dynare_output(self, cred_location, content):
+        os.makedirs(Path(cred_location, '+DGE_CRED_Model'), exist_ok=True)
+        Path(cred_location, '+DGE_CRED_Model', 'driver.m').write_text(content)
+
+    def test_fingerprint_follows_the_mod_file(self):
+        fingerprint = DynareCache.fingerprint(self.cred_location)
+        self.assertEqual(fingerprint, DynareCache.fingerprint(self.cred_location))
+        with open(Path(self.cred_location, 'DGE_CRED_Model.mod'), 'a') as f:
+            f.write('% a change\n')
+        self.assertNotEqual(fingerprint, DynareCache.fingerprint(self.cred_location))
+
+    def test_compiled_model_is_restored_into_a_fresh_workspace(self):
+        fingerprint = DynareCache.fingerprint(self.cred_location)
+        self.assertFalse(self.cache.restore(self.cred_location, fingerprint))
+        self._fake_dynare_output(self.cred_location, 'compiled')
+        self.cache.store(self.cred_location, fingerprint)
+        self.assertTrue(self.cache.contains(fingerprint))
+
+        with CREDWorkspace(self.cred_location, scratch_dir=self.tmp) as workspace:
+            self.assertFalse(os.path.exists(Path(workspace.path, '+DGE_CRED_Model')))
+            self.assertTrue(self.cache.restore(workspace.path, fingerprint))
+            self.assertEqual(Path(workspace.path, '+DGE_CRED_Model', 'driver.m').read_text(), 'compiled')
+            self.assertEqual(DynareCache.current_fingerprint(workspace.path), fingerprint)
+
+    def test_repeat_runs_do_not_touch_the_model(self):
+        cred = MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=Path(self.tmp, 'output.xlsx'),
+            scenarios=['Scenario'],
+            cred_location=self.cred_location,
+            engine='mock',
+            dynare_cache=self.cache
+        )
+        cred.run()
+        self.assertTrue(self.cache.contains(cred.dynare_fingerprint))
+        self.assertEqual(DynareCache.current_fingerprint(self.cred_location), cred.dynare_fingerprint)
+        runsimulations_text = cred.runsimulations_file.read_text()
+        self.assertIn("evalin('base', 'DGE_CRED_Model.driver');", runsimulations_text)
+        mtimes = {f: os.stat(f).st_mtime_ns for f in [cred.mod_file, cred.runsimulations_file]}
+        fingerprint = cred.dynare_fingerprint
+        cred.run()
+        for f, mtime in mtimes.items():
+            self.assertEqual(os.stat(f).st_mtime_ns, mtime)
+        self.assertEqual(cred.dynare_fingerprint, fingerprint)
+
+    def test_a_changed_model_is_preprocessed_again(self):
+        fingerprint = DynareCache.fingerprint(self.cred_location)
+        self._fake_dynare_output(self.cred_location, 'compiled')
+        self.cache.store(self.cred_location, fingerprint)
+        with open(Path(self.cred_location, 'DGE_CRED_Model.mod'), 'a') as f:
+            f.write('% a change\n')
+        # The generated model left in the directory is out of date, so RunSimulations.m mustn't run it
+        self.assertFalse(self.cache.restore(self.cred_location, DynareCache.fingerprint(self.cred_location)))
+        self.assertIsNone(DynareCache.current_fingerprint(self.cred_location))
+        # Going back to the cached model reuses it again
+        with open(Path(self.cred_location, 'DGE_CRED_Model.mod')) as f:
+            text = f.read()
+        Path(self.cred_location, 'DGE_CRED_Model.mod').write_text(text.replace('% a change\n', ''))
+        self.assertTrue(self.cache.restore(self.cred_location, fingerprint))
+        self.assertEqual(DynareCache.current_fingerprint(self.cred_location), fingerprint)
+
+
+class CountingEngine(MockEngine):
+    # A MockEngine that counts how many times the model actually ran
+
+    def __init__(self):
+        super().__init__()
+        self.n_executions = 0
+
+    def execute(self, cred):
+        self.n_executions += 1
+        super().execute(cred)
+
+
+class TestCREDResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+        self.engine = CountingEngine()
+        self.cred_kwargs = {
+            'cred_location': self.cred_location,
+            'engine': self.engine,
+            'result_cache': CREDResultCache(Path(self.tmp, 'result_cache'))
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _input(self, name, damage=0):
+        cred_input = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+        cred_input.data['Scenario']['exo_D_1_1'] = damage
+        path = Path(self.tmp, name)
+        cred_input.to_excel(path)
+        return path
+
+    def _run(self, input_excel, output_name, **kwargs):
+        return run_cred_task(dict(self.cred_kwargs, **kwargs), input_excel, Path(self.tmp, output_name), ['Scenario'])
+
+    def test_workbook_hash_follows_the_sheets_not_the_file(self):
+        first = CREDResultCache.hash_workbook(self._input('first.xlsx'))
+        self.assertEqual(CREDResultCache.hash_workbook(self._input('second.xlsx')), first)
+        self.assertNotEqual(CREDResultCache.hash_workbook(self._input('changed.xlsx', damage=0.1)), first)
+
+    def test_identical_inputs_are_served_from_the_cache(self):
+        first = self._run(self._input('no_events_1.xlsx'), 'out_1.xlsx')
+        second = self._run(self._input('no_events_2.xlsx'), 'out_2.xlsx')
+        self.assertEqual(first.status, 'success')
+        self.assertEqual(second.status, 'cached')
+        self.assertTrue(second.succeeded)
+        self.assertEqual(self.engine.n_executions, 1)
+        pd.testing.assert_frame_equal(
+            pd.read_excel(Path(self.tmp, 'out_1.xlsx'), sheet_name='Scenario'),
+            pd.read_excel(Path(self.tmp, 'out_2.xlsx'), sheet_name='Scenario')
+        )
+
+    def test_different_inputs_or_setup_are_not(self):
+        input_excel = self._input('no_events.xlsx')
+        self._run(input_excel, 'out_1.xlsx')
+        self.assertEqual(self._run(self._input('events.xlsx', damage=0.1), 'out_2.xlsx').status, 'success')
+        self.assertEqual(self._run(input_excel, 'out_3.xlsx', ForwardLooking=True).status, 'success')
+        self.assertEqual(self._run(input_excel, 'out_4.xlsx', n_sim_years=1).status, 'success')
+        self.assertEqual(self._run(input_excel, 'out_5.xlsx', Subsecstart=[1, 2, 3, 5]).status, 'success')
+        self.assertEqual(self.engine.n_executions, 5)
+        self.assertEqual(self._run(input_excel, 'out_6.xlsx').status, 'cached')
+
+    def test_model_code_is_part_of_the_key(self):
+        input_excel = self._input('no_events.xlsx')
+        self._run(input_excel, 'out_1.xlsx')
+        with open(Path(self.cred_location, 'Functions', 'Simulation_Model.m'), 'a') as f:
+            f.write('% a change to the model\n')
+        self.assertEqual(self._run(input_excel, 'out_2.xlsx').status, 'success')
+        # Files generated by Dynare aren't
+        os.makedirs(Path(self.cred_location, '+DGE_CRED_Model'))
+        Path(self.cred_location, '+DGE_CRED_Model', 'driver.m').write_text('generated')
+        self.assertEqual(self._run(input_excel, 'out_3.xlsx').status, 'cached')
+
+
+class TestBaselineStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+        self.store = BaselineStore(Path(self.tmp, 'baselines'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _baseline(self, input_excel=TESTDATA_INPUT, **kwargs):
+        return MacroEconomyCRED(
+            input_excel=input_excel,
+            output_excel=Path(self.tmp, 'baseline.xlsx'),
+            scenarios=['Baseline'],
+            cred_location=self.cred_location,
+            engine='mock',
+            **kwargs
+        )
+
+    def test_key_ignores_the_state_of_the_model_directory(self):
+        key = self.store.key(self._baseline())
+        # A scenario run leaves different settings in the model files
+        MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=Path(self.tmp, 'scenario.xlsx'),
+            scenarios=['Scenario'],
+            n_sim_years=1,
+            cred_location=self.cred_location,
+            engine='mock'
+        ).run()
+        self.assertEqual(self.store.key(self._baseline()), key)
+
+    def test_key_follows_the_baseline_and_setup(self):
+        key = self.store.key(self._baseline())
+        self.assertNotEqual(self.store.key(self._baseline(ForwardLooking=True)), key)
+        self.assertNotEqual(self.store.key(self._baseline(n_sim_years=1)), key)
+        cred_input = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+        cred_input.baseline['exo_PoP'] = 0.01
+        changed_input = Path(self.tmp, 'changed_baseline.xlsx')
+        cred_input.to_excel(changed_input)
+        self.assertNotEqual(self.store.key(self._baseline(changed_input)), key)
+        # Scenario sheets don't matter. (Compare files written the same way: Excel round trips can change the last bits of floats)
+        cred_input = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+        unchanged_input = Path(self.tmp, 'unchanged.xlsx')
+        cred_input.to_excel(unchanged_input)
+        cred_input.data['Scenario']['exo_D_1_1'] = 0.5
+        changed_input = Path(self.tmp, 'changed_scenario.xlsx')
+        cred_input.to_excel(changed_input)
+        self.assertEqual(self.store.key(self._baseline(changed_input)), self.store.key(self._baseline(unchanged_input)))
+
+    def test_key_follows_the_calibration(self):
+        cred_input = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+        unchanged_input = Path(self.tmp, 'unchanged.xlsx')
+        cred_input.to_excel(unchanged_input)
+        key = self.store.key(self._baseline(unchanged_input))
+        # A recalibrated template with the same Baseline sheet
+        recalibrated_input = Path(self.tmp, 'recalibrated.xlsx')
+        cred_input.to_excel(recalibrated_input)
+        parameters = pd.read_excel(recalibrated_input, sheet_name='Structural Parameters')
+        column = parameters.select_dtypes('number').columns[0]
+        parameters.loc[parameters[column].first_valid_index(), column] *= 1.1
+        with pd.ExcelWriter(recalibrated_input, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
+            parameters.to_excel(writer, sheet_name='Structural Parameters', index=False)
+        self.assertNotEqual(self.store.key(self._baseline(recalibrated_input)), key)
+
+    def test_stored_baseline_is_returned(self):
+        cred = self._baseline()
+        key = self.store.key(cred)
+        self.assertFalse(self.store.get(key, Path(self.tmp, 'restored.xlsx')))
+        cred.run()
+        self.store.put(key, cred.user_output_excel)
+        self.assertTrue(self.store.get(key, Path(self.tmp, 'restored.xlsx')))
+        pd.testing.assert_frame_equal(
+            pd.read_excel(Path(self.tmp, 'restored.xlsx'), sheet_name='Baseline'),
+            pd.read_excel(cred.user_output_excel, sheet_name='Baseline')
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
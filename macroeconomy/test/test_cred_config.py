@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from macroeconomy.cred_config import (
+    CREDConfig, Assignment, LineArray, ScenarioNames, DynareOptions, CachedDynareModel, format_value,
+    RUNSIMULATIONS_FILE, MOD_FILE, SIMULATION_MODEL_FILE
+)
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_model import MacroEconomyCRED
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestCREDConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_format_value(self):
+        self.assertEqual(format_value(True), '1')
+        self.assertEqual(format_value(40), '40')
+        self.assertEqual(format_value(0.25), '0.25')
+        self.assertEqual(format_value("it's"), "'it''s'")
+        self.assertEqual(format_value([1, 2]), '[1, 2]')
+        self.assertEqual(format_value(['a', 'b']), "{'a', 'b'}")
+        with self.assertRaises(ValueError):
+            format_value({'a': 1})
+
+    def test_typed_assignments_keep_the_rest_of_the_line(self):
+        text = "options_.iStepSimulation  = 40; % years\ndBeta = 0.99;\nx.dBeta = 0.5;\nsName = 'old';\n"
+        text = Assignment('options_.iStepSimulation', 37).apply(text)
+        text = Assignment('dBeta', 0.98).apply(text)
+        text = Assignment('sName', 'new').apply(text)
+        # x.dBeta is a different variable
+        self.assertEqual(text, "options_.iStepSimulation  = 37; % years\ndBeta = 0.98;\nx.dBeta = 0.5;\nsName = 'new';\n")
+
+    def test_render_writes_each_file_once_and_only_when_it_changes(self):
+        config = CREDConfig()
+        config.add(MOD_FILE, Assignment('options_.iStepSimulation', 37))
+        config.add(MOD_FILE, Assignment('@# define ForwardLooking', True))
+        config.add(SIMULATION_MODEL_FILE, Assignment('iDisplay', 37))
+        config.add(RUNSIMULATIONS_FILE, ScenarioNames(['Baseline', 'Scenario']))
+        config.add(RUNSIMULATIONS_FILE, LineArray('sSubsecstart', [1, 2, 3, 4]))
+        config.add(RUNSIMULATIONS_FILE, DynareOptions(['fast']))
+
+        written = config.render(self.cred_location)
+        self.assertEqual(len(written), 3)
+        mod_text = Path(self.cred_location, MOD_FILE).read_text()
+        self.assertIn('options_.iStepSimulation  = 37;', mod_text)
+        self.assertIn('@# define ForwardLooking = 1', mod_text)
+        runsimulations_text = Path(self.cred_location, RUNSIMULATIONS_FILE).read_text()
+        self.assertIn("casScenarioNames = {'Baseline', 'Scenario'}", runsimulations_text)
+        self.assertIn('sSubsecstart = [1, 2, 3, 4];', runsimulations_text)
+        self.assertIn('sSubsecend = [1, 3, 4, 5];', runsimulations_text)
+        self.assertIn('dynare DGE_CRED_Model fast', runsimulations_text)
+
+        mtimes = {f: os.stat(Path(self.cred_location, f)).st_mtime_ns for f in [MOD_FILE, SIMULATION_MODEL_FILE, RUNSIMULATIONS_FILE]}
+        self.assertEqual(config.render(self.cred_location), [])
+        for f, mtime in mtimes.items():
+            self.assertEqual(os.stat(Path(self.cred_location, f)).st_mtime_ns, mtime)
+
+    def test_cached_dynare_model_wraps_and_unwraps_the_dynare_call(self):
+        text = "x = 1;\n  dynare DGE_CRED_Model noclearall;\ny = 2;\n"
+        cached = CachedDynareModel().apply(text)
+        self.assertEqual(cached, (
+            "x = 1;\n"
+            "  if exist('.cred_dynare_fingerprint', 'file')   % DynareCache: the generated model is current, so skip the preprocessor\n"
+            "      dynare_config();\n"
+            "      evalin('base', 'DGE_CRED_Model.driver');\n"
+            "  else\n"
+            "      dynare DGE_CRED_Model noclearall;\n"
+            "  end\n"
+            "y = 2;\n"
+        ))
+        self.assertEqual(CachedDynareModel().apply(cached), cached)
+        self.assertEqual(CachedDynareModel(enabled=False).apply(cached), text)
+        self.assertEqual(CachedDynareModel(enabled=False).apply(text), text)
+        # The last line of a file may have no line ending
+        self.assertEqual(CachedDynareModel(enabled=False).apply(CachedDynareModel().apply('dynare M')), 'dynare M')
+
+    def test_missing_required_settings_are_errors(self):
+        text = "dBeta = 0.99;\n"
+        with self.assertRaises(ValueError):
+            Assignment('sExchangeFormat', 'mat').apply(text)
+        self.assertEqual(Assignment('sExchangeFormat', 'xlsx', required=False).apply(text), text)
+
+    def test_mat_exchange_needs_a_model_that_uses_it(self):
+        runsimulations_file = Path(self.cred_location, RUNSIMULATIONS_FILE)
+        original = runsimulations_file.read_text()
+        without_format = ''.join(line for line in original.splitlines(keepends=True) if 'sExchangeFormat' not in line)
+        without_hooks = ''.join(line for line in original.splitlines(keepends=True) if 'CREDReadSheet' not in line)
+        for text in [without_format, without_hooks]:
+            runsimulations_file.write_text(text)
+            cred = MacroEconomyCRED(
+                input_excel=TESTDATA_INPUT,
+                output_excel=Path(self.tmp, 'output.xlsx'),
+                cred_location=self.cred_location,
+                engine='mock',
+                exchange_format='mat'
+            )
+            with self.assertRaises(ValueError):
+                cred.run()
+            self.assertFalse(os.path.exists(Path(self.tmp, 'output.mat')))
+        # xlsx runs don't need either
+        runsimulations_file.write_text(without_format)
+        cred = MacroEconomyCRED(input_excel=TESTDATA_INPUT, output_excel=Path(self.tmp, 'output.xlsx'), cred_location=self.cred_location, engine='mock')
+        cred.run()
+
+    def test_later_settings_replace_earlier_ones(self):
+        config = CREDConfig()
+        config.add(SIMULATION_MODEL_FILE, Assignment('iDisplay', 10))
+        config.add(SIMULATION_MODEL_FILE, Assignment('iDisplay', 20))
+        config.render(self.cred_location)
+        self.assertEqual(Path(self.cred_location, SIMULATION_MODEL_FILE).read_text(), 'iDisplay = 20;\n')
+
+    def test_model_setup_matches_single_setting_methods(self):
+        cred = MacroEconomyCRED(input_excel=TESTDATA_INPUT, cred_location=self.cred_location, engine='mock', n_sim_years=2)
+        cred.model_config().render(self.cred_location)
+        rendered = {f: Path(self.cred_location, f).read_text() for f in [MOD_FILE, SIMULATION_MODEL_FILE, RUNSIMULATIONS_FILE]}
+
+        other_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED2'), TESTDATA_INPUT)
+        other = MacroEconomyCRED(input_excel=TESTDATA_INPUT, cred_location=other_location, engine='mock', n_sim_years=2)
+        other.set_istep_simulation(other.n_model_years)
+        other.set_forwardlooking(other.ForwardLooking)
+        other.set_scenarios(other.scenarios)
+        other.set_iDisplay(other.n_sim_years)
+        other.set_subsector_starts_and_ends(other.Subsecstart, other.Subsecend)
+        for f, text in rendered.items():
+            self.assertEqual(Path(other_location, f).read_text(), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_model import MacroEconomyCRED
+from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_exchange import read_sheets, write_sheets
+from macroeconomy.cred_ensemble_store import CREDEnsembleStore
+from macroeconomy.cred_controller import CREDController
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestCREDController(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+        self.input_dir = Path(self.tmp, 'inputs')
+        os.makedirs(self.input_dir)
+        # Inputs that differ only in their damages
+        for i in range(4):
+            cred_input = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+            cred_input.data['Scenario']['exo_D_1_1'] = 0.1 * i
+            cred_input.to_excel(Path(self.input_dir, f'in_{i}.xlsx'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _controller(self, output_name='outputs', **kwargs):
+        output_dir = Path(self.tmp, output_name)
+        os.makedirs(output_dir, exist_ok=True)
+        cred_template = MacroEconomyCRED(input_excel=TESTDATA_INPUT, cred_location=self.cred_location, engine=MockEngine(), n_sim_years=2)
+        return CREDController(cred_template, self.input_dir, output_dir, **kwargs)
+
+    def test_parallel_experiment_matches_serial_experiment(self):
+        serial = self._controller('serial')
+        parallel = self._controller('parallel')
+        serial_results = serial.run_experiment()
+        parallel_results = parallel.run_experiment(max_workers=2, scratch_dir=self.tmp)
+
+        inputs = [Path(self.input_dir, f'in_{i}.xlsx') for i in range(4)]
+        for results in [serial_results, parallel_results]:
+            self.assertEqual([Path(r.input_excel) for r in results], inputs)
+            self.assertTrue(all(r.status == 'success' for r in results), results)
+        for f in sorted(os.listdir(self.input_dir)):
+            pd.testing.assert_frame_equal(
+                read_sheets(parallel.output_path(f))['Scenario'],
+                read_sheets(serial.output_path(f))['Scenario']
+            )
+        # The runs differ: each has its own input
+        self.assertFalse(read_sheets(parallel.output_path('in_0.xlsx'))['Scenario'].equals(read_sheets(parallel.output_path('in_3.xlsx'))['Scenario']))
+        # Worker workspaces are removed when the experiment ends
+        self.assertEqual([p for p in os.listdir(self.tmp) if p.startswith('cred_workspace_')], [])
+
+    def test_existing_outputs_are_skipped_unless_overwritten(self):
+        controller = self._controller()
+        controller.run_experiment()
+        mtimes = {f: os.stat(controller.output_path(f)).st_mtime_ns for f in os.listdir(self.input_dir)}
+        os.remove(controller.output_path('in_2.xlsx'))
+
+        results = controller.run_experiment(max_workers=2, scratch_dir=self.tmp)
+        self.assertEqual([r.status for r in results], ['skipped', 'skipped', 'success', 'skipped'])
+        for f in ['in_0.xlsx', 'in_1.xlsx', 'in_3.xlsx']:
+            self.assertEqual(os.stat(controller.output_path(f)).st_mtime_ns, mtimes[f])
+
+        results = controller.run_experiment(overwrite_existing=True, max_workers=2, scratch_dir=self.tmp)
+        self.assertEqual([r.status for r in results], ['success'] * 4)
+        for f in ['in_0.xlsx', 'in_1.xlsx', 'in_3.xlsx']:
+            self.assertNotEqual(os.stat(controller.output_path(f)).st_mtime_ns, mtimes[f])
+
+    def test_failed_runs_are_reported(self):
+        Path(self.input_dir, 'in_4.xlsx').write_text('not a workbook')
+        for batch_size in [1, 2]:
+            controller = self._controller(f'outputs_{batch_size}')
+            with self.assertLogs('macroeconomy.cred_controller', level='WARNING') as logs:
+                results = controller.run_experiment(max_workers=2, scratch_dir=self.tmp, batch_size=batch_size)
+            self.assertEqual(len(results), 5)
+            self.assertEqual([r.status for r in results[:4]], ['success'] * 4)
+            self.assertEqual(results[4].status, 'failed')
+            self.assertIsNotNone(results[4].error)
+            self.assertFalse(os.path.exists(controller.output_path('in_4.xlsx')))
+            self.assertIn('1 of 5 model runs failed', '\n'.join(logs.output))
+
+    def test_persistent_sessions_need_matlab(self):
+        controller = self._controller()
+        for kwargs in [{'persistent_session': True}, {'persistent_session': True, 'max_workers': 2}]:
+            with self.assertRaises(ValueError):
+                controller.run_experiment(**kwargs)
+        self.assertEqual(os.listdir(controller.output_dir), [])
+
+    def test_rewritten_outputs_are_not_served_from_the_ensemble_store(self):
+        controller = self._controller(ensemble_store=CREDEnsembleStore(Path(self.tmp, 'store')))
+        controller.run_experiment()
+        label, variable = 'GDP', 'Y'
+        before = controller.process_outputs()[label]
+
+        # in_1's output is rewritten, e.g. by a re-run, behind the store's back
+        output_path = controller.output_path('in_1.xlsx')
+        sheets = read_sheets(output_path)
+        sheets['Scenario'][variable] = sheets['Scenario'][variable] * 2
+        write_sheets(output_path, sheets)
+
+        after = controller.process_outputs()[label]
+        np.testing.assert_allclose(after['in_1.xlsx'], 2 * before['in_1.xlsx'])
+        pd.testing.assert_series_equal(after['in_0.xlsx'], before['in_0.xlsx'])
+        # and the store has been brought up to date
+        np.testing.assert_allclose(controller.ensemble_store.run('in_1.xlsx')[variable], 2 * before['in_1.xlsx'].to_numpy())
+        self.assertEqual(controller.ensemble_store.source_stamp('in_1.xlsx'), CREDController._file_stamp(output_path))
+
+    def test_outputs_are_ingested_incrementally(self):
+        controller = self._controller()
+        controller.run_experiment()
+        variables = list(controller.output_var_lookup.values())
+        os.remove(controller.output_path('in_2.xlsx'))
+
+        def outputs_read(call):
+            # The outputs CREDOutput is asked to read while call runs
+            with mock.patch('macroeconomy.cred_controller.CREDOutput', wraps=CREDOutput) as spy:
+                changed = call()
+            return changed, sorted(Path(c.args[1]).name for c in spy.call_args_list)
+
+        changed, read = outputs_read(lambda: controller.ingest_outputs(variables))
+        self.assertTrue(changed)
+        self.assertEqual(read, ['baseline.xlsx', 'in_0.xlsx', 'in_1.xlsx', 'in_3.xlsx'])
+        ingested = dict(controller._ingested)
+        self.assertEqual(outputs_read(lambda: controller.ingest_outputs(variables)), (False, []))
+
+        # A rewritten output is read again, and only it
+        output_path = controller.output_path('in_1.xlsx')
+        sheets = read_sheets(output_path)
+        sheets['Scenario']['Y'] = sheets['Scenario']['Y'] * 2
+        write_sheets(output_path, sheets)
+        self.assertEqual(outputs_read(lambda: controller.ingest_outputs(variables)), (True, ['in_1.xlsx']))
+        for f in ['in_0.xlsx', 'in_3.xlsx']:
+            self.assertIs(controller._ingested[f], ingested[f])
+        np.testing.assert_allclose(controller._ingested['in_1.xlsx'][1][variables.index('Y')], 2 * ingested['in_1.xlsx'][1][variables.index('Y')])
+
+        # New outputs are read, deleted ones are dropped without reading anything
+        shutil.copy2(controller.output_path('in_0.xlsx'), controller.output_path('in_2.xlsx'))
+        self.assertEqual(outputs_read(lambda: controller.ingest_outputs(variables)), (True, ['in_2.xlsx']))
+        os.remove(controller.output_path('in_3.xlsx'))
+        self.assertEqual(outputs_read(lambda: controller.ingest_outputs(variables)), (True, []))
+        self.assertEqual(sorted(controller._ingested), ['in_0.xlsx', 'in_1.xlsx', 'in_2.xlsx'])
+
+        # A new baseline over the same years is read on its own; over different years, everything is read again
+        baseline_path = controller.output_path('baseline.xlsx')
+        baseline = read_sheets(baseline_path)
+        write_sheets(baseline_path, {'Baseline': baseline['Baseline'].assign(Y=baseline['Baseline']['Y'] + 1)})
+        self.assertEqual(outputs_read(lambda: controller.ingest_outputs(variables)), (True, ['baseline.xlsx']))
+        np.testing.assert_allclose(controller._ingested_baseline[1][variables.index('Y')], baseline['Baseline']['Y'] + 1)
+        write_sheets(baseline_path, {'Baseline': baseline['Baseline'].iloc[0:1]})
+        changed, read = outputs_read(lambda: controller.ingest_outputs(variables))
+        self.assertEqual(read, ['baseline.xlsx', 'in_0.xlsx', 'in_1.xlsx', 'in_2.xlsx'])
+        self.assertEqual(controller._ingested['in_0.xlsx'][1].shape, (len(variables), 1))
+
+    def test_summary_matches_per_run_calculation(self):
+        controller = self._controller()
+        controller.run_experiment()
+        # One run is missing a value, another a whole year
+        sheets = read_sheets(controller.output_path('in_1.xlsx'))
+        sheets['Scenario'].loc[0, 'Y'] = np.nan
+        write_sheets(controller.output_path('in_1.xlsx'), sheets)
+        sheets = read_sheets(controller.output_path('in_2.xlsx'))
+        write_sheets(controller.output_path('in_2.xlsx'), {'Scenario': sheets['Scenario'].iloc[0:1]})
+
+        quantiles = [0.1, 0.9]
+        processed = controller.process_outputs(quantiles=quantiles)
+        statistics = controller.output_statistics.set_index(['variable', 'Year', 'statistic']).sort_index()
+        baseline = read_sheets(controller.output_path('baseline.xlsx'))['Baseline'].set_index('Year')
+        runs = {f: read_sheets(controller.output_path(f))['Scenario'].set_index('Year') for f in sorted(os.listdir(self.input_dir))}
+        for label, variable in controller.output_var_lookup.items():
+            # As process_outputs used to: a column per run, then a mean across them
+            expected = pd.DataFrame(index=baseline.index)
+            for f, run in runs.items():
+                expected[f] = run[variable]
+            pd.testing.assert_frame_equal(processed[label][list(runs)], expected, check_names=False, check_index_type=False, check_dtype=False)
+            np.testing.assert_allclose(processed[label]['mean'], expected.mean(axis=1))
+            np.testing.assert_allclose(processed[label]['Baseline'], baseline[variable])
+
+            reference = {
+                'mean': expected.mean(axis=1),
+                'std': expected.std(axis=1),
+                'median': expected.median(axis=1),
+                'q0.1': expected.quantile(0.1, axis=1),
+                'q0.9': expected.quantile(0.9, axis=1),
+            }
+            for statistic, values in reference.items():
+                for year, value in values.items():
+                    row = statistics.loc[(variable, year, statistic)]
+                    # Variables can appear under more than one label
+                    row = row.iloc[0] if isinstance(row, pd.DataFrame) else row
+                    np.testing.assert_allclose(row['value'], value, err_msg=f'{statistic} of {variable} in {year}')
+                    if statistic != 'std':
+                        np.testing.assert_allclose(row['baseline_delta'], value - baseline.loc[year, variable])
+        # The missing values were left out, not counted as zeros
+        self.assertAlmostEqual(processed['GDP'].loc[baseline.index[1], 'mean'], np.mean([runs[f].loc[baseline.index[1], 'Y'] for f in ['in_0.xlsx', 'in_1.xlsx', 'in_3.xlsx']]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import stat
+import shutil
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_engine import CREDEngine, MatlabEngine, OctaveEngine, MockEngine, get_engine
+from macroeconomy.cred_model import MacroEconomyCRED
+from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_watchdog import CREDRunKilled
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestCREDEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_engine(self):
+        self.assertIsInstance(get_engine('matlab'), MatlabEngine)
+        self.assertIsInstance(get_engine('octave'), OctaveEngine)
+        engine = MockEngine()
+        self.assertIs(get_engine(engine), engine)
+        with self.assertRaises(ValueError):
+            get_engine('excel')
+
+    def test_missing_executable_fails_check(self):
+        with self.assertRaises(FileNotFoundError):
+            MatlabEngine(Path(self.tmp, 'no_matlab')).check()
+        MockEngine().check()
+
+    def test_commands_run_in_the_model_directory(self):
+        cred = MacroEconomyCRED(input_excel=TESTDATA_INPUT, cred_location=self.cred_location, engine='mock')
+        self.assertIn(f"cd('{self.cred_location}')", OctaveEngine('/usr/bin/octave').command(cred))
+        self.assertIn(f"cd('{self.cred_location}')", MatlabEngine('/usr/bin/matlab').command(cred))
+
+    def test_mock_engine_runs_cred(self):
+        output_excel = Path(self.tmp, 'output.xlsx')
+        cred = MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=output_excel,
+            scenarios=['Baseline', 'Scenario'],
+            cred_location=self.cred_location,
+            engine='mock'
+        )
+        output = cred.run()
+        self.assertIsInstance(output, CREDOutput)
+        self.assertTrue(os.path.exists(output_excel))
+        for var in CREDOutput.get_output_var_lookup(output.sectors).values():
+            self.assertIn(var, output.data['Scenario'].columns)
+        self.assertEqual(output.data['Baseline'].shape[0], cred.n_sim_years)
+
+    def test_terminal_years_are_simulated_but_not_written(self):
+        output_excel = Path(self.tmp, 'output.xlsx')
+        cred = MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=output_excel,
+            scenarios=['Scenario'],
+            n_sim_years=1,
+            n_terminal_years=1,
+            cred_location=self.cred_location,
+            engine='mock'
+        )
+        output = cred.run()
+        self.assertIn('options_.iStepSimulation  = 2;', cred.mod_file.read_text())
+        self.assertIn('iDisplay = 1;', cred.simulation_model_file.read_text())
+        # The terminal year is dropped from the output file, so every reader gets n_sim_years
+        self.assertEqual(pd.read_excel(output_excel, sheet_name='Scenario').shape[0], 1)
+        self.assertEqual(output.data['Scenario'].shape[0], 1)
+        self.assertEqual(output.n_sim_years, 1)
+        self.assertEqual(CREDOutput(TESTDATA_INPUT, output_excel, ['Scenario']).n_sim_years, 1)
+
+    def test_run_async(self):
+        cred = MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=Path(self.tmp, 'output.xlsx'),
+            scenarios=['Scenario'],
+            cred_location=self.cred_location,
+            engine='mock'
+        )
+        output = asyncio.run(cred.run_async())
+        self.assertIsInstance(output, CREDOutput)
+
+    def _hanging_octave(self):
+        # An 'Octave' that records its process ID and then hangs
+        executable = Path(self.tmp, 'octave')
+        pid_file = Path(self.tmp, 'pid')
+        executable.write_text(f'#!/bin/sh\necho $$ > {pid_file}\nexec sleep 60\n')
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        cred = MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=Path(self.tmp, 'output.xlsx'),
+            scenarios=['Scenario'],
+            cred_location=self.cred_location,
+            engine=OctaveEngine(executable)
+        )
+        return cred, pid_file
+
+    def test_run_async_times_out(self):
+        cred, _ = self._hanging_octave()
+        cred.timeout = 0.5
+        with self.assertRaises(CREDRunKilled):
+            asyncio.run(cred.run_async())
+        self.assertEqual(cred.kill_reason, 'timeout')
+
+    def test_cancelling_run_async_kills_the_model(self):
+        cred, pid_file = self._hanging_octave()
+
+        async def start_and_cancel():
+            task = asyncio.ensure_future(cred.run_async())
+            while not os.path.exists(pid_file) or not pid_file.read_text().strip():
+                await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(start_and_cancel())
+        # The model process was killed (it may linger as a zombie until its new parent reaps it)
+        import psutil
+        pid = int(pid_file.read_text())
+        if psutil.pid_exists(pid):
+            self.assertEqual(psutil.Process(pid).status(), psutil.STATUS_ZOMBIE)
+
+    def test_mock_engine_damages_reduce_output(self):
+        n_years = 5
+        scenario_input = pd.DataFrame({'Time': np.arange(n_years), 'exo_PoP': np.zeros(n_years)})
+        baseline = MockEngine().simulate(scenario_input, n_sectors=2)
+        scenario_input['exo_D_1_1'] = [0, 0.5, 0, 0, 0]
+        scenario = MockEngine().simulate(scenario_input, n_sectors=2)
+        np.testing.assert_allclose(scenario['Y_2'], baseline['Y_2'])
+        self.assertEqual(scenario['Y_1'][0], baseline['Y_1'][0])
+        self.assertTrue(np.all(scenario['Y_1'][1:] < baseline['Y_1'][1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
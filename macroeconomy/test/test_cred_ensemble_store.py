@@ -0,0 +1,98 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_ensemble_store import CREDEnsembleStore
+
+
+def run_output(seed, years=(2014, 2015, 2016)):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'Year': list(years), 'Y': rng.random(len(years)), 'Y_1': rng.random(len(years))})
+
+
+class TestCREDEnsembleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store_dir = Path(self.tmp, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_append_and_read_across_chunks(self):
+        store = CREDEnsembleStore(self.store_dir, chunk_size=2)
+        outputs = {f'run_{i}.xlsx': run_output(i) for i in range(5)}
+        for name, df in outputs.items():
+            store.append(name, df)
+        self.assertEqual(len(list(self.store_dir.glob('chunk_*.npy'))), 3)
+        self.assertEqual(store.names, list(outputs))
+        self.assertEqual(store.variables, ['Y', 'Y_1'])
+
+        expected = np.stack([df['Y'].to_numpy() for df in outputs.values()])
+        np.testing.assert_array_equal(store.variable('Y'), expected)
+        np.testing.assert_array_equal(store.variable('Y', runs=['run_3.xlsx', 'run_0.xlsx']), expected[[3, 0]])
+        pd.testing.assert_frame_equal(store.run('run_4.xlsx'), outputs['run_4.xlsx'])
+        frame = store.variable_frame('Y_1')
+        self.assertEqual(list(frame.index), [2014, 2015, 2016])
+        np.testing.assert_array_equal(frame['run_2.xlsx'], outputs['run_2.xlsx']['Y_1'])
+
+        # Reopened from disk
+        reopened = CREDEnsembleStore(self.store_dir)
+        self.assertEqual(reopened.names, store.names)
+        self.assertEqual(reopened.chunk_size, 2)
+        np.testing.assert_array_equal(reopened.variable('Y'), expected)
+
+    def test_appending_a_name_again_replaces_it(self):
+        store = CREDEnsembleStore(self.store_dir)
+        store.append('run_0.xlsx', run_output(0))
+        store.append('run_0.xlsx', run_output(1))
+        self.assertEqual(len(store), 1)
+        pd.testing.assert_frame_equal(store.run('run_0.xlsx'), run_output(1))
+
+    def test_runs_keep_the_stamp_of_their_output(self):
+        store = CREDEnsembleStore(self.store_dir)
+        store.append('run_0.xlsx', run_output(0), stamp=(100, 1))
+        store.append('run_1.xlsx', run_output(1))
+        self.assertEqual(store.source_stamp('run_0.xlsx'), (100, 1))
+        self.assertIsNone(store.source_stamp('run_1.xlsx'))
+        store.append('run_0.xlsx', run_output(2), stamp=(120, 2))
+        reopened = CREDEnsembleStore(self.store_dir)
+        self.assertEqual(reopened.source_stamp('run_0.xlsx'), (120, 2))
+        pd.testing.assert_frame_equal(reopened.run('run_0.xlsx'), run_output(2))
+        with self.assertRaises(KeyError):
+            store.source_stamp('run_2.xlsx')
+
+        # Stores written before stamps were kept list only the names
+        Path(self.store_dir, 'chunk_00000.json').write_text('["run_0.xlsx", "run_1.xlsx"]')
+        old = CREDEnsembleStore(self.store_dir)
+        self.assertEqual(old.names, ['run_0.xlsx', 'run_1.xlsx'])
+        self.assertIsNone(old.source_stamp('run_0.xlsx'))
+
+    def test_runs_are_matched_to_the_store_layout(self):
+        store = CREDEnsembleStore(self.store_dir)
+        store.append('run_0.xlsx', run_output(0))
+        short = run_output(1, years=(2014, 2015)).drop(columns='Y_1').assign(extra=1.0)
+        store.append('run_1.xlsx', short)
+        run = store.run('run_1.xlsx')
+        self.assertEqual(list(run.columns), ['Year', 'Y', 'Y_1'])
+        self.assertTrue(np.isnan(run['Y'].iloc[2]))
+        self.assertTrue(run['Y_1'].isna().all())
+        with self.assertRaises(ValueError):
+            CREDEnsembleStore(self.store_dir, years=[2014])
+        with self.assertRaises(KeyError):
+            store.variable('extra')
+
+    def test_readers_refresh_to_see_new_runs(self):
+        writer = CREDEnsembleStore(self.store_dir)
+        writer.append('run_0.xlsx', run_output(0))
+        reader = CREDEnsembleStore(self.store_dir)
+        writer.append('run_1.xlsx', run_output(1))
+        self.assertEqual(len(reader), 1)
+        self.assertEqual(reader.refresh().names, ['run_0.xlsx', 'run_1.xlsx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_model import MacroEconomyCRED
+from macroeconomy.cred_executor import run_cred_batch_task
+from macroeconomy.cred_exchange import (
+    exchange_path, format_of, list_sheets, read_sheets, write_sheets, install_exchange_hooks, EXCHANGE_HOOKS
+)
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestCREDExchange(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = MockEngine.make_model_directory(Path(self.tmp, 'CRED'), TESTDATA_INPUT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_paths_and_formats(self):
+        self.assertEqual(exchange_path('out/run_001.xlsx', 'mat'), Path('out/run_001.mat'))
+        self.assertEqual(format_of('run_001.mat'), 'mat')
+        with self.assertRaises(ValueError):
+            exchange_path('run_001.xlsx', 'hdf5')
+        with self.assertRaises(ValueError):
+            format_of('run_001.csv')
+
+    def test_mat_round_trip(self):
+        sheets = {
+            'Baseline': pd.DataFrame({'Year': [2020, 2021], 'Y': [1.5, np.nan]}),
+            'Scenario_001': pd.DataFrame({'Year': [2020], 'Y': [0.25]}),
+        }
+        path = Path(self.tmp, 'sheets.mat')
+        write_sheets(path, sheets)
+        self.assertEqual(list_sheets(path), ['Baseline', 'Scenario_001'])
+        data = read_sheets(path)
+        for name, df in sheets.items():
+            pd.testing.assert_frame_equal(data[name], df)
+        self.assertEqual(read_sheets(path, ['Baseline'], nrows=1)['Baseline'].shape, (1, 2))
+        with self.assertRaises(ValueError):
+            read_sheets(path, ['Scenario'])
+
+    def test_xlsx_columns_match_read_excel(self):
+        sheets = {
+            'Baseline': pd.DataFrame({'Year': [2020, 2021, 2022], 'X': [1.0, 2.0, 3.0], 'Y': [1.5, np.nan, 0.5], 'Z': ['a', 'b', 'c']}),
+            'Scenario_001': pd.DataFrame({'Z': ['a'], 'Y': [0.25], 'Year': [2020]}),
+        }
+        path = Path(self.tmp, 'sheets.xlsx')
+        write_sheets(path, sheets)
+        columns = ['Year', 'Y']
+        for nrows in [None, 2]:
+            data = read_sheets(path, nrows=nrows, columns=columns)
+            expected = pd.read_excel(path, sheet_name=None, nrows=nrows, usecols=lambda column: column in columns)
+            self.assertEqual(list(data), list(expected))
+            for name, df in expected.items():
+                pd.testing.assert_frame_equal(data[name], df)
+        with self.assertRaises(ValueError):
+            read_sheets(path, ['Scenario'], columns=columns)
+
+    def test_mat_needs_matlab_names_and_numbers(self):
+        with self.assertRaises(ValueError):
+            write_sheets(Path(self.tmp, 'bad.mat'), {'Structural Parameters': pd.DataFrame({'a': [1]})})
+        with self.assertRaises(ValueError):
+            write_sheets(Path(self.tmp, 'bad.mat'), {'Content': pd.DataFrame({'a': ['text']})})
+
+    def test_install_exchange_hooks(self):
+        self.assertEqual(len(install_exchange_hooks(self.cred_location)), len(EXCHANGE_HOOKS))
+        self.assertEqual(install_exchange_hooks(self.cred_location), [])
+
+    def run_cred(self, output_excel, **kwargs):
+        return MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=output_excel,
+            scenarios=['Baseline', 'Scenario'],
+            cred_location=self.cred_location,
+            engine='mock',
+            **kwargs
+        ).run()
+
+    def test_mat_runs_match_xlsx_runs(self):
+        xlsx_output = self.run_cred(Path(self.tmp, 'xlsx_output.xlsx'))
+        mat_output = self.run_cred(Path(self.tmp, 'mat_output.xlsx'), exchange_format='mat')
+
+        # The model is told the format, reads its scenarios from the .mat and writes its results as .mat
+        self.assertIn("sExchangeFormat = 'mat';", Path(self.cred_location, 'RunSimulations.m').read_text())
+        self.assertTrue(os.path.exists(Path(self.cred_location, 'Functions', 'CREDReadSheet.m')))
+        self.assertEqual(mat_output.output_excel_path, Path(self.tmp, 'mat_output.mat'))
+        self.assertFalse(os.path.exists(Path(self.tmp, 'mat_output.xlsx')))
+        # Same numbers, though the xlsx output reads whole numbers back as integers
+        for scenario in ['Baseline', 'Scenario']:
+            pd.testing.assert_frame_equal(mat_output.data[scenario], xlsx_output.data[scenario], check_dtype=False)
+
+    def test_mat_output_is_cut_to_n_sim_years(self):
+        output = self.run_cred(Path(self.tmp, 'output.xlsx'), exchange_format='mat', n_sim_years=1, n_terminal_years=1)
+        self.assertEqual(read_sheets(Path(self.tmp, 'output.mat'))['Scenario'].shape[0], 1)
+        self.assertEqual(output.n_sim_years, 1)
+
+    def test_excel_export(self):
+        output = self.run_cred(Path(self.tmp, 'output.xlsx'), exchange_format='mat', export_excel=True)
+        exported = pd.read_excel(Path(self.tmp, 'output.xlsx'), sheet_name=None)
+        self.assertEqual(sorted(exported), ['Baseline', 'Scenario'])
+        # Excel reads whole numbers back as integers
+        pd.testing.assert_frame_equal(exported['Scenario'], output.data['Scenario'], check_dtype=False)
+
+    def test_batched_mat_runs(self):
+        cred_kwargs = {'cred_location': self.cred_location, 'engine': 'mock', 'exchange_format': 'mat'}
+        output_dir = Path(self.tmp, 'out')
+        os.makedirs(output_dir)
+        members = [(TESTDATA_INPUT, Path(output_dir, f'run_{i}.mat')) for i in range(2)]
+        results = run_cred_batch_task(cred_kwargs, members, 'Scenario', self.tmp)
+        self.assertTrue(all(r.succeeded for r in results))
+        self.assertEqual(sorted(os.listdir(output_dir)), ['run_0.mat', 'run_1.mat'])
+        self.assertEqual(list_sheets(members[0][1]), ['Scenario'])
+
+
+if __name__ == '__main__':
+    unittest.main()
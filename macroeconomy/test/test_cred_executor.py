@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import asyncio
+import unittest
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_exchange import read_sheets, write_sheets
+from macroeconomy.cred_executor import CREDRunResult, run_cred_task, run_cred_task_async, run_cred_batch_task, run_cred_tasks_in_parallel
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class DroppingEngine(MockEngine):
+    # A MockEngine that leaves one scenario out of its output, as CRED does when a scenario fails to solve
+
+    def __init__(self, dropped):
+        super().__init__()
+        self.dropped = dropped
+
+    def execute(self, cred):
+        scenario_inputs = read_sheets(cred.cred_input_path, cred.scenarios)
+        results = {s: self.simulate(scenario_inputs[s], cred.n_sectors) for s in cred.scenarios if s != self.dropped}
+        write_sheets(cred.cred_output_path, results)
+
+
+def crashing_task(cred_kwargs, input_excel, output_excel, scenarios, crash_on='in_1.xlsx'):
+    # Dies the way a worker killed by the OOM killer or a segfault does, without raising
+    if Path(input_excel).name == crash_on:
+        os._exit(1)
+    return CREDRunResult(input_excel, output_excel, 'success')
+
+
+class TestCREDExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cred_location = Path(self.tmp, 'CRED')
+        os.makedirs(Path(self.cred_location, 'ExcelFiles'))
+        Path(self.cred_location, 'RunSimulations.m').write_text('')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_failed_runs_are_recorded_not_raised(self):
+        result = run_cred_task({'cred_location': self.cred_location}, Path(self.tmp, 'missing.xlsx'), Path(self.tmp, 'out.xlsx'), ['Scenario'])
+        self.assertIsInstance(result, CREDRunResult)
+        self.assertEqual(result.status, 'failed')
+        self.assertFalse(result.succeeded)
+        self.assertIsNotNone(result.error)
+
+    def test_parallel_results_keep_task_order(self):
+        tasks = [(Path(self.tmp, f'in_{i}.xlsx'), Path(self.tmp, f'out_{i}.xlsx'), ['Scenario']) for i in range(6)]
+        results = run_cred_tasks_in_parallel({'cred_location': self.cred_location}, tasks, max_workers=3, scratch_dir=self.tmp)
+        self.assertEqual([r.input_excel for r in results], [t[0] for t in tasks])
+        self.assertTrue(all(r.status == 'failed' for r in results))
+        # Worker workspaces are removed when the pool shuts down
+        self.assertEqual([p for p in os.listdir(self.tmp) if p.startswith('cred_workspace_')], [])
+
+    def test_persistent_sessions_need_matlab(self):
+        tasks = [(Path(self.tmp, 'in_0.xlsx'), Path(self.tmp, 'out_0.xlsx'), ['Scenario'])]
+        for engine in ['octave', MockEngine()]:
+            with self.assertRaises(ValueError):
+                run_cred_tasks_in_parallel({'cred_location': self.cred_location, 'engine': engine}, tasks, max_workers=2, persistent_session=True)
+
+    def test_a_dead_worker_fails_its_tasks_not_the_experiment(self):
+        tasks = [(Path(self.tmp, f'in_{i}.xlsx'), Path(self.tmp, f'out_{i}.xlsx'), ['Scenario']) for i in range(4)]
+        finished = []
+        results = run_cred_tasks_in_parallel(
+            {'cred_location': self.cred_location}, tasks, max_workers=2, scratch_dir=self.tmp,
+            task_function=crashing_task, on_result=finished.append
+        )
+        self.assertEqual([r.input_excel for r in results], [t[0] for t in tasks])
+        self.assertEqual(results[1].status, 'failed')
+        self.assertIn('worker process died', results[1].error)
+        # Tasks that finished before the pool broke keep their results
+        self.assertTrue(all(r.status in ['success', 'failed'] for r in results))
+        self.assertEqual(sorted(r.input_excel for r in finished), [t[0] for t in tasks])
+
+    def test_parallel_runs_with_the_mock_engine(self):
+        cred_location = MockEngine.make_model_directory(Path(self.tmp, 'MockCRED'), TESTDATA_INPUT)
+        cred_kwargs = {'cred_location': cred_location, 'engine': MockEngine(), 'n_sim_years': 2}
+        tasks = [(TESTDATA_INPUT, Path(self.tmp, f'out_{i}.xlsx'), ['Scenario']) for i in range(4)]
+        results = run_cred_tasks_in_parallel(cred_kwargs, tasks, max_workers=2, scratch_dir=self.tmp)
+        self.assertTrue(all(r.succeeded for r in results), results)
+        for _, output_excel, _ in tasks:
+            self.assertTrue(os.path.exists(output_excel))
+        # Each run's timings come back from its worker
+        for result in results:
+            self.assertEqual([phase for phase in result.timings if '.' not in phase], ['setup', 'cache_lookup', 'execute', 'teardown', 'load_output'])
+        # The shared model directory was never used
+        self.assertFalse(os.path.exists(Path(cred_location, 'ExcelFiles', 'ResultsScenarios5Sectorsand1Regions.xlsx')))
+
+    def _member_inputs(self, n):
+        # Inputs that differ only in their damages
+        paths = []
+        for i in range(n):
+            cred_input = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+            cred_input.data['Scenario']['exo_D_1_1'] = 0.1 * i
+            path = Path(self.tmp, f'in_{i}.xlsx')
+            cred_input.to_excel(path)
+            paths.append(path)
+        return paths
+
+    def test_batched_input_has_one_sheet_per_member(self):
+        inputs = self._member_inputs(3)
+        batch = CREDInput.batch(inputs)
+        self.assertEqual(batch.scenarios, ['Scenario_001', 'Scenario_002', 'Scenario_003'])
+        self.assertNotIn('Scenario', batch.data)
+        self.assertEqual(batch.data['Scenario_003']['exo_D_1_1'][0], 0.2)
+
+    def test_batched_runs_match_single_runs(self):
+        cred_location = MockEngine.make_model_directory(Path(self.tmp, 'MockCRED'), TESTDATA_INPUT)
+        cred_kwargs = {'cred_location': cred_location, 'engine': MockEngine(), 'n_sim_years': 2}
+        inputs = self._member_inputs(3)
+        members = [(path, Path(self.tmp, f'batched_{i}.xlsx')) for i, path in enumerate(inputs)]
+        batch_dir = Path(self.tmp, 'batches')
+        os.makedirs(batch_dir)
+
+        results = run_cred_batch_task(cred_kwargs, members, 'Scenario', batch_dir)
+        self.assertTrue(all(r.succeeded for r in results), results)
+        self.assertEqual(os.listdir(batch_dir), [])
+
+        for i, (input_excel, batched_output) in enumerate(members):
+            single_output = Path(self.tmp, f'single_{i}.xlsx')
+            self.assertTrue(run_cred_task(cred_kwargs, input_excel, single_output, ['Scenario']).succeeded)
+            pd.testing.assert_frame_equal(
+                CREDOutput(input_excel, batched_output, ['Scenario']).data['Scenario'],
+                CREDOutput(input_excel, single_output, ['Scenario']).data['Scenario']
+            )
+
+    def test_members_missing_from_the_batched_output_fail_alone(self):
+        cred_location = MockEngine.make_model_directory(Path(self.tmp, 'MockCRED'), TESTDATA_INPUT)
+        cred_kwargs = {'cred_location': cred_location, 'engine': DroppingEngine('Scenario_002'), 'n_sim_years': 2}
+        members = [(path, Path(self.tmp, f'batched_{i}.xlsx')) for i, path in enumerate(self._member_inputs(3))]
+        batch_dir = Path(self.tmp, 'batches')
+        os.makedirs(batch_dir)
+
+        results = run_cred_batch_task(cred_kwargs, members, 'Scenario', batch_dir)
+        self.assertEqual([r.status for r in results], ['success', 'failed', 'success'])
+        self.assertIn('Scenario_002 missing', results[1].error)
+        self.assertTrue(os.path.exists(members[0][1]))
+        self.assertFalse(os.path.exists(members[1][1]))
+        self.assertTrue(os.path.exists(members[2][1]))
+        self.assertEqual(os.listdir(batch_dir), [])
+
+    def test_concurrent_async_runs_in_workspaces(self):
+        from macroeconomy.cred_workspace import CREDWorkspacePool
+        cred_location = MockEngine.make_model_directory(Path(self.tmp, 'MockCRED'), TESTDATA_INPUT)
+        cred_kwargs = {'cred_location': cred_location, 'engine': MockEngine(), 'n_sim_years': 2}
+        outputs = [Path(self.tmp, f'out_{i}.xlsx') for i in range(4)]
+
+        async def run_all():
+            with CREDWorkspacePool(4, source_dir=cred_location, scratch_dir=self.tmp) as pool:
+                return await asyncio.gather(*[
+                    run_cred_task_async(cred_kwargs, TESTDATA_INPUT, output, ['Scenario'], cred_location=workspace.create())
+                    for output, workspace in zip(outputs, pool.workspaces)
+                ])
+
+        results = asyncio.run(run_all())
+        self.assertTrue(all(r.succeeded for r in results), results)
+        self.assertTrue(all(os.path.exists(output) for output in outputs))
+
+
+if __name__ == '__main__':
+    unittest.main()
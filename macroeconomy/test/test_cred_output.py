@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_engine import MockEngine
+from macroeconomy.cred_model import MacroEconomyCRED
+from macroeconomy.cred_input import CREDInput, CREDInputTemplate
+from macroeconomy.cred_output import CREDOutput
+from macroeconomy.cred_exchange import exchange_path, read_sheets, write_sheets
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestCREDOutput(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cred_location = MockEngine.make_model_directory(Path(cls.tmp, 'CRED'), TESTDATA_INPUT)
+        cls.output_excel = Path(cls.tmp, 'output.xlsx')
+        MacroEconomyCRED(
+            input_excel=TESTDATA_INPUT,
+            output_excel=cls.output_excel,
+            scenarios=['Baseline', 'Scenario'],
+            cred_location=cred_location,
+            engine='mock'
+        ).run()
+        cls.output_mat = exchange_path(cls.output_excel, 'mat')
+        write_sheets(cls.output_mat, read_sheets(cls.output_excel))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def test_sheets_are_read_when_first_used(self):
+        output = CREDOutput(TESTDATA_INPUT, self.output_excel, ['Scenario'])
+        self.assertEqual(sorted(output.data), ['Baseline', 'Scenario'])
+        self.assertEqual(output.data.loaded, [])
+        self.assertIsNone(output._input)
+
+        self.assertIn('Y', output.data['Scenario'].columns)
+        self.assertEqual(output.data.loaded, ['Scenario'])
+        self.assertEqual(output.n_sectors, 5)
+        self.assertIsNone(output._input)
+        self.assertEqual(output.input.data['Scenario'].shape[0], output.n_sim_years)
+
+    def test_column_projection(self):
+        for path in [self.output_excel, self.output_mat]:
+            full = CREDOutput(TESTDATA_INPUT, path, ['Scenario'], n_sim_years=1)
+            projected = CREDOutput(TESTDATA_INPUT, path, ['Scenario'], n_sim_years=1, columns=['Y_1', 'Y'])
+            self.assertEqual(list(projected.data['Scenario'].columns), ['Year', 'Y_1', 'Y'])
+            pd.testing.assert_frame_equal(projected.data['Scenario'], full.data['Scenario'][['Year', 'Y_1', 'Y']])
+            self.assertEqual(projected.data['Baseline'].shape, (1, 3))
+
+    def test_missing_scenario_fails_early(self):
+        with self.assertRaises(ValueError):
+            CREDOutput(TESTDATA_INPUT, self.output_excel, ['Scenario_001'])
+
+
+    def test_shared_input_template(self):
+        template = CREDInputTemplate.get(TESTDATA_INPUT)
+        self.assertIs(CREDInputTemplate.get(TESTDATA_INPUT), template)
+
+        own = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'])
+        shared = CREDInput(TESTDATA_INPUT, scenarios=['Scenario'], template=template)
+        pd.testing.assert_frame_equal(shared.baseline, own.baseline)
+        pd.testing.assert_frame_equal(shared.data['Scenario'], own.data['Scenario'])
+        self.assertEqual(list(shared.sectors), list(own.sectors))
+        self.assertEqual(shared.input_var_lookup, own.input_var_lookup)
+        # Changes to one input don't reach the template
+        shared.set_impacts_to_zero()
+        shared.baseline.iloc[0, 1] = -1
+        self.assertNotEqual(template.baseline.iloc[0, 1], -1)
+
+        output = CREDOutput(TESTDATA_INPUT, self.output_excel, ['Scenario'], template=template)
+        self.assertIs(output.sectors, template.sectors)
+        self.assertIs(output.input.sectors, template.sectors)
+
+    def test_edited_template_is_parsed_again(self):
+        path = Path(self.tmp, 'template.xlsx')
+        shutil.copy(TESTDATA_INPUT, path)
+        template = CREDInputTemplate.get(path)
+        os.utime(path, ns=(0, 0))
+        self.assertIsNot(CREDInputTemplate.get(path), template)
+
+    def test_template_registry_keeps_the_most_recently_used(self):
+        CREDInputTemplate.clear()
+        template = CREDInputTemplate.get(TESTDATA_INPUT)
+        for i in range(CREDInputTemplate.REGISTRY_SIZE):
+            path = Path(self.tmp, f'template_{i}.xlsx')
+            shutil.copy2(TESTDATA_INPUT, path)
+            CREDInputTemplate.get(path)
+            if i == 0:
+                # Using the first template again keeps it in the registry
+                self.assertIs(CREDInputTemplate.get(TESTDATA_INPUT), template)
+        self.assertEqual(len(CREDInputTemplate._registry), CREDInputTemplate.REGISTRY_SIZE)
+        self.assertIs(CREDInputTemplate.get(TESTDATA_INPUT), template)
+        # The least recently used went instead
+        parsed = [path for path, _, _ in CREDInputTemplate._registry]
+        self.assertNotIn(os.path.realpath(Path(self.tmp, 'template_0.xlsx')), parsed)
+        CREDInputTemplate.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
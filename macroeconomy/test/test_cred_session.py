@@ -0,0 +1,91 @@
+import sys
+import unittest
+from subprocess import CalledProcessError, TimeoutExpired
+
+from macroeconomy.cred_session import MatlabSession, CREDSessionPool
+
+# A stand-in for a MATLAB session: reads commands from stdin and replies with the session sentinel.
+# Commands containing error(...) fail and commands containing pause(...) hang
+FAKE_MATLAB = r'''
+import re, sys, time
+for line in sys.stdin:
+    if line.strip() == 'quit;':
+        break
+    ok = re.search(r"disp\('(\S+:0)'\)", line).group(1)
+    fail = ok[:-1] + '1'
+    if 'pause(' in line:
+        time.sleep(60)
+    print('running: ' + line.split('disp(')[0])
+    if 'error(' in line:
+        print(fail + ' something went wrong')
+    else:
+        print(ok)
+    sys.stdout.flush()
+'''
+FAKE_MATLAB_COMMAND = [sys.executable, '-u', '-c', FAKE_MATLAB]
+
+
+class TestMatlabSession(unittest.TestCase):
+
+    def test_session_runs_many_commands_in_one_process(self):
+        session = MatlabSession(FAKE_MATLAB_COMMAND)
+        try:
+            session.run_simulations('/tmp/cred_a', timeout=10)
+            pid = session.process.pid
+            output = session.run_simulations('/tmp/cred_b', timeout=10)
+            self.assertEqual(session.process.pid, pid)
+            self.assertEqual(session.n_runs, 2)
+            self.assertIn("cd('/tmp/cred_b'); RunSimulations();", output)
+        finally:
+            session.close()
+        self.assertFalse(session.is_alive())
+
+    def test_session_reports_errors(self):
+        session = MatlabSession(FAKE_MATLAB_COMMAND)
+        try:
+            with self.assertRaises(CalledProcessError) as context:
+                session.run("error('boom');", timeout=10)
+            self.assertIn('something went wrong', context.exception.output)
+            # The session survives a failed command
+            session.run("x = 1;", timeout=10)
+        finally:
+            session.close()
+
+    def test_session_times_out_and_is_discarded(self):
+        session = MatlabSession(FAKE_MATLAB_COMMAND)
+        with self.assertRaises(TimeoutExpired):
+            session.run("pause(60);", timeout=0.5)
+        self.assertFalse(session.is_alive())
+        # The next command starts a fresh session
+        try:
+            session.run("x = 1;", timeout=10)
+        finally:
+            session.close()
+
+
+class TestCREDSessionPool(unittest.TestCase):
+
+    def test_pool_reuses_warm_sessions(self):
+        with CREDSessionPool(n_sessions=2, command=FAKE_MATLAB_COMMAND) as pool:
+            for i in range(5):
+                pool.run_simulations(f'/tmp/cred_{i}', timeout=10)
+            pids = {s.process.pid for s in pool.sessions if s.process}
+            self.assertEqual(len(pids), 1)
+        self.assertFalse(any(s.is_alive() for s in pool.sessions))
+
+    def test_pool_recycles_sessions(self):
+        with CREDSessionPool(n_sessions=1, command=FAKE_MATLAB_COMMAND, max_runs_per_session=2) as pool:
+            pool.run_simulations('/tmp/cred', timeout=10)
+            pid = pool.sessions[0].process.pid
+            pool.run_simulations('/tmp/cred', timeout=10)
+            pool.run_simulations('/tmp/cred', timeout=10)
+            self.assertNotEqual(pool.sessions[0].process.pid, pid)
+            self.assertEqual(pool.sessions[0].n_runs, 1)
+
+    def test_pool_needs_a_session(self):
+        with self.assertRaises(ValueError):
+            CREDSessionPool(n_sessions=0, command=FAKE_MATLAB_COMMAND)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from macroeconomy.cred_statistics import ensemble_statistics, tidy_statistics, quantile_name, \
+    WelfordAccumulator, KLLSketch, EnsembleAccumulator
+
+
+class TestEnsembleStatistics(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.cube = rng.random((2, 50, 4))     # variable, run, year
+        self.baseline = rng.random((2, 4))
+
+    def test_statistics_match_per_variable_calculation(self):
+        stats = ensemble_statistics(self.cube, self.baseline, quantiles=[0.1, 0.9])
+        self.assertEqual(list(stats), ['mean', 'std', 'median', 'q0.1', 'q0.9', 'baseline'])
+        for i in range(2):
+            df = pd.DataFrame(self.cube[i])
+            np.testing.assert_allclose(stats['mean'][i], df.mean())
+            np.testing.assert_allclose(stats['std'][i], df.std())
+            np.testing.assert_allclose(stats['median'][i], df.median())
+            np.testing.assert_allclose(stats['q0.9'][i], df.quantile(0.9))
+
+    def test_missing_values_are_ignored(self):
+        cube = self.cube.copy()
+        cube[0, 0, :] = np.nan
+        cube[1, :, 3] = np.nan
+        stats = ensemble_statistics(cube)
+        np.testing.assert_allclose(stats['mean'][0], self.cube[0, 1:].mean(axis=0))
+        self.assertTrue(np.isnan(stats['median'][1, 3]))
+        self.assertNotIn('baseline', stats)
+
+    def test_tidy_statistics(self):
+        stats = ensemble_statistics(self.cube, self.baseline, quantiles=[0.5])
+        tidy = tidy_statistics(stats, ['Y', 'C'], [2020, 2021, 2022, 2023], labels=['GDP', 'Consumption'])
+        self.assertEqual(list(tidy.columns), ['label', 'variable', 'Year', 'statistic', 'value', 'baseline_delta'])
+        self.assertEqual(len(tidy), 2 * 4 * len(stats))
+        row = tidy[(tidy['variable'] == 'C') & (tidy['Year'] == 2022) & (tidy['statistic'] == 'mean')].iloc[0]
+        self.assertEqual(row['label'], 'Consumption')
+        self.assertAlmostEqual(row['value'], stats['mean'][1, 2])
+        self.assertAlmostEqual(row['baseline_delta'], stats['mean'][1, 2] - self.baseline[1, 2])
+        self.assertTrue(tidy.loc[tidy['statistic'] == 'std', 'baseline_delta'].isna().all())
+        self.assertEqual(quantile_name(0.5), 'q0.5')
+
+
+class TestStreamingStatistics(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.runs = rng.normal(size=(5000, 2, 3))
+        self.runs[:50, 0, 0] = np.nan
+
+    def assertRanksClose(self, estimates, quantiles, tolerance):
+        for k, q in enumerate(quantiles):
+            for i, j in np.ndindex(self.runs.shape[1:]):
+                values = self.runs[:, i, j]
+                rank = (values[~np.isnan(values)] < estimates[k, i, j]).mean()
+                self.assertLess(abs(rank - q), tolerance)
+
+    def test_welford_matches_numpy_and_merges(self):
+        whole, first, second = WelfordAccumulator((2, 3)), WelfordAccumulator((2, 3)), WelfordAccumulator((2, 3))
+        for n, values in enumerate(self.runs):
+            whole.update(values)
+            (first if n < 1234 else second).update(values)
+        first.merge(second)
+        for accumulator in [whole, first]:
+            np.testing.assert_allclose(accumulator.mean, np.nanmean(self.runs, axis=0))
+            np.testing.assert_allclose(accumulator.std, np.nanstd(self.runs, axis=0, ddof=1))
+            self.assertEqual(accumulator.count[0, 0], 4950)
+
+    def test_kll_quantiles_in_bounded_memory(self):
+        quantiles = [0.05, 0.5, 0.95]
+        whole = KLLSketch((2, 3), k=100, seed=0)
+        parts = [KLLSketch((2, 3), k=100, seed=i) for i in range(3)]
+        for n, values in enumerate(self.runs):
+            whole.update(values)
+            parts[n % 3].update(values)
+        self.assertLess(len(whole), 600)
+        self.assertRanksClose(whole.quantile(quantiles), quantiles, 0.03)
+        merged = parts[0].merge(parts[1]).merge(parts[2])
+        self.assertEqual(merged.n, len(self.runs))
+        self.assertRanksClose(merged.quantile(quantiles), quantiles, 0.03)
+        self.assertTrue(np.isnan(KLLSketch((2, 3)).quantile([0.5])).all())
+
+    def test_ensemble_accumulator(self):
+        years = [2020, 2021, 2022]
+        accumulator = EnsembleAccumulator(['Y', 'C'], years, seed=0)
+        for values in self.runs[:100]:
+            accumulator.update(pd.DataFrame({'Year': years, 'Y': values[0], 'C': values[1]}))
+        stats = accumulator.statistics(baseline=np.zeros((2, 3)), quantiles=[0.5])
+        self.assertEqual(list(stats), ['mean', 'std', 'median', 'q0.5', 'baseline'])
+        np.testing.assert_allclose(stats['mean'], np.nanmean(self.runs[:100], axis=0))
+        # Under k runs the sketch holds them all, so the median is exact: the sample value, not interpolated
+        exact = np.nanquantile(self.runs[:100], 0.5, axis=0, method='inverted_cdf')
+        np.testing.assert_allclose(stats['median'], exact)
+        with self.assertRaises(ValueError):
+            accumulator.merge(EnsembleAccumulator(['Y'], years))
+
+
+if __name__ == '__main__':
+    unittest.main()
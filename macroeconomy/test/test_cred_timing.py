@@ -0,0 +1,73 @@
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.cred_timing import PhaseTimer, timing_table, timing_summary, write_timing_report
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    def test_phases_nest_and_add_up(self):
+        timer = PhaseTimer()
+        with timer.phase('setup'):
+            with timer.phase('copy_input'):
+                time.sleep(0.01)
+            timer.record('extra', 1.0)
+        with timer.phase('setup'):
+            pass
+        self.assertEqual(list(timer.timings), ['setup', 'setup.copy_input', 'setup.extra'])
+        self.assertGreaterEqual(timer.timings['setup.copy_input'], 0.01)
+        self.assertGreaterEqual(timer.timings['setup'], timer.timings['setup.copy_input'])
+        self.assertEqual(timer.timings['setup.extra'], 1.0)
+
+    def test_failed_phases_are_still_timed(self):
+        timer = PhaseTimer()
+        with self.assertRaises(ValueError):
+            with timer.phase('execute'):
+                raise ValueError()
+        self.assertIn('execute', timer.timings)
+        with timer.phase('teardown'):
+            pass
+        self.assertIn('teardown', timer.timings)
+
+
+class TestTimingReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.table = timing_table({
+            'run_0.xlsx': {'setup': 1.0, 'setup.copy_input': 0.5, 'execute': 3.0},
+            'run_1.xlsx': {'setup': 2.0, 'execute': 4.0},
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_table_and_summary(self):
+        self.assertEqual(list(self.table.columns), ['setup', 'setup.copy_input', 'execute'])
+        self.assertTrue(np.isnan(self.table.loc['run_1.xlsx', 'setup.copy_input']))
+        summary = timing_summary(self.table)
+        self.assertEqual(summary.loc['setup.copy_input', 'n_runs'], 1)
+        self.assertEqual(summary.loc['execute', 'total'], 7.0)
+        self.assertAlmostEqual(summary.loc['setup', 'share'], 0.3)
+
+    def test_report_files(self):
+        path = write_timing_report(Path(self.tmp, 'timings.json'), self.table, {'experiment.baseline': 5.0})
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['experiment'], {'experiment.baseline': 5.0})
+        self.assertEqual(report['runs']['run_0.xlsx']['execute'], 3.0)
+        self.assertEqual(report['summary']['execute']['mean'], 3.5)
+        path = write_timing_report(Path(self.tmp, 'timings.csv'), self.table)
+        pd.testing.assert_frame_equal(pd.read_csv(path, index_col='run'), self.table)
+        with self.assertRaises(ValueError):
+            write_timing_report(Path(self.tmp, 'timings.txt'), self.table)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+import subprocess
+from pathlib import Path
+
+from macroeconomy.cred_engine import MockEngine, OctaveEngine
+from macroeconomy.cred_executor import run_cred_task
+from macroeconomy.cred_session import MatlabSession
+from macroeconomy.cred_watchdog import CREDWatchdog, CREDRunKilled
+
+from macroeconomy.test.test_cred_session import FAKE_MATLAB_COMMAND
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+SLEEP = 'import time; time.sleep(60)'
+BUSY = 'while True: pass'
+GREEDY = 'import time; x = bytearray(300 * 2**20); x[::4096] = b"x" * len(x[::4096]); time.sleep(60)'
+
+
+def python_process(code):
+    return subprocess.Popen([sys.executable, '-c', code])
+
+
+class TestCREDWatchdog(unittest.TestCase):
+
+    def test_finished_process_returns_its_code(self):
+        watchdog = CREDWatchdog(max_rss_mb=10000, stall_timeout=10, poll_interval=0.1)
+        self.assertEqual(watchdog.watch(python_process('import sys; sys.exit(3)')), 3)
+
+    def test_stalled_process_is_killed(self):
+        process = python_process(SLEEP)
+        with self.assertRaises(CREDRunKilled) as context:
+            CREDWatchdog(stall_timeout=0.5, poll_interval=0.1).watch(process)
+        self.assertEqual(context.exception.reason, 'stall')
+        self.assertIsNotNone(process.poll())
+
+    def test_busy_process_is_not_a_stall(self):
+        process = python_process(BUSY)
+        with self.assertRaises(CREDRunKilled) as context:
+            CREDWatchdog(stall_timeout=0.5, min_cpu_seconds=0.1, poll_interval=0.1).watch(process, timeout=1.5)
+        self.assertEqual(context.exception.reason, 'timeout')
+
+    def test_memory_hog_is_killed(self):
+        process = python_process(GREEDY)
+        with self.assertRaises(CREDRunKilled) as context:
+            CREDWatchdog(max_rss_mb=100, poll_interval=0.1).watch(process, timeout=30)
+        self.assertEqual(context.exception.reason, 'memory')
+
+    def test_hung_session_is_killed_and_discarded(self):
+        session = MatlabSession(FAKE_MATLAB_COMMAND)
+        with self.assertRaises(CREDRunKilled) as context:
+            session.run('pause(60);', watchdog=CREDWatchdog(stall_timeout=0.5, poll_interval=0.1))
+        self.assertEqual(context.exception.reason, 'stall')
+        self.assertFalse(session.is_alive())
+
+    def test_kill_reason_is_recorded_in_the_run_result(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            cred_location = MockEngine.make_model_directory(Path(tmp, 'CRED'), TESTDATA_INPUT)
+            # An 'Octave' that hangs without doing anything
+            executable = Path(tmp, 'octave')
+            executable.write_text(f'#!/bin/sh\nexec {sys.executable} -c "{SLEEP}"\n')
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            cred_kwargs = {
+                'cred_location': cred_location,
+                'engine': OctaveEngine(executable),
+                'watchdog': CREDWatchdog(stall_timeout=0.5, poll_interval=0.1)
+            }
+            result = run_cred_task(cred_kwargs, TESTDATA_INPUT, Path(tmp, 'output.xlsx'), ['Scenario'])
+            self.assertEqual(result.status, 'failed')
+            self.assertEqual(result.kill_reason, 'stall')
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
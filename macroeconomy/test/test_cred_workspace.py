@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from macroeconomy.cred_workspace import CREDWorkspace, CREDWorkspacePool
+
+
+class TestCREDWorkspace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = Path(self.tmp, 'CRED')
+        for rel_path in [
+            'RunSimulations.m',
+            'DGE_CRED_Model.mod',
+            'Functions/Simulation_Model.m',
+            'Functions/Helper.m',
+            'ExcelFiles/ModelSimulationandCalibration5Sectorsand1Regions.xlsx',
+            'DGE_CRED_Model.log',
+            '+DGE_CRED_Model/driver.m',
+        ]:
+            path = Path(self.source, rel_path)
+            os.makedirs(path.parent, exist_ok=True)
+            path.write_text(f'original {rel_path}')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_workspace_links_immutable_files_and_copies_private_ones(self):
+        with CREDWorkspace(self.source, scratch_dir=self.tmp) as workspace:
+            helper = Path(workspace.path, 'Functions/Helper.m')
+            self.assertTrue(os.path.samefile(helper, Path(self.source, 'Functions/Helper.m')))
+            for rel_path in ['RunSimulations.m', 'DGE_CRED_Model.mod', 'Functions/Simulation_Model.m',
+                             'ExcelFiles/ModelSimulationandCalibration5Sectorsand1Regions.xlsx']:
+                private = Path(workspace.path, rel_path)
+                self.assertFalse(os.path.samefile(private, Path(self.source, rel_path)))
+                private.write_text('edited')
+                self.assertEqual(Path(self.source, rel_path).read_text(), f'original {rel_path}')
+            # Dynare output from earlier runs is not carried over
+            self.assertFalse(os.path.exists(Path(workspace.path, 'DGE_CRED_Model.log')))
+            self.assertFalse(os.path.exists(Path(workspace.path, '+DGE_CRED_Model')))
+            path = workspace.path
+        self.assertFalse(os.path.exists(path))
+
+    def test_workspace_symlinks(self):
+        with CREDWorkspace(self.source, scratch_dir=self.tmp, link_mode='symlink') as workspace:
+            self.assertTrue(os.path.islink(Path(workspace.path, 'Functions/Helper.m')))
+            self.assertFalse(os.path.islink(Path(workspace.path, 'RunSimulations.m')))
+
+    def test_workspace_validates_arguments(self):
+        with self.assertRaises(ValueError):
+            CREDWorkspace(Path(self.tmp, 'missing'))
+        with self.assertRaises(ValueError):
+            CREDWorkspace(self.source, link_mode='teleport')
+
+    def test_workspace_pool_gives_each_run_its_own_directory(self):
+        with CREDWorkspacePool(n_workspaces=2, source_dir=self.source, scratch_dir=self.tmp) as pool:
+            with pool.workspace() as ws1, pool.workspace() as ws2:
+                self.assertNotEqual(ws1.path, ws2.path)
+            with pool.workspace() as ws3:
+                self.assertIn(ws3.path, [ws1.path, ws2.path])
+
+
+if __name__ == '__main__':
+    unittest.main()
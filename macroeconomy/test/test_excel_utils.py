@@ -0,0 +1,137 @@
+import io
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+import openpyxl
+import pandas as pd
+from pathlib import Path
+
+from macroeconomy.excel_utils import truncate_workbook, sheet_parts, WorkbookIndex, _truncate_sheet_xml, _count_sheet_rows
+
+TESTDATA_DIR = Path(os.path.dirname(__file__), 'data')
+TESTDATA_INPUT = Path(TESTDATA_DIR, 'test_input_excel.xlsx')
+
+
+class TestTruncateWorkbook(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.workbook = Path(self.tmp, 'input.xlsx')
+        shutil.copy2(TESTDATA_INPUT, self.workbook)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_only_the_named_sheets_are_truncated(self):
+        truncate_workbook(self.workbook, self.workbook, ['Baseline', 'Scenario'], 1)
+        original = pd.read_excel(TESTDATA_INPUT, sheet_name=None)
+        truncated = pd.read_excel(self.workbook, sheet_name=None)
+        self.assertEqual(list(truncated), list(original))
+        for name, df in original.items():
+            expected = df.iloc[0:1] if name in ['Baseline', 'Scenario'] else df
+            # Columns that are whole numbers in the rows that are left are read back as integers
+            pd.testing.assert_frame_equal(truncated[name], expected, check_dtype=False)
+
+        # Still a valid workbook, without the calculation chain
+        self.assertEqual(openpyxl.load_workbook(self.workbook)['Scenario'].dimensions, 'A1:AH2')
+        with zipfile.ZipFile(self.workbook) as zf:
+            self.assertNotIn('xl/calcChain.xml', zf.namelist())
+            self.assertNotIn(b'calcChain', zf.read('[Content_Types].xml'))
+            # Parts we don't touch are copied exactly
+            with zipfile.ZipFile(TESTDATA_INPUT) as original_zf:
+                self.assertEqual(zf.read('xl/sharedStrings.xml'), original_zf.read('xl/sharedStrings.xml'))
+
+    def test_problems_leave_the_output_alone(self):
+        output = Path(self.tmp, 'output.xlsx')
+        with self.assertRaises(ValueError):
+            truncate_workbook(self.workbook, output, ['Scenario'], 10)
+        with self.assertRaises(ValueError):
+            truncate_workbook(self.workbook, output, ['No such sheet'], 1)
+        self.assertEqual(os.listdir(self.tmp), ['input.xlsx'])
+
+    def test_tags_split_across_chunks(self):
+        with zipfile.ZipFile(TESTDATA_INPUT) as zf:
+            xml = zf.read(sheet_parts(zf)['Scenario'])
+        expected = io.BytesIO()
+        _truncate_sheet_xml(io.BytesIO(xml), expected, 1)
+        for chunk_size in [1, 7, 64]:
+            out = io.BytesIO()
+            self.assertEqual(_truncate_sheet_xml(io.BytesIO(xml), out, 1, chunk_size=chunk_size), 2)
+            self.assertEqual(out.getvalue(), expected.getvalue())
+
+    def test_rows_with_only_formatting_are_not_data(self):
+        # A trailing row that was formatted but never filled in, as Excel leaves behind
+        xml = b'<sheetData><row r="1"><c r="A1"><v>1</v></c></row><row r="2"><c r="A2"><v>2</v></c></row><row r="3" spans="1:1"><c r="A3" s="1"/></row></sheetData>'
+        self.assertEqual(_truncate_sheet_xml(io.BytesIO(xml), io.BytesIO(), 2), 1)
+        self.assertEqual(_truncate_sheet_xml(io.BytesIO(xml), io.BytesIO(), 2), _count_sheet_rows(io.BytesIO(xml)))
+        # so a workbook whose last row is like that is too short to truncate to it
+        workbook = openpyxl.load_workbook(self.workbook)
+        sheet = workbook['Scenario']
+        n_rows = sheet.max_row - 1
+        sheet.cell(row=sheet.max_row + 1, column=1).number_format = '0.00'
+        workbook.save(self.workbook)
+        self.assertEqual(WorkbookIndex.get(self.workbook).n_rows('Scenario'), n_rows)
+        with self.assertRaises(ValueError):
+            truncate_workbook(self.workbook, Path(self.tmp, 'output.xlsx'), ['Scenario'], n_rows + 1)
+        truncate_workbook(self.workbook, Path(self.tmp, 'output.xlsx'), ['Scenario'], n_rows)
+
+
+
+class TestWorkbookIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.workbook = Path(self.tmp, 'input.xlsx')
+        shutil.copy2(TESTDATA_INPUT, self.workbook)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_index_matches_pandas(self):
+        index = WorkbookIndex.get(self.workbook)
+        sheets = pd.read_excel(self.workbook, sheet_name=None)
+        self.assertEqual(index.sheet_names, list(sheets))
+        for name, df in sheets.items():
+            self.assertEqual(index.n_rows(name), df.shape[0])
+            self.assertEqual(index.columns(name), list(df.columns))
+        pd.testing.assert_frame_equal(index.sheet('Content'), sheets['Content'])
+        with self.assertRaises(ValueError):
+            index.n_rows('No such sheet')
+
+    def test_index_is_shared_until_the_workbook_changes(self):
+        index = WorkbookIndex.get(self.workbook)
+        self.assertIs(WorkbookIndex.get(self.workbook), index)
+        truncate_workbook(self.workbook, self.workbook, ['Scenario'], 1)
+        self.assertEqual(WorkbookIndex.get(self.workbook).n_rows('Scenario'), 1)
+
+    def test_registry_keeps_the_most_recently_used(self):
+        WorkbookIndex.clear()
+        index = WorkbookIndex.get(self.workbook)
+        for i in range(WorkbookIndex.REGISTRY_SIZE):
+            workbook = Path(self.tmp, f'input_{i}.xlsx')
+            shutil.copy2(TESTDATA_INPUT, workbook)
+            WorkbookIndex.get(workbook)
+            if i == 0:
+                # Using the first workbook again keeps it in the registry
+                self.assertIs(WorkbookIndex.get(self.workbook), index)
+        self.assertEqual(len(WorkbookIndex._registry), WorkbookIndex.REGISTRY_SIZE)
+        self.assertIs(WorkbookIndex.get(self.workbook), index)
+        # The least recently used went instead
+        indexed = [path for path, _, _ in WorkbookIndex._registry]
+        self.assertNotIn(os.path.realpath(Path(self.tmp, 'input_0.xlsx')), indexed)
+        WorkbookIndex.clear()
+
+    def test_row_count_with_tags_split_across_chunks(self):
+        with zipfile.ZipFile(TESTDATA_INPUT) as zf:
+            xml = zf.read(sheet_parts(zf)['Structural Parameters'])
+        for chunk_size in [1, 7, 64]:
+            self.assertEqual(_count_sheet_rows(io.BytesIO(xml), chunk_size=chunk_size), 88)
+        # Rows with formatting but no values aren't data
+        empty_rows = b'<sheetData><row r="1"><c r="A1"><v>1</v></c></row><row r="2"><c r="A2"><v>2</v></c></row><row r="3"><c r="A3" s="1"/></row></sheetData>'
+        self.assertEqual(_count_sheet_rows(io.BytesIO(empty_rows)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import pstats
+import shutil
+import tempfile
+import unittest
+import subprocess
+from pathlib import Path
+
+from macroeconomy.profiling import profiling as profiling_session, profiled, profile_stage, profiling_enabled, PROFILE_ENV_VAR
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+@profiled('inner')
+def inner(n):
+    return busy(n)
+
+
+@profiled('outer')
+def outer(n):
+    return busy(n) + inner(n)
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_off_by_default(self):
+        self.assertFalse(profiling_enabled())
+        self.assertEqual(outer(10), 2 * busy(10))
+        with profile_stage('unused'):
+            pass
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_stages_are_profiled_separately(self):
+        with profiling_session(self.tmp) as session:
+            self.assertTrue(profiling_enabled())
+            for _ in range(3):
+                outer(20000)
+            with profile_stage('block'):
+                busy(1000)
+        self.assertFalse(profiling_enabled())
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['block.prof', 'inner.prof', 'outer.prof', 'summary.txt'])
+
+        summary = session.stage_summary()
+        self.assertEqual(summary.loc['outer', 'calls'], 3)
+        self.assertEqual(summary.loc['inner', 'calls'], 3)
+        # The outer stage's wall time includes the inner stage, its profile doesn't
+        self.assertGreater(summary.loc['outer', 'wall_time'], summary.loc['inner', 'wall_time'])
+        outer_functions = {func[2] for func in pstats.Stats(str(Path(self.tmp, 'outer.prof'))).stats}
+        self.assertNotIn('inner', outer_functions)
+        self.assertIn('busy', {func[2] for func in pstats.Stats(str(Path(self.tmp, 'inner.prof'))).stats})
+        self.assertIn('busy', Path(self.tmp, 'summary.txt').read_text())
+        self.assertTrue(session.hot_functions(5)['function'].str.contains('genexpr|busy').any())
+
+    def test_environment_variable(self):
+        output_dir = Path(self.tmp, 'profiles')
+        code = 'from macroeconomy.test.test_profiling import outer; outer(1000)'
+        env = dict(os.environ, **{PROFILE_ENV_VAR: str(output_dir)})
+        subprocess.run([sys.executable, '-c', code], env=env, check=True, cwd=Path(__file__).parents[2])
+        self.assertIn('outer.prof', os.listdir(output_dir))
+        self.assertIn('summary.txt', os.listdir(output_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@ from macroeconomy.unu_era.data_unu.entity import ENTITY_CODES, get_unu_entity, g
 from macroeconomy.unu_era.data_unu.hazard import get_unu_heatwave_hazard, get_unu_flood_hazard, get_unu_drought_hazard
 from macroeconomy.unu_era.data_unu.impact_functions import get_unu_heatwave_impfset_agriculture_labour, get_unu_heatwave_impfset_manufacturing_labour, get_unu_heatwave_impfset_tourism_labour, get_unu_heatwave_impfset_energy_labour, get_unu_heatwave_impfset_services_labour
 from macroeconomy.unu_era.interpolation import interpolate_ev
+from macroeconomy.profiling import profiled
 
 
 # This is your one-stop shop for all impact data used in the UNU ERA calculations
@@ -137,6 +138,7 @@ def get_impact_yearset(hazard_type, exposure_type, impact_type, country, climate
         return create_yearset(imp, n_sim_years, seed)
     return yearset_from_rp(imp, n_sim_years, seed)
 
+@profiled()
 def get_impact(hazard_type, exposure_type, impact_type, country, climate_scenario, normalise):
     haz = get_hazard(hazard_type, country, climate_scenario)
     exp = get_exposure(exposure_type, country, hazard_type)
@@ -164,6 +166,7 @@ def scale_impf_set(impf_set, scale):
     return ImpactFuncSet(out)
 
 
+@profiled()
 def create_yearset(imp, n_sim_years, seed=None):
     if len(np.unique(imp.frequency)) == 1:   # Annual-ish event data
         return yearset_from_imp(imp, n_sim_years, seed=seed)
@@ -10,7 +10,8 @@ from climada.engine import Impact
 from nccs.pipeline.direct.calc_yearset import combine_yearsets, cap_impact
 
 from macroeconomy.unu_era import base
-from macroeconomy.cred_input import CREDInput
+from macroeconomy.cred_input import CREDInput, CREDInputTemplate
+from macroeconomy.profiling import profiled
 from macroeconomy.unu_era.base import HAZARD_TYPES, HAZ_EXPOSURE_IMPACTS
 
 LOGGER = logging.getLogger(__name__)
@@ -70,6 +71,7 @@ CRED_TEMPLATE = {
 
 
 # TODO refactor: one method to create impacts, one to load
+@profiled()
 def get_cred_impacts(
     country: str,
     climate_scenario: str,
@@ -131,7 +133,8 @@ def get_cred_impacts(
 def generate_cred_input(country, climate_scenario, haz_type_list, n_sim_years=None, measures=None, output_path=None, impacts_directory=None, write_files=True, seed=None):
     cred_template = CRED_TEMPLATE[country]
     scenario = 'Scenario'
-    cred_input = CREDInput(cred_template, scenarios=[scenario])
+    # The template's Baseline and sectors are parsed once and shared across an ensemble's inputs
+    cred_input = CREDInput(cred_template, scenarios=[scenario], template=CREDInputTemplate.get(cred_template))
 
     if n_sim_years:
         cred_input.truncate_to_n_years(n_sim_years)  # 2014 to 2050   # TODO make this more easily user-accessible
@@ -0,0 +1,358 @@
+# Benchmarks for the CLIMADA side of generating CRED inputs: calculating impacts, sampling yearsets from them
+# and combining them into a CRED input, with synthetic hazards, exposures and impact functions of any size.
+#
+# Not a unittest: this takes a while, and needs CLIMADA and the NCCS pipeline (see requirements/unu_calculations.yml).
+# Run it as a script, e.g.
+#   python -m macroeconomy.unu_era.test.benchmark_impacts --centroids 100 1000 10000 --output impacts.json
+#
+# Unlike build_all_possible_impacts.py it needs no project data. While benchmarking, base.get_hazard, get_exposure
+# and get_impact_funcset are swapped for generators of synthetic data (see synthetic_data), and a 'synthetic'
+# country is added with every sector of a CRED template (by default the test input) exposed to every hazard:
+# - flood and drought are return period hazards, one band per return period like the UNU rasters, so
+#   create_yearset samples them with yearset_from_rp
+# - heatwave is an event set with equal frequencies, so create_yearset samples it with yearset_from_imp
+# Hazards, exposures and impact functions are generated once per size and cached, like the real data sources,
+# so the timings are of the pipeline and not of the generators.
+#
+# It reports scaling curves, the median of --repeat timings at each size, for:
+# - base.get_impact against centroids (both kinds of hazard) and events (event sets)
+# - create_yearset against events and samples (simulated years), and yearset_from_rp against samples
+# - combine_yearsets_without_imp_mat against samples
+# - generate_cred_input, end to end including writing the input, against centroids and events
+# with the slope of each curve on log-log axes: 1 is linear scaling.
+#
+# Everything is generated from --seed, so runs of the benchmark are comparable over time.
+
+import os
+import json
+import time
+import zlib
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from contextlib import contextmanager
+from importlib import metadata
+from scipy import sparse
+from climada.hazard import Hazard, Centroids
+from climada.entity import Exposures, ImpactFunc, ImpactFuncSet
+
+from macroeconomy.unu_era import base, generate_cred_inputs
+from macroeconomy.unu_era.generate_cred_inputs import generate_cred_input, combine_yearsets_without_imp_mat
+from macroeconomy.cred_input import CREDInputTemplate
+
+TESTDATA_INPUT = Path(os.path.dirname(__file__), '..', '..', 'test', 'data', 'test_input_excel.xlsx').resolve()
+
+COUNTRY = 'synthetic'
+CLIMATE_SCENARIO = 'rcp85'
+
+# hazard type: (CLIMADA hazard type, kind, units, typical maximum intensity)
+HAZARDS = {
+    'flood': ('FL', 'return period', 'm', 5.0),
+    'drought': ('DR', 'return period', '', 3.0),
+    'heatwave': ('HW', 'events', 'degC', 10.0),
+}
+RETURN_PERIODS = [2, 5, 10, 25, 50, 100, 250, 500]
+EVENT_DENSITY = 0.05        # Share of centroids hit by each event in an event set
+
+# Hazards get more intense in the future
+SCENARIO_INTENSITY = {'historical': 1.0, 'rcp26': 1.1, 'rcp85': 1.25}
+
+# Impact functions reach 63% damage at this multiple of the hazard's typical maximum intensity
+IMPACT_TYPE_SCALE = {'asset loss': 1.0, 'capital productivity': 2.0, 'labour productivity': 1.5}
+
+# Centroids are scattered over this box (min lat, max lat, min lon, max lon)
+BOUNDS = (5.0, 20.0, 97.0, 106.0)
+
+DEFAULT_CENTROIDS = [100, 1000, 10000, 100000]
+DEFAULT_END_TO_END_CENTROIDS = [100, 1000, 10000]
+DEFAULT_EVENTS = [10, 100, 1000, 10000]
+DEFAULT_SAMPLES = [10, 100, 1000, 10000]
+BENCHMARKS = ['get_impact', 'create_yearset', 'yearset_from_rp', 'combine_yearsets', 'generate_cred_input']
+
+
+def _rng(seed, *names):
+    # A generator for one piece of synthetic data, the same whatever else is generated
+    return np.random.default_rng([seed] + [zlib.crc32(str(name).encode()) for name in names])
+
+
+class SyntheticData():
+    # Synthetic hazards, exposures and impact function sets with the signatures of base.get_hazard,
+    # get_exposure and get_impact_funcset. Each is generated on first request and cached. Every hazard
+    # uses the same n_centroids centroids, and every exposure has a point at each of them
+
+    def __init__(self, n_centroids, n_events, seed=0, return_periods=RETURN_PERIODS, event_density=EVENT_DENSITY):
+        self.n_centroids = n_centroids
+        self.n_events = n_events
+        self.seed = seed
+        self.return_periods = np.array(return_periods)
+        self.event_density = event_density
+        rng = _rng(seed, 'centroids')
+        self.lat = rng.uniform(BOUNDS[0], BOUNDS[1], n_centroids)
+        self.lon = rng.uniform(BOUNDS[2], BOUNDS[3], n_centroids)
+        self.centroids = Centroids(lat=self.lat, lon=self.lon)
+        self._hazards = {}
+        self._exposures = {}
+        self._impf_sets = {}
+
+    def get_hazard(self, hazard_type, country, climate_scenario):
+        key = (hazard_type, climate_scenario)
+        if key not in self._hazards:
+            self._hazards[key] = self._make_hazard(hazard_type, climate_scenario)
+        return self._hazards[key]
+
+    def _make_hazard(self, hazard_type, climate_scenario):
+        if hazard_type not in HAZARDS:
+            raise ValueError(f'No synthetic hazard of type {hazard_type}. Choose from {list(HAZARDS)}')
+        if climate_scenario not in SCENARIO_INTENSITY:
+            raise ValueError(f'Unexpected climate_scenario {climate_scenario}. Choose from {list(SCENARIO_INTENSITY)}')
+        haz_type, kind, units, max_intensity = HAZARDS[hazard_type]
+        rng = _rng(self.seed, 'hazard', hazard_type, climate_scenario)
+        max_intensity = max_intensity * SCENARIO_INTENSITY[climate_scenario]
+
+        if kind == 'return period':
+            # One band per return period: every centroid is hit, harder at longer return periods
+            susceptibility = rng.uniform(0.05, 1, self.n_centroids)
+            severity = np.log(self.return_periods) / np.log(self.return_periods.max())
+            intensity = sparse.csr_matrix(max_intensity * np.outer(severity, susceptibility))
+            frequency = 1 / self.return_periods
+        else:
+            # Events hit a random share of the centroids. On average one event a year
+            intensity = sparse.random(
+                self.n_events, self.n_centroids, density=self.event_density, format='csr', random_state=rng,
+                data_rvs=lambda n: rng.uniform(0, max_intensity, n)
+            )
+            frequency = np.full(self.n_events, 1 / self.n_events)
+
+        n_events = intensity.shape[0]
+        return Hazard(
+            haz_type=haz_type,
+            units=units,
+            centroids=self.centroids,
+            event_id=np.arange(1, n_events + 1),
+            event_name=[f'{hazard_type}_{i}' for i in range(n_events)],
+            date=np.full(n_events, pd.Timestamp('2000-01-01').toordinal()),
+            frequency=frequency,
+            intensity=intensity
+        )
+
+    def get_exposure(self, exposure_type, country, hazard_name):
+        if exposure_type not in self._exposures:
+            rng = _rng(self.seed, 'exposure', exposure_type)
+            df = pd.DataFrame({
+                'latitude': self.lat,
+                'longitude': self.lon,
+                'value': rng.lognormal(0, 1, self.n_centroids),
+            })
+            for haz_type, _, _, _ in HAZARDS.values():
+                df[f'impf_{haz_type}'] = 1
+            self._exposures[exposure_type] = Exposures(df, value_unit='USD')
+        # get_impact normalises the values in place, so each call gets its own copy
+        return self._exposures[exposure_type].copy(deep=True)
+
+    def get_impact_funcset(self, hazard_type, exposure_type, impact_type, country):
+        key = (hazard_type, impact_type)
+        if key not in self._impf_sets:
+            haz_type, _, units, max_intensity = HAZARDS[hazard_type]
+            intensity = np.linspace(0, 1.5 * max_intensity * max(SCENARIO_INTENSITY.values()), 20)
+            impf = ImpactFunc(
+                haz_type=haz_type,
+                id=1,
+                intensity=intensity,
+                mdd=1 - np.exp(-intensity / (max_intensity * IMPACT_TYPE_SCALE[impact_type])),
+                paa=np.ones_like(intensity),
+                intensity_unit=units,
+                name=f'Synthetic {hazard_type} {impact_type}'
+            )
+            self._impf_sets[key] = ImpactFuncSet([impf])
+        return self._impf_sets[key]
+
+
+@contextmanager
+def synthetic_data(n_centroids, n_events, cred_template=TESTDATA_INPUT, seed=0, hazards=tuple(HAZARDS)):
+    # Run the impact pipeline on synthetic data in this context. Adds the synthetic country, with every
+    # sector of cred_template exposed to every hazard, and puts everything back afterwards
+    data = SyntheticData(n_centroids, n_events, seed=seed)
+    sectors = [s.lower() for s in CREDInputTemplate.get(cred_template).sectors]
+    exposure_impacts = [('housing', 'asset loss')] + [(s, i) for s in sectors for i in IMPACT_TYPE_SCALE]
+    providers = ['get_hazard', 'get_exposure', 'get_impact_funcset']
+    original = {name: getattr(base, name) for name in providers}
+
+    base.HAZ_EXPOSURE_IMPACTS[COUNTRY] = {hazard: exposure_impacts for hazard in hazards}
+    generate_cred_inputs.CRED_TEMPLATE[COUNTRY] = str(cred_template)
+    for name in providers:
+        setattr(base, name, getattr(data, name))
+    try:
+        yield data
+    finally:
+        for name, provider in original.items():
+            setattr(base, name, provider)
+        base.HAZ_EXPOSURE_IMPACTS.pop(COUNTRY, None)
+        generate_cred_inputs.CRED_TEMPLATE.pop(COUNTRY, None)
+
+
+def get_impact(hazard_type, climate_scenario='historical'):
+    return base.get_impact(hazard_type, 'agriculture', 'asset loss', COUNTRY, climate_scenario, normalise=True)
+
+
+def median_time(f, *args, repeat=3, **kwargs):
+    # Median seconds over repeat calls, after one call to warm the caches
+    f(*args, **kwargs)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+class Benchmark():
+    # Collects timings as rows of (benchmark, parameter, size, seconds), so each (benchmark, parameter)
+    # is one scaling curve
+
+    def __init__(self, args):
+        self.args = args
+        self.rows = []
+
+    def time(self, benchmark, parameter, size, f, *f_args, **f_kwargs):
+        seconds = median_time(f, *f_args, repeat=self.args.repeat, **f_kwargs)
+        print(f'{benchmark} with {size} {parameter}: {seconds:.4g}s', flush=True)
+        self.rows.append({'benchmark': benchmark, 'parameter': parameter, 'size': size, 'seconds': seconds})
+
+    def synthetic_data(self, n_centroids=None, n_events=None):
+        return synthetic_data(
+            n_centroids or self.args.fixed_centroids,
+            n_events or self.args.fixed_events,
+            cred_template=self.args.cred_template,
+            seed=self.args.seed
+        )
+
+    def get_impact(self):
+        for n in self.args.centroids:
+            with self.synthetic_data(n_centroids=n):
+                for hazard_type in ['flood', 'heatwave']:
+                    self.time(f'get_impact[{hazard_type}]', 'centroids', n, get_impact, hazard_type)
+        for n in self.args.events:
+            with self.synthetic_data(n_events=n):
+                self.time('get_impact[heatwave]', 'events', n, get_impact, 'heatwave')
+
+    def create_yearset(self):
+        seed, fixed_samples = self.args.seed, self.args.fixed_samples
+        for n in self.args.events:
+            with self.synthetic_data(n_events=n):
+                imp = get_impact('heatwave')
+                self.time('create_yearset[heatwave]', 'events', n, base.create_yearset, imp, fixed_samples, seed)
+        with self.synthetic_data():
+            imp = get_impact('heatwave')
+            for n in self.args.samples:
+                self.time('create_yearset[heatwave]', 'samples', n, base.create_yearset, imp, n, seed)
+
+    def yearset_from_rp(self):
+        with self.synthetic_data():
+            imp = get_impact('flood')
+            for n in self.args.samples:
+                self.time('yearset_from_rp[flood]', 'samples', n, base.yearset_from_rp, imp, n, self.args.seed)
+
+    def combine_yearsets(self):
+        with self.synthetic_data():
+            impacts = [get_impact(hazard_type) for hazard_type in HAZARDS]
+            for n in self.args.samples:
+                yearsets = [base.create_yearset(imp, n, self.args.seed) for imp in impacts]
+                self.time('combine_yearsets_without_imp_mat', 'samples', n, combine_yearsets_without_imp_mat, yearsets, cap_exposure=1)
+
+    def generate_cred_input(self):
+        output_dir = Path(tempfile.mkdtemp(prefix='cred_impact_benchmark_'))
+        kwargs = {'haz_type_list': list(HAZARDS), 'output_path': Path(output_dir, 'input.xlsx'), 'seed': self.args.seed}
+        try:
+            for n in self.args.end_to_end_centroids:
+                with self.synthetic_data(n_centroids=n):
+                    self.time('generate_cred_input', 'centroids', n, generate_cred_input, COUNTRY, CLIMATE_SCENARIO, **kwargs)
+            for n in self.args.events:
+                with self.synthetic_data(n_events=n):
+                    self.time('generate_cred_input', 'events', n, generate_cred_input, COUNTRY, CLIMATE_SCENARIO, **kwargs)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def table(self):
+        return pd.DataFrame(self.rows, columns=['benchmark', 'parameter', 'size', 'seconds'])
+
+
+def scaling_exponents(table):
+    # The slope of each curve on log-log axes: how time grows with size. 1 is linear, 2 quadratic
+    def slope(curve):
+        if len(curve) < 2:
+            return np.nan
+        return np.polyfit(np.log(curve['size']), np.log(curve['seconds']), 1)[0]
+    exponents = table.groupby(['benchmark', 'parameter'], sort=False).apply(slope, include_groups=False)
+    return exponents.rename('exponent').reset_index()
+
+
+def environment():
+    def version(package):
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return None
+
+    return {
+        'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'climada': version('climada'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CLIMADA impact pipeline on synthetic data')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--centroids', type=int, nargs='+', default=DEFAULT_CENTROIDS, help='Numbers of centroids for the get_impact curves')
+    parser.add_argument('--end-to-end-centroids', type=int, nargs='+', default=DEFAULT_END_TO_END_CENTROIDS, help='Numbers of centroids for the generate_cred_input curve')
+    parser.add_argument('--events', type=int, nargs='+', default=DEFAULT_EVENTS, help='Numbers of events in the event set hazard')
+    parser.add_argument('--samples', type=int, nargs='+', default=DEFAULT_SAMPLES, help='Numbers of years to sample in yearsets')
+    parser.add_argument('--fixed-centroids', type=int, default=1000, help='Number of centroids when varying something else')
+    parser.add_argument('--fixed-events', type=int, default=100, help='Number of events when varying something else')
+    parser.add_argument('--fixed-samples', type=int, default=100, help='Number of sampled years when varying something else')
+    parser.add_argument('--cred-template', default=str(TESTDATA_INPUT), help='CRED input to use as the template for generate_cred_input')
+    parser.add_argument('--repeat', type=int, default=3, help='Time each call this many times and report the median')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    # generate_cred_inputs logs every impact it calculates to stdout
+    generate_cred_inputs.LOGGER.setLevel(logging.WARNING)
+
+    benchmark = Benchmark(args)
+    for name in args.benchmarks:
+        print(f'Benchmarking {name}...', flush=True)
+        getattr(benchmark, name)()
+
+    table = benchmark.table()
+    exponents = scaling_exponents(table)
+    with pd.option_context('display.float_format', '{:.4g}'.format):
+        for (name, parameter), curve in table.groupby(['benchmark', 'parameter'], sort=False):
+            print(f'\n{name} against {parameter}')
+            print(curve[['size', 'seconds']].to_string(index=False))
+        print('\nScaling exponents (slope on log-log axes)')
+        print(exponents.to_string(index=False))
+    if args.output:
+        report = {
+            'environment': environment(),
+            'settings': vars(args),
+            'results': table.to_dict(orient='records'),
+            'scaling_exponents': exponents.to_dict(orient='records'),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return table
+
+
+if __name__ == '__main__':
+    main()